@@ -1 +1,2 @@
 from .sed import Sed, SedException
+from .sed import regexp_cache_info, regexp_cache_clear, set_regexp_cache_size
@@ -0,0 +1,380 @@
+"""
+Linear-time regexp engine: simulation of a Thompson NFA (Pike VM) compiled
+from the parse of a python regexp.
+
+Threads are run in lockstep over the string, in the priority order of the
+backtracking engine of re, so that matches and groups are the ones re gives.
+The time of a search is O(len(string) * len(program)) whatever the pattern,
+at the price of a constant factor compared to re. Patterns with
+backreferences, lookarounds, atomic groups or possessive repeats cannot be
+run by an NFA and raise NFAError.
+"""
+
+try:
+    from re import _parser as sre_parse
+    from re import _compiler as sre_compile
+except ImportError:
+    import sre_parse
+    import sre_compile
+
+
+# limit of the number of instructions, repeats with bounds are expanded
+MAX_PROGRAM_SIZE = 10000
+
+# instructions, stored as tuples whose first item is the opcode
+CHAR = 0        # (CHAR, test, item, flags): consume a character for which
+                # test is true, item is its parse
+SPLIT = 1       # (SPLIT, pc1, pc2): continue at pc1, then at pc2
+JMP = 2         # (JMP, pc)
+SAVE = 3        # (SAVE, slot): store the position in a capture slot
+ASSERT = 4      # (ASSERT, test): continue if test(string, position)
+MARK = 5        # (MARK, slot): store the position where an iteration starts
+UNTIL = 6       # (UNTIL, slot, loop, tail): as re, stop after an empty iteration
+MATCH = 7
+
+
+class NFAError(Exception):
+    pass
+
+
+class NFAPattern:
+    """Compiled pattern with the subset of the interface of re patterns
+    used by sed: search, match, finditer, groups, pattern and flags.
+    """
+
+    __slots__ = ('pattern', 'flags', 'groups', 'program', 'nslots', 'marks',
+                 'first')
+
+    def __init__(self, pattern, flags=0):
+        parsed = sre_parse.parse(pattern, flags)
+        self.pattern = pattern
+        self.flags = parsed.state.flags
+        self.groups = parsed.state.groups - 1
+        compiler = Compiler(2 * (self.groups + 1))
+        compiler.emit((SAVE, 0))
+        compiler.compile(parsed, parsed.state.flags)
+        compiler.emit((SAVE, 1))
+        compiler.emit((MATCH,))
+        self.program = compiler.program
+        self.nslots = compiler.nslots
+        self.marks = tuple(range(2 * (self.groups + 1), compiler.nslots))
+        self.first = first_pattern(self.program)
+
+    def search(self, string, pos=0):
+        return self.run(string, pos, False, False)
+
+    def match(self, string, pos=0):
+        return self.run(string, pos, True, False)
+
+    def finditer(self, string, pos=0):
+        # as re, after an empty match the next one is searched at the same
+        # position but must not be empty
+        must_advance = False
+        while pos <= len(string):
+            m = self.run(string, pos, False, must_advance)
+            if m is None:
+                return
+            yield m
+            pos = m.end()
+            must_advance = m.start() == pos
+
+    def run(self, string, pos, anchored, must_advance):
+        # when no thread is alive, the search resumes at the next character
+        # which may start a match, found by re
+        program = self.program
+        marks = self.marks
+        first = None if anchored else self.first
+        length = len(string)
+        start_slots = (-1,) * self.nslots
+        matched = None
+
+        index = pos
+        if first is not None:
+            m = first.search(string, index)
+            if m is None:
+                return None
+            index = m.start()
+        threads = []
+        add_thread(program, marks, threads, set(), 0, start_slots, string, index)
+        while True:
+            next_threads = []
+            visited = set()
+            char = string[index] if index < length else None
+            for pc, slots in threads:
+                instruction = program[pc]
+                if instruction[0] == MATCH:
+                    if must_advance and slots[0] == index == pos:
+                        continue
+                    # threads of lower priority are dropped
+                    matched = slots
+                    break
+                if char is not None and instruction[1](char):
+                    add_thread(program, marks, next_threads, visited, pc + 1,
+                               slots, string, index + 1)
+            if index >= length:
+                break
+            index += 1
+            if matched is None and not anchored:
+                if not next_threads and first is not None:
+                    m = first.search(string, index)
+                    if m is None:
+                        break
+                    index = m.start()
+                add_thread(program, marks, next_threads, visited, 0,
+                           start_slots, string, index)
+            elif not next_threads:
+                break
+            threads = next_threads
+
+        if matched is None:
+            return None
+        return NFAMatch(self, string, matched)
+
+
+def add_thread(program, marks, threads, visited, pc, slots, string, index):
+    # follow the instructions which do not consume characters, in priority
+    # order, and append the threads stopping on CHAR or MATCH. A thread
+    # reaching an instruction already reached at this position is dropped,
+    # the first one having the priority. As re does one more iteration of
+    # a loop when the previous one is not empty, the state of a thread
+    # includes which iterations have started at this position: an
+    # instruction may be reached again in a new iteration.
+    stack = [(pc, slots)]
+    while stack:
+        pc, slots = stack.pop()
+        instruction = program[pc]
+        opcode = instruction[0]
+        if opcode == UNTIL:
+            # the way out of UNTIL depends on the thread, it is followed by
+            # all of them. Loops are cut at the SPLIT of the iteration.
+            if slots[instruction[1]] == index:
+                stack.append((instruction[3], slots))
+            else:
+                stack.append((instruction[2], slots))
+            continue
+        if marks:
+            key = (pc,) + tuple(slots[mark] == index for mark in marks)
+        else:
+            key = pc
+        if key in visited:
+            continue
+        visited.add(key)
+        if opcode == JMP:
+            stack.append((instruction[1], slots))
+        elif opcode == SPLIT:
+            stack.append((instruction[2], slots))
+            stack.append((instruction[1], slots))
+        elif opcode == SAVE or opcode == MARK:
+            slot = instruction[1]
+            stack.append((pc + 1, slots[:slot] + (index,) + slots[slot + 1:]))
+        elif opcode == ASSERT:
+            if instruction[1](string, index):
+                stack.append((pc + 1, slots))
+        else:
+            threads.append((pc, slots))
+
+
+class NFAMatch:
+    """Match of an NFAPattern, with the subset of the interface of re
+    matches used by sed.
+    """
+
+    __slots__ = ('re', 'string', 'slots')
+
+    def __init__(self, pattern, string, slots):
+        self.re = pattern
+        self.string = string
+        self.slots = slots
+
+    def span(self, group=0):
+        return self.slots[2 * group], self.slots[2 * group + 1]
+
+    def start(self, group=0):
+        return self.slots[2 * group]
+
+    def end(self, group=0):
+        return self.slots[2 * group + 1]
+
+    def group(self, *groups):
+        if not groups:
+            groups = (0,)
+        values = []
+        for group in groups:
+            if not 0 <= group <= self.re.groups:
+                raise IndexError('no such group')
+            start, end = self.span(group)
+            values.append(None if start < 0 or end < 0 else self.string[start:end])
+        return values[0] if len(values) == 1 else tuple(values)
+
+    def groups(self, default=None):
+        return tuple(default if value is None else value for value in
+                     (self.group(index) for index in range(1, self.re.groups + 1)))
+
+
+class Compiler:
+    # translation of the parse of a pattern into a list of instructions.
+    # Slots after the capture ones store the start of iterations.
+
+    def __init__(self, nslots):
+        self.program = []
+        self.nslots = nslots
+
+    def emit(self, instruction):
+        if len(self.program) >= MAX_PROGRAM_SIZE:
+            raise NFAError('pattern too large')
+        self.program.append(instruction)
+        return len(self.program) - 1
+
+    def patch(self, pc, instruction):
+        self.program[pc] = instruction
+
+    def compile(self, items, flags):
+        for opcode, value in items:
+            if opcode in (sre_parse.LITERAL, sre_parse.NOT_LITERAL,
+                          sre_parse.ANY, sre_parse.IN):
+                item = (opcode, value)
+                self.emit((CHAR, char_test(item, flags), item, flags))
+            elif opcode is sre_parse.AT:
+                self.emit((ASSERT, position_test((opcode, value), flags)))
+            elif opcode is sre_parse.SUBPATTERN:
+                group, add_flags, del_flags, pattern = value
+                local_flags = (flags | add_flags) & ~del_flags
+                if group:
+                    self.emit((SAVE, 2 * group))
+                self.compile(pattern, local_flags)
+                if group:
+                    self.emit((SAVE, 2 * group + 1))
+            elif opcode is sre_parse.BRANCH:
+                self.compile_branch(value[1], flags)
+            elif opcode in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+                self.compile_repeat(value, opcode is sre_parse.MAX_REPEAT, flags)
+            else:
+                # backreferences, lookarounds, atomic groups, possessive
+                # repeats
+                raise NFAError('unsupported: %s' % opcode)
+
+    def compile_branch(self, alternatives, flags):
+        jumps = []
+        for index, alternative in enumerate(alternatives):
+            if index < len(alternatives) - 1:
+                split = self.emit(None)
+                self.compile(alternative, flags)
+                jumps.append(self.emit(None))
+                self.patch(split, (SPLIT, split + 1, len(self.program)))
+            else:
+                self.compile(alternative, flags)
+        for jump in jumps:
+            self.patch(jump, (JMP, len(self.program)))
+
+    def compile_repeat(self, value, greedy, flags):
+        # the body is repeated min times then optional up to max times.
+        # As in re, an optional iteration of a body which may match an empty
+        # string is the last one if it matches an empty string.
+        minimum, maximum, body = value
+        nullable = body.getwidth()[0] == 0
+        slot = None
+        if nullable:
+            slot = self.nslots
+            self.nslots += 1
+
+        for _ in range(minimum):
+            self.compile(body, flags)
+
+        def optional():
+            split = self.emit(None)
+            if nullable:
+                self.emit((MARK, slot))
+            self.compile(body, flags)
+            return split
+
+        if maximum == sre_parse.MAXREPEAT:
+            split = optional()
+            if nullable:
+                until = self.emit(None)
+                end = len(self.program)
+                self.patch(until, (UNTIL, slot, split, end))
+            else:
+                self.emit((JMP, split))
+                end = len(self.program)
+            self.patch(split, (SPLIT, split + 1, end) if greedy else
+                       (SPLIT, end, split + 1))
+        else:
+            tails = []
+            splits = []
+            for _ in range(maximum - minimum):
+                splits.append(optional())
+                if nullable:
+                    tails.append(self.emit(None))
+            end = len(self.program)
+            for split in splits:
+                self.patch(split, (SPLIT, split + 1, end) if greedy else
+                           (SPLIT, end, split + 1))
+            for tail in tails:
+                self.patch(tail, (UNTIL, slot, tail + 1, end))
+
+
+def first_pattern(program):
+    # pattern matching the characters which may start a match, or None if a
+    # match may be empty or start with an assertion
+    items = []
+    reached = set()
+    stack = [0]
+    while stack:
+        pc = stack.pop()
+        if pc in reached:
+            continue
+        reached.add(pc)
+        instruction = program[pc]
+        opcode = instruction[0]
+        if opcode == CHAR:
+            items.append(instruction[2:])
+        elif opcode == JMP:
+            stack.append(instruction[1])
+        elif opcode == SPLIT:
+            stack.extend(instruction[1:])
+        elif opcode == UNTIL:
+            stack.extend(instruction[2:])
+        elif opcode == SAVE or opcode == MARK:
+            stack.append(pc + 1)
+        else:
+            return None
+
+    flags = set(item_flags for _, item_flags in items)
+    if len(flags) != 1:
+        return None
+    flags = flags.pop()
+    state = sre_parse.State()
+    state.flags = flags
+    branch = [sre_parse.SubPattern(state, [item]) for item, _ in items]
+    return sre_compile.compile(sre_parse.SubPattern(
+        state, [(sre_parse.BRANCH, (None, branch))]), flags)
+
+
+def item_pattern(item, flags):
+    # pattern made of a single parsed item, compiled by re to get exactly its
+    # semantics (character classes, case folding, word boundaries)
+    state = sre_parse.State()
+    state.flags = flags
+    return sre_compile.compile(sre_parse.SubPattern(state, [item]), flags)
+
+
+def char_test(item, flags):
+    # results are memoized by character
+    match = item_pattern(item, flags).match
+    results = dict()
+
+    def test(char):
+        try:
+            return results[char]
+        except KeyError:
+            result = results[char] = match(char) is not None
+            return result
+    return test
+
+
+def position_test(item, flags):
+    match = item_pattern(item, flags).match
+
+    def test(string, index):
+        return match(string, index) is not None
+    return test
@@ -168,25 +168,34 @@ def parse_seq(regexp, i, within_group=False):
                 nodes.append(Anchor(regexp[i]))
                 i += 1
         elif regexp[i] in '+*?':
-            if i > 0:
+            if nodes:
                 nodes.append(Quantifier(regexp[i], nodes.pop()))
                 i += 1
             else:
-                SedException('regexp: nothing to repeat ' + regexp)
+                raise SedException('regexp: nothing to repeat ' + regexp)
         elif regexp[i] in '{':
-            if i > 0:
+            if nodes:
                 i, n1, n2 = parse_braces(regexp, i + 1)
                 nodes.append(Braces(n1, n2, nodes.pop()))
                 i += 1
             else:
-                SedException('regexp: nothing to repeat ' + regexp)
+                raise SedException('regexp: nothing to repeat ' + regexp)
         elif regexp[i] in '}':
             nodes.append(Char(regexp[i]))
             i += 1
         elif regexp[i] in '|':
             s1 = Seq(nodes)
-            i, s2 = parse_seq(regexp, i + 1)
-            return i, Alt(s1, s2)
+            i, s2 = parse_seq(regexp, i + 1, within_group)
+            if within_group:
+                # s2 is the group closed by the parenthesis, the alternation
+                # is its content
+                if len(s2.list) == 1 and isinstance(s2.list[0], Alt):
+                    s2 = s2.list[0]
+                else:
+                    s2 = Seq(s2.list)
+                return i, Group([Alt(s1, s2)])
+            else:
+                return i, Alt(s1, s2)
         else:
             nodes.append(Char(regexp[i]))
             i += 1
@@ -195,15 +204,20 @@ def parse_seq(regexp, i, within_group=False):
 
 def parse_set(regexp, i):
     """ i first char after opening bracket
+    a closing bracket first or after ^ is part of the set
     """
     i0 = i
+    if i < len(regexp) and regexp[i] == '^':
+        i += 1
+    if i < len(regexp) and regexp[i] == ']':
+        i += 1
     while i < len(regexp):
-        if regexp[i] == ']' and i > 0:
+        if regexp[i] == ']':
             return i, Set(regexp[i0:i])
         else:
             i += 1
     else:
-        raise Exception('No closing bracket')
+        raise SedException('regexp: charset not closed ' + regexp)
 
 
 def parse_slash(regexp, i):
@@ -225,7 +239,260 @@ def parse_braces(regexp, i):
     if m:
         return i + m.end(2), m.group(1), m.group(2)
 
-    raise Exception('Invalid content of {}')
+    raise SedException('regexp: invalid content of {} ' + regexp)
+
+
+# Literals required by a regexp
+
+ESCAPED_LITERALS = {'n': '\n', 't': '\t'}
+
+
+def required_literals(regexp, count=3):
+    """ regexp must be an extended regexp
+    return up to count longest strings which are part of any match of regexp,
+    the longest first
+    """
+    literals = []
+    run = collect_literals(Regast(regexp).regast, literals, '')
+    literals.append(run)
+    unique = []
+    for literal in literals:
+        if literal and literal not in unique:
+            unique.append(literal)
+    unique.sort(key=len, reverse=True)
+    return unique[:count]
+
+
+def collect_literals(regast, literals, run):
+    """ run is the literal matched just before regast
+    literals known to be required are appended to literals
+    return the literal matched at the end of regast
+    """
+    if isinstance(regast, Char):
+        return run + regast.char
+    elif isinstance(regast, Escaped):
+        return run + ESCAPED_LITERALS.get(regast.char, regast.char)
+    elif isinstance(regast, Anchor):
+        # zero width, characters around are still adjacent
+        return run
+    elif isinstance(regast, (Seq, Group)):
+        if any(isinstance(node, Alt) for node in regast.list):
+            literals.append(run)
+            return ''
+        for node in regast.list:
+            run = collect_literals(node, literals, run)
+        return run
+    elif (isinstance(regast, Quantifier) and regast.quantifier == '+' or
+          isinstance(regast, Braces) and int(regast.n1) > 0):
+        # repeated at least once, its literals are required but are not
+        # adjacent to the ones around
+        literals.append(run)
+        literals.append(collect_literals(regast.regast, literals, ''))
+        return ''
+    else:
+        # alternation, optional, any, set, backreference
+        literals.append(run)
+        return ''
+
+
+# Backtracking risks
+
+def backtracking_risks(regexp):
+    """ regexp must be an extended regexp
+    return the descriptions of the shapes of regexp known to make a
+    backtracking engine take an exponential time on some strings: nested
+    quantifiers and overlapping alternatives repeated without bound
+    """
+    risks = []
+    collect_risks(Regast(regexp).regast, risks)
+    return risks
+
+
+def collect_risks(regast, risks):
+    if isinstance(regast, (Seq, Group)):
+        for node in regast.list:
+            collect_risks(node, risks)
+    elif isinstance(regast, Alt):
+        collect_risks(regast.alt1, risks)
+        collect_risks(regast.alt2, risks)
+    elif isinstance(regast, (Quantifier, Braces)):
+        if is_unbounded(regast):
+            body = regast.regast
+            inner = nested_repeat(body)
+            if inner is not None:
+                risks.append('nested quantifiers %s in %s' % (inner, regast))
+            elif overlapping_alternatives(body):
+                risks.append('overlapping alternatives in %s' % regast)
+        collect_risks(regast.regast, risks)
+
+
+def is_unbounded(regast):
+    return (isinstance(regast, Quantifier) and regast.quantifier in '*+' or
+            isinstance(regast, Braces) and regast.n2 == '')
+
+
+def is_variable(regast):
+    # repeat matching a variable number of times
+    if isinstance(regast, Quantifier):
+        return regast.quantifier in '*+'
+    elif isinstance(regast, Braces):
+        return regast.n2 is not None and (regast.n2 == '' or
+                                          int(regast.n2) > max(int(regast.n1), 1))
+    else:
+        return False
+
+
+def nested_repeat(body):
+    """ return a repeat of a variable number of times inside body, which is
+    repeated, unless a character required by body cannot be matched by the
+    inner repeat: then the iterations of body cannot be split in several ways
+    """
+    repeats = []
+    find_repeats(body, repeats)
+    required = []
+    required_chars(body, required)
+    for repeat in repeats:
+        chars = node_chars(repeat.regast)
+        if not any(not overlap(chars, other) for other in required):
+            return repeat
+    return None
+
+
+def find_repeats(regast, repeats):
+    if is_variable(regast):
+        repeats.append(regast)
+    elif isinstance(regast, (Seq, Group)):
+        for node in regast.list:
+            find_repeats(node, repeats)
+    elif isinstance(regast, Alt):
+        find_repeats(regast.alt1, repeats)
+        find_repeats(regast.alt2, repeats)
+    elif isinstance(regast, (Quantifier, Braces)):
+        find_repeats(regast.regast, repeats)
+
+
+def required_chars(regast, required):
+    # character sets of the characters matched by any match of regast
+    if isinstance(regast, (Char, Escaped, Set, Any)):
+        required.append(node_chars(regast))
+    elif isinstance(regast, (Seq, Group)):
+        if not any(isinstance(node, Alt) for node in regast.list):
+            for node in regast.list:
+                required_chars(node, required)
+
+
+def overlapping_alternatives(body):
+    """ True if two alternatives of a group may start with the same
+    character
+    """
+    if isinstance(body, Group) and len(body.list) == 1:
+        body = body.list[0]
+    if not isinstance(body, Alt):
+        return False
+    alternatives = []
+    while isinstance(body, Alt):
+        alternatives.append(body.alt1)
+        body = body.alt2
+    alternatives.append(body)
+    firsts = [first_chars(alternative) for alternative in alternatives]
+    for index, chars in enumerate(firsts):
+        for other in firsts[index + 1:]:
+            if overlap(chars, other):
+                return True
+    return False
+
+
+def first_chars(regast):
+    # set of the characters which may start a match, ALL_CHARS if unknown
+    if isinstance(regast, (Char, Escaped, Set, Any)):
+        return node_chars(regast)
+    elif isinstance(regast, Seq) and regast.list:
+        node = regast.list[0]
+        if isinstance(node, (Char, Escaped, Set, Any)):
+            return node_chars(node)
+        return ALL_CHARS
+    else:
+        return ALL_CHARS
+
+
+# a set of characters is a couple (negated, characters)
+
+ALL_CHARS = (True, frozenset())
+
+# [:class:], [.symbol.] and [=equivalent=] are not expanded
+SET_CLASS = re.compile(r'\[[:.=]')
+
+
+def node_chars(regast):
+    if isinstance(regast, Char):
+        return False, frozenset(regast.char)
+    elif isinstance(regast, Escaped):
+        if regast.char in ESCAPED_LITERALS:
+            return False, frozenset(ESCAPED_LITERALS[regast.char])
+        elif regast.char.isalnum():
+            # class of characters
+            return ALL_CHARS
+        else:
+            return False, frozenset(regast.char)
+    elif isinstance(regast, Set):
+        return set_chars(regast.set)
+    elif isinstance(regast, (Seq, Group)):
+        chars = (False, frozenset())
+        for node in regast.list:
+            chars = union(chars, node_chars(node))
+        return chars
+    elif isinstance(regast, Alt):
+        return union(node_chars(regast.alt1), node_chars(regast.alt2))
+    elif isinstance(regast, (Quantifier, Braces)):
+        return node_chars(regast.regast)
+    elif isinstance(regast, Anchor):
+        return False, frozenset()
+    else:
+        return ALL_CHARS
+
+
+def set_chars(text):
+    negated = text.startswith('^')
+    if negated:
+        text = text[1:]
+    if SET_CLASS.search(text) or '\\' in text:
+        return ALL_CHARS
+    chars = set()
+    i = 0
+    while i < len(text):
+        if i + 2 < len(text) and text[i + 1] == '-':
+            chars.update(chr(code) for code in range(ord(text[i]), ord(text[i + 2]) + 1))
+            i += 3
+        else:
+            chars.add(text[i])
+            i += 1
+    return negated, frozenset(chars)
+
+
+def union(chars1, chars2):
+    negated1, set1 = chars1
+    negated2, set2 = chars2
+    if negated1 and negated2:
+        return True, set1 & set2
+    elif negated1:
+        return True, set1 - set2
+    elif negated2:
+        return True, set2 - set1
+    else:
+        return False, set1 | set2
+
+
+def overlap(chars1, chars2):
+    negated1, set1 = chars1
+    negated2, set2 = chars2
+    if negated1 and negated2:
+        return True
+    elif negated1:
+        return not set2 <= set1
+    elif negated2:
+        return not set1 <= set2
+    else:
+        return bool(set1 & set2)
 
 
 class SedException(Exception):
@@ -265,6 +532,10 @@ if __name__ == "__main__":
         'abc*?+{5,9}',
         'abc|def',
         'abc|def|ghi',
+        'a(b|c)d',
+        'a(b|c|d)e',
+        'a((b|c)d|e)f',
+        '[]a]b[^]c]d',
     )
 
     for test in tests:
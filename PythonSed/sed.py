@@ -32,10 +32,27 @@ THE SOFTWARE.
 
 import re
 import sys
+import collections
+import itertools
+import threading
 import os
-import argparse
-import string
-import webbrowser
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+try:
+    from .regast import required_literals, backtracking_risks
+    from .nfa import NFAPattern, NFAError
+except ImportError:
+    # sed.py run as a script
+    from regast import required_literals, backtracking_risks
+    from nfa import NFAPattern, NFAError
+
+# modules used only by the script cache, the command line, the time budget,
+# warnings or python 2 are imported when needed to keep the import of
+# PythonSed fast
 
 
 class Sed:
@@ -45,11 +62,33 @@ class Sed:
     sed = Sed()
     sed.no_autoprint = True/False
     sed.regexp_extended = True/False
+    sed.optimize = True/False                 peephole optimization of script
+    sed.lazy_regexps = True/False             convert and compile on first use
+    sed.cache_dir = None/mydirectory          cache of parsed scripts
+    sed.address_scan = True/False             one scan of regexp addresses per line
+    sed.idioms = True/False                   native run of well-known one-liners
+    sed.regexp_engine = 're'/'nfa'            engine running the regexps
+    sed.regexp_engine_by_command = {num: 'nfa'}    engine of some commands
+    sed.backtracking_risk = 'ignore'/'warn'/'reject'   regexps prone to
+                                              catastrophic backtracking
+    sed.time_budget = None/milliseconds       maximum time of a cycle
+    sed.memory_budget = None/characters       maximum size of pattern and hold
+                                              spaces, see sed.peak_space_size
+    sed.register_command(name, function)      python function run by a
+                                              one letter command
+    sed.register_replacement(num, function)   python function computing the
+                                              replacements of s command num
+    sed.explain()                             list of lines of execution plan
     sed.load_script(myscript)
     sed.load_string(mystring)
-    lines = sed.apply(myinput)                print lines to stdout
+    sed.apply(myinput)                        print lines to stdout
     lines = sed.apply(myinput, None)          do not print lines
-    lines = sed.apply(myinput, myoutput)      print lines to myoutput
+    sed.apply(myinput, myoutput)              print lines to myoutput
+    lines = sed.apply(myinput, myoutput, collect=True)   print and return lines
+    for line in sed.iter_apply(myinput):      lines yielded after each cycle
+    feeder = sed.feeder(callback)             input pushed by feeder.feed(text)
+    feeder.feed(text)                         and feeder.close(), callback
+    feeder.close()                            called with each printed line
 
     myinput and myoutput may be:
     * strings, in that case they are interpreted as file names
@@ -57,21 +96,38 @@ class Sed:
 
     Note that if myinput or myoutput are file-like objects, they must be closed
     by the caller.
+
+    Regexps are shared by all Sed instances through a process-wide LRU
+    cache, see regexp_cache_info(), regexp_cache_clear() and
+    set_regexp_cache_size(maxsize).
+
+    program = sed.compile() returns the loaded script as a read-only Program
+    whose apply and iter_apply methods have the signatures of the Sed ones. A
+    program keeps no state between runs and may be applied concurrently from
+    several threads.
     """
 
     def __init__(self):
-        self.PS = ''
-        self.HS = ''
         self.first_cmd = None
-        self.reader = Reader()
-        self.output = None
-        self.output_lines = []
         self.no_autoprint = False
         self.regexp_extended = False
-        self.subst_successful = False
-        self.append_buffer = []
-        self.last_regexp = None
+        self.optimize = True
+        self.lazy_regexps = True
+        self.cache_dir = None
+        self.address_scan = False
+        self.idioms = True
+        self.idiom = None
+        self.regexp_engine = 're'
+        self.regexp_engine_by_command = dict()
+        self.backtracking_risk = 'ignore'
+        self.time_budget = None
+        self.memory_budget = None
+        self.peak_space_size = None
+        self.native_commands = dict()
+        self.replacement_hooks = dict()
         self.commands = None
+        self.removed_commands = []
+        self.program = None
 
     def load_script(self, filename):
         try:
@@ -89,23 +145,120 @@ class Sed:
         string_list = string.split('\n')
         self.load_string_list(string_list)
 
+    def register_command(self, name, function):
+        # function(PS, match) returns the new pattern space, or None to leave
+        # it unchanged. match is the last match of a regexp in the pattern
+        # space, e.g. of the address of the command, or None. Commands are
+        # registered before loading the script.
+        if (len(name) != 1 or not name.isalpha() or name in COMMAND_CLASSES or
+                name == 'I'):
+            raise SedException('invalid command name: %s' % name)
+        if not callable(function):
+            raise SedException('command %s is not callable' % name)
+        self.native_commands[name] = function
+
+    def register_replacement(self, num, function):
+        # function(PS, match) returns the replacement of each match of the s
+        # command whose number is num, as listed by dump_script. Hooks are
+        # registered before loading the script.
+        if not callable(function):
+            raise SedException('replacement of command %s is not callable' % num)
+        self.replacement_hooks[num] = function
+
     def load_string_list(self, string_list):
+        without_gc(self.parse_string_list, string_list)
+
+    def parse_string_list(self, string_list):
         self.parse_flags(string_list)
+        # python functions cannot be saved in the script cache, and pickles
+        # written by other users are not loaded
+        use_cache = (self.cache_dir and not self.native_commands and
+                     not self.replacement_hooks and
+                     private_cache_dir(self.cache_dir))
+        if use_cache and self.load_cached_script(string_list):
+            removed = [command for command, _ in self.removed_commands]
+            self.create_write_files(self.commands + removed)
+            self.check_backtracking_risks()
+            if not self.lazy_regexps:
+                self.compile_regexps()
+            self.program = None
+            return
+
         script = pack_script(string_list)
-        self.commands = parse_script(script)
+        self.commands = parse_script(script, self.native_commands)
         self.first_cmd = self.commands[0]
+        self.attach_replacement_hooks()
         self.convert()
-        self.create_write_files()
+        self.create_write_files(self.commands)
+        self.idiom = recognize_idiom(self.commands)
+        if self.optimize:
+            self.commands, self.first_cmd, self.removed_commands = \
+                optimize_commands(self.commands, self.first_cmd)
+        else:
+            self.removed_commands = []
+        number_ranges(self.commands)
+        self.check_backtracking_risks()
+        self.program = None
+
+        if use_cache:
+            self.save_cached_script(string_list)
+
+    def script_cache_file(self, string_list):
+        # the parsed script depends on its text, on the flags and on the
+        # versions of python and of the modules of the package (and their
+        # last change)
+        import hashlib
+        sources = (__file__, sys.modules[required_literals.__module__].__file__,
+                   sys.modules[NFAPattern.__module__].__file__)
+        stats = [(stat.st_mtime, stat.st_size) for stat in map(os.stat, sources)]
+        key = repr((VERSION, stats, sys.version_info[:2],
+                    self.no_autoprint, self.regexp_extended, self.optimize,
+                    self.regexp_engine,
+                    sorted(self.regexp_engine_by_command.items())))
+        digest = hashlib.sha256(key.encode('utf-8'))
+        digest.update('\n'.join(string_list).encode('utf-8', 'surrogateescape'))
+        return os.path.join(self.cache_dir, digest.hexdigest() + '.pickle')
+
+    def load_cached_script(self, string_list):
+        # return True if the parsed script has been read from the cache. Any
+        # error when reading is a cache miss.
+        filename = self.script_cache_file(string_list)
+        try:
+            with open(filename, 'rb') as f:
+                if not private_stat(os.fstat(f.fileno())):
+                    return False
+                data = f.read()
+            script = load_commands(data)
+        except Exception:
+            return False
+        self.commands, self.first_cmd, self.removed_commands, self.idiom = script
+        return True
 
-    def create_write_files(self):
-        for command in self.commands:
+    def save_cached_script(self, string_list):
+        # the cache is an optimization, failing to write in it is ignored
+        filename = self.script_cache_file(string_list)
+        try:
+            data = dump_commands(self.commands, self.first_cmd,
+                                 self.removed_commands, self.idiom)
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir, 0o700)
+            tempname = '%s.%d.tmp' % (filename, os.getpid())
+            # not writable by others whatever the umask
+            fd = os.open(tempname, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tempname, filename)
+        except Exception:
+            pass
+
+    def create_write_files(self, commands):
+        for command in commands:
             filename = None
             if command.function == 'w':
                 filename = command.args
             elif command.function == 's':
-                write = command.args[5]
-                if write:
-                    filename = command.args[6]
+                if command.write:
+                    filename = command.filename
             if filename:
                 try:
                     open(filename, 'w')
@@ -117,9 +270,56 @@ class Sed:
         if script and script[0].startswith('#n'):
             self.no_autoprint = True
 
+    def attach_replacement_hooks(self):
+        commands = dict((command.num, command) for command in self.commands)
+        for num, function in self.replacement_hooks.items():
+            command = commands.get(num)
+            if not isinstance(command, Command_s):
+                raise SedException('no s command with number %s' % num)
+            command.hook = ReplacementHook(function)
+
     def convert(self):
+        # identical regexps are shared through the process-wide regexp
+        # cache and converted and compiled once. Unless lazy regexps are
+        # disabled, this is done on first use.
+        regexps = dict()
+        for command in self.commands:
+            engine = self.regexp_engine_by_command.get(command.num,
+                                                       self.regexp_engine)
+            if engine not in REGEXP_ENGINES:
+                raise SedException('unknown regexp engine: %s' % engine)
+            command.convert(self.regexp_extended, regexps, engine)
+        if not self.lazy_regexps:
+            self.compile_regexps()
+
+    def check_backtracking_risks(self):
+        # regexps run by re whose shape may make it backtrack for an
+        # exponential time are reported according to backtracking_risk
+        if self.backtracking_risk not in ('ignore', 'warn', 'reject'):
+            raise SedException('unknown backtracking policy: %s' %
+                               self.backtracking_risk)
+        if self.backtracking_risk == 'ignore':
+            return
+        for command in self.commands:
+            for regexp in command.regexps():
+                if regexp.engine == 'nfa':
+                    continue
+                for risk in regexp.backtracking_risks():
+                    message = 'command %d, regexp %s: %s' % (
+                        command.num, regexp.source, risk)
+                    if self.backtracking_risk == 'reject':
+                        raise SedException('backtracking risk: ' + message)
+                    import warnings
+                    warnings.warn(message, RuntimeWarning, stacklevel=4)
+
+    def regexps(self):
         for command in self.commands:
-            command.convert(self.regexp_extended)
+            for regexp in command.regexps():
+                yield regexp
+
+    def compile_regexps(self):
+        for regexp in self.regexps():
+            regexp.compile()
 
     def need_last_line(self):
         for command in self.commands:
@@ -132,6 +332,219 @@ class Sed:
     def dump_script(self):
         for command in self.commands:
             print(command)
+        for command, reason in self.removed_commands:
+            print('|%03d|%1s| %s' % (command.num, command.function, reason))
+        if self.idiom is not None:
+            print('idiom: %s%s' % (self.idiom, '' if self.idioms else ' (disabled)'))
+
+    def explain(self):
+        # execution plan of the loaded script: properties of the whole script
+        # deciding which modes of execution are possible, then commands with
+        # their regexps and the fast paths applying to them
+        if self.commands is None:
+            raise SedException('no script loaded')
+
+        functions = set(command.function for command in self.commands)
+        hold = sorted(functions & set('hHgGx'))
+        multiline = sorted(functions & set('nNDP'))
+        lookahead = self.need_last_line()
+
+        # a script is line independent if each line can be processed without
+        # knowing the other ones, e.g. in parallel on chunks of the input
+        dependencies = []
+        if hold:
+            dependencies.append('hold space')
+        if multiline:
+            dependencies.append('several lines per cycle')
+        if lookahead:
+            dependencies.append('$ address')
+        for command in self.commands:
+            if command.address2 is not None:
+                dependencies.append('ranges')
+                break
+        for command in self.commands:
+            if (isinstance(command.address1, AddressNumber) or
+                isinstance(command.address2, AddressNumber) or
+                command.function == '='):
+                dependencies.append('line numbers')
+                break
+        if 'q' in functions:
+            dependencies.append('q')
+        if functions & set('w') or any(isinstance(command, Command_s) and
+                                       command.write for command in self.commands):
+            dependencies.append('write files')
+
+        def yes_no(items):
+            return 'yes (%s)' % ', '.join(items) if items else 'no'
+
+        lines = []
+        lines.append('commands: %d (%d removed by optimizer)' %
+                     (len(self.commands), len(self.removed_commands)))
+        lines.append('autoprint: %s' % ('no' if self.no_autoprint else 'yes'))
+        lines.append('$ lookahead (need_last_line): %s' %
+                     ('yes' if lookahead else 'no'))
+        lines.append('hold space: %s' % yes_no(hold))
+        lines.append('multi-line pattern space: %s' % yes_no(multiline))
+        lines.append('segmented spaces: %s' % yes_no(accumulations(self.commands)))
+        lines.append('branches: %s' % yes_no(sorted(functions & set('bt'))))
+        lines.append('line independent: %s' %
+                     ('yes' if not dependencies else
+                      'no (%s)' % ', '.join(dependencies)))
+        lines.append('streaming: %s' %
+                     ('one line lookahead' if lookahead else 'yes'))
+        lines.append('idiom: %s' % ('no' if self.idiom is None else
+                                    '%s, run natively' % self.idiom if self.idioms else
+                                    '%s, disabled' % self.idiom))
+        if self.address_scan:
+            scan = AddressScan.factory(self.commands)
+            lines.append('address scan: %s' %
+                         ('%d regexps' % len(scan.regexps) if scan else 'no'))
+
+        for command in self.commands:
+            lines.append(str(command))
+            for note in command.explain():
+                lines.append('    ' + note)
+        for command, reason in self.removed_commands:
+            lines.append('|%03d|%1s| %s' % (command.num, command.function, reason))
+        return lines
+
+    def explain_script(self):
+        for line in self.explain():
+            print(line)
+
+    def compile(self):
+        if self.commands is None:
+            raise SedException('no script loaded')
+
+        # the program is cached until the script or the flags change. As in
+        # Program, idioms are not run natively with a budget.
+        idiom = self.idiom if self.idioms else None
+        if self.time_budget is not None or self.memory_budget is not None:
+            idiom = None
+        if (self.program is None or
+                self.program.no_autoprint != self.no_autoprint or
+                self.program.address_scan != self.address_scan or
+                self.program.time_budget != self.time_budget or
+                self.program.memory_budget != self.memory_budget or
+                self.program.idiom is not idiom):
+            self.program = without_gc(Program, self.commands, self.first_cmd,
+                                      self.no_autoprint, self.need_last_line(),
+                                      self.address_scan, self.time_budget, idiom,
+                                      self.memory_budget)
+        return self.program
+
+    def apply(self, source_file, output=sys.stdout, collect=None):
+        # with a memory budget, the peak size of the spaces is kept, even if
+        # the budget is exceeded
+        program = self.compile()
+        ctx = program.context_class(program)
+        try:
+            return ctx.apply(source_file, output, collect)
+        finally:
+            self.peak_space_size = (None if program.memory_budget is None else
+                                    ctx.peak_space_size)
+
+    def feeder(self, callback):
+        return self.compile().feeder(callback)
+
+    def iter_apply(self, source_file):
+        program = self.compile()
+        ctx = program.context_class(program)
+        try:
+            for line in ctx.iter_apply(source_file):
+                yield line
+        finally:
+            self.peak_space_size = (None if program.memory_budget is None else
+                                    ctx.peak_space_size)
+
+
+def without_gc(function, *args):
+    # loading and compiling large scripts create many objects and no garbage
+    # cycles. Each full collection would traverse all the objects created so
+    # far, making the load time grow faster than the script size.
+    import gc
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return function(*args)
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class Program:
+    """Compiled script, read-only and shared by all its runs. The state of a
+    run is held by a Context created by apply.
+    """
+
+    __slots__ = ('commands', 'first_step', 'range_count', 'no_autoprint',
+                 'need_last_line', 'address_scan', 'time_budget', 'context_class',
+                 'idiom', 'memory_budget')
+
+    def __init__(self, commands, first_cmd, no_autoprint, need_last_line,
+                 address_scan=False, time_budget=None, idiom=None,
+                 memory_budget=None):
+        first_step, range_count = compile_commands(commands, first_cmd,
+                                                   address_scan, time_budget,
+                                                   memory_budget)
+        set_attribute = super(Program, self).__setattr__
+        set_attribute('commands', tuple(commands))
+        set_attribute('first_step', first_step)
+        set_attribute('range_count', range_count)
+        set_attribute('no_autoprint', no_autoprint)
+        set_attribute('need_last_line', need_last_line)
+        set_attribute('address_scan', address_scan)
+        set_attribute('time_budget', time_budget)
+        set_attribute('memory_budget', memory_budget)
+        # scripts accumulating lines keep the pattern and hold spaces in pieces
+        set_attribute('context_class', SegmentedContext
+                      if accumulations(commands) else Context)
+        # a recognized idiom is run natively, unless cycles are timed or
+        # spaces are measured
+        set_attribute('idiom', idiom if time_budget is None and
+                      memory_budget is None else None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Program is read-only')
+
+    def apply(self, source_file, output=sys.stdout, collect=None):
+        return self.context_class(self).apply(source_file, output, collect)
+
+    def iter_apply(self, source_file):
+        return self.context_class(self).iter_apply(source_file)
+
+    def feeder(self, callback):
+        ctx = self.context_class(self)
+        ctx.open_feed(callback)
+        return ctx
+
+
+class Context:
+    """Execution state of one run of a program: pattern and hold spaces,
+    input, output and states of ranges.
+    """
+
+    def __init__(self, program):
+        self.program = program
+        self.no_autoprint = program.no_autoprint
+        self.PS = ''
+        self.HS = ''
+        self.reader = Reader()
+        self.output = None
+        self.output_lines = []
+        self.subst_successful = False
+        self.append_buffer = []
+        self.last_regexp = None
+        self.last_match = None
+        self.scanned_PS = None
+        self.scan_matched = True
+        self.current_command = None
+        self.resume_step = None
+        self.deadline = None
+        self.peak_space_size = 0
+        self.ranges = [False] * program.range_count
+        self.restart_cycle = False
+        self.quit = False
 
     def readline(self):
         self.subst_successful = False
@@ -141,15 +554,71 @@ class Sed:
         return self.reader.islastline()
 
     def printline(self, line):
-        self.output_lines.append(line)
-        if self.output is not None:
-            print(line, file=self.output)
+        # replaced by output_lines.append when lines are only collected
+        if self.output_lines is not None:
+            self.output_lines.append(line)
+        print(line, file=self.output)
 
     def flush_append_buffer(self):
         for line in self.append_buffer:
             self.printline(line)
         del self.append_buffer[:]
 
+    def append_line(self, line):
+        # N: append a newline and line to PS
+        self.PS = self.PS + '\n' + line
+
+    def delete_first_line(self):
+        # D: delete up to the first newline of PS, return False if there is
+        # no newline
+        PS = self.PS
+        index = PS.find('\n')
+        if index < 0:
+            return False
+        self.PS = PS[index + 1:]
+        return True
+
+    def first_line(self):
+        # P: PS up to the first newline
+        PS = self.PS
+        index = PS.find('\n')
+        return PS if index < 0 else PS[:index]
+
+    def append_hold(self):
+        # G
+        self.PS = self.PS + '\n' + self.HS
+
+    def append_to_hold(self):
+        # H
+        self.HS = self.HS + '\n' + self.PS
+
+    def copy_to_hold(self):
+        # h
+        self.HS = self.PS
+
+    def exchange(self):
+        # x
+        self.PS, self.HS = self.HS, self.PS
+
+    def space_size(self):
+        # total length of the pattern and hold spaces, overridden by
+        # SegmentedContext to measure them without joining
+        PS = self.PS
+        return (0 if PS is None else len(PS)) + len(self.HS)
+
+    def check_space_size(self, budget, command):
+        # command is None when a line is read at the start of a cycle
+        size = self.space_size()
+        if size > self.peak_space_size:
+            self.peak_space_size = size
+            if size > budget:
+                if command is None:
+                    culprit = 'reading'
+                else:
+                    culprit = 'command %d (%s)' % (command.num, command.function)
+                raise SedException('memory budget of %d characters exceeded by %s on line %d'
+                                   % (budget, culprit, self.reader.line_number))
+
     def cache_regexp(self, reg_exp_container):
         # handle empty regexp with default to previous one
         if reg_exp_container is None:
@@ -160,72 +629,384 @@ class Sed:
 
         return self.last_regexp
 
-    def apply(self, source_file, output=sys.stdout):
-        self.reader.open(source_file, self.need_last_line())
+    def apply(self, source_file, output=sys.stdout, collect=None):
+        # printed lines are returned if collect is true, by default when
+        # they are not printed, None otherwise
+        self.reader.open(source_file, self.program.need_last_line)
         self.output = output
-        self.output_lines = []
+        if collect is None:
+            collect = output is None
+        self.output_lines = [] if collect else None
 
-        if output is not None:
-            if type(output) != str:
-                self.output = output
+        if output is None:
+            if collect:
+                self.printline = self.output_lines.append
             else:
-                if sys.version_info[0] == 2:
-                    self.output = open(output, 'wt')
-                else:
-                    self.output = open(output, 'wt', encoding="latin-1")
-
-        self.PS = self.readline()
-        while self.PS is not None:
-            matched, command = False, self.first_cmd
-            while command:
-                prev_command = command
-                matched, command = command.apply_func(self)
-
-            # end of cycle
+                self.printline = lambda line: None
+        elif type(output) == str:
+            if sys.version_info[0] == 2:
+                self.output = open(output, 'wt')
+            else:
+                self.output = open(output, 'wt', encoding="latin-1")
 
-            if self.no_autoprint:
-                pass
-            elif prev_command.function == 'D':
-                pass
-            elif prev_command.function == 'd':
-                if self.PS is None:
-                    # if d triggered
-                    pass
-                else:
-                    self.printline(self.PS)
+        try:
+            if self.program.idiom is not None:
+                self.program.idiom.run(self)
             else:
-                if self.PS is None:
-                    # if n triggered at end of file
+                for _ in self.run_cycles():
                     pass
-                else:
-                    self.printline(self.PS)
+        finally:
+            if type(output) == str:
+                self.output.close()
 
-            self.flush_append_buffer()
+        return self.output_lines
 
-            if prev_command.function == 'q' and matched:
-                break
+    def iter_apply(self, source_file):
+        # the lines printed by a cycle are yielded at its end, so that the
+        # output is not kept. Idioms print their output at once, the cycles
+        # are run instead.
+        self.reader.open(source_file, self.program.need_last_line)
+        self.output = None
+        self.output_lines = lines = []
+        self.printline = lines.append
+
+        for _ in self.run_cycles():
+            if lines:
+                for line in lines:
+                    yield line
+                del lines[:]
+
+    def open_feed(self, callback):
+        # input is pushed by feed and close, cycles are run as soon as their
+        # lines are there, and printed lines are passed to callback. As with
+        # iter_apply, idioms are not run natively.
+        self.reader.open_feed(self.program.need_last_line)
+        self.output = None
+        self.output_lines = []
+        self.printline = self.output_lines.append
+        self.callback = callback
+        self.cycles = self.run_cycles()
 
-            if prev_command.function != 'D':
-                self.PS = self.readline()
+    def feed(self, text):
+        self.reader.feed(text)
+        self.resume_cycles()
 
-        if type(output) == str:
-            self.output.close()
+    def close(self):
+        self.reader.close_feed()
+        self.resume_cycles()
 
-        return self.output_lines
+    def resume_cycles(self):
+        # run the cycles until they wait for input or end
+        if self.cycles is None:
+            return
+        lines = self.output_lines
+        callback = self.callback
+        for waiting in self.cycles:
+            if lines:
+                for line in lines:
+                    callback(line)
+                del lines[:]
+            if waiting:
+                break
+        else:
+            self.cycles = None
+
+    def run_cycles(self):
+        # generator running the cycles, yielding False at the end of each one
+        # and True when pushed input is needed. The cycle is then resumed at
+        # the action of the command reading input, its address being tested.
+        first_step = self.program.first_step
+        budget = self.program.time_budget
+        memory_budget = self.program.memory_budget
+        timer = None
+        if budget is not None:
+            import time
+            clock = time.perf_counter
+        try:
+            self.quit = False
+            self.restart_cycle = False
+            while True:
+                # PS is not read when D restarts the cycle: segmented
+                # pattern spaces are not joined
+                if not self.restart_cycle:
+                    try:
+                        line = self.readline()
+                    except InputNeeded:
+                        yield True
+                        continue
+                    if line is None:
+                        break
+                    self.PS = line
+                self.restart_cycle = False
+                if memory_budget is not None:
+                    self.check_space_size(memory_budget, None)
+                step = first_step
+                while step is not None:
+                    if budget is not None:
+                        # the timer interrupts a regexp search running too
+                        # long, the deadline is also checked after each
+                        # command. Waiting for input is not counted.
+                        # The handler is only installed while the steps
+                        # run, not while the generator is paused.
+                        self.deadline = clock() + budget / 1000.0
+                        timer = self.start_timer(budget / 1000.0)
+                    try:
+                        while step is not None:
+                            step = step(self)
+                    except InputNeeded:
+                        # the size is checked after the line is read
+                        step = self.resume_step
+                        if memory_budget is not None:
+                            step = memory_step(None, step, memory_budget)
+                    finally:
+                        if timer:
+                            self.stop_timer(timer)
+                            timer = None
+                    if step is not None:
+                        yield True
+
+                # end of cycle. PS is None if d or c triggered, or if n or D
+                # triggered at end of file. restart_cycle is set by D, PS is
+                # then read only to be printed.
+
+                if not (self.no_autoprint or self.restart_cycle):
+                    PS = self.PS
+                    if PS is not None:
+                        self.printline(PS)
+
+                self.flush_append_buffer()
+                yield False
+
+                if self.quit:
+                    break
+        except TimeBudgetExceeded:
+            command = self.current_command
+            raise SedException('time budget of %g ms exceeded by command %d (%s) '
+                               'on line %d' % (budget, command.num if command else 0,
+                                               command.function if command else '',
+                                               self.reader.line_number))
+
+    def start_timer(self, delay):
+        # arm SIGALRM to interrupt the steps after delay seconds if it can be
+        # used, i.e. in the main thread of a platform providing it. Return the
+        # state restored by stop_timer, or None if the deadline is only
+        # checked after each command. A timer of the host program expiring
+        # first is left running, otherwise it is set again by stop_timer.
+        import signal
+        if (not hasattr(signal, 'setitimer') or
+                threading.current_thread() is not threading.main_thread()):
+            return None
+        host_delay, host_interval = signal.getitimer(signal.ITIMER_REAL)
+        if host_delay and host_delay <= delay:
+            return None
 
-    def match(self, address):
-        return address.match(self)
+        def interrupt(signum, frame):
+            raise TimeBudgetExceeded()
+        import time
+        previous_handler = signal.signal(signal.SIGALRM, interrupt)
+        signal.setitimer(signal.ITIMER_REAL, delay)
+        return (signal, previous_handler, host_delay, host_interval,
+                time.perf_counter())
+
+    def stop_timer(self, timer):
+        import time
+        signal, previous_handler, host_delay, host_interval, start = timer
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        if previous_handler is not None:
+            signal.signal(signal.SIGALRM, previous_handler)
+        if host_delay:
+            # the time spent in the steps is deducted from the host delay
+            remaining = host_delay - (time.perf_counter() - start)
+            signal.setitimer(signal.ITIMER_REAL, max(remaining, 1e-6),
+                             host_interval)
 
     def write_subst_file(self, filename, line):
         with open(filename, 'at') as f:
             print(line, file=f)
 
 
+# length from which the pattern and hold spaces are kept in pieces
+SEGMENT_SIZE = 4096
+
+
+class SegmentedContext(Context):
+    """Context of scripts accumulating lines: N in a loop, H or G. Long
+    pattern and hold spaces are kept as ropes, appended to and shared by h,
+    g and x without copying, and joined into strings only when a command
+    reads PS. For N and D, the pattern space is split into a deque of chunks.
+    Accumulating a file is then linear instead of quadratic.
+
+    The raw value of PS, a string, a rope or None, is stored in text, unless
+    chunks is not None.
+    """
+
+    def __init__(self, program):
+        self.chunks = None
+        self.chunks_length = 0
+        Context.__init__(self, program)
+
+    @property
+    def PS(self):
+        # the joined string replaces the rope or the chunks
+        text = self.text
+        if self.chunks is not None:
+            text = self.text = '\n'.join(self.chunks)
+            self.chunks = None
+        elif text.__class__ is Rope:
+            text = self.text = str(text)
+        return text
+
+    @PS.setter
+    def PS(self, value):
+        self.text = value
+        self.chunks = None
+
+    def raw_PS(self):
+        if self.chunks is not None:
+            self.text = '\n'.join(self.chunks)
+            self.chunks = None
+        return self.text
+
+    def append_line(self, line):
+        # short pattern spaces, as in sliding windows, are faster to copy
+        chunks = self.chunks
+        if chunks is None:
+            text = self.text
+            if len(text) + len(line) < SEGMENT_SIZE:
+                self.text = text + '\n' + line
+                return
+            chunks = self.chunks = collections.deque(
+                text.pieces() if text.__class__ is Rope else [text])
+            self.chunks_length = len(text)
+        chunks.append(line)
+        self.chunks_length += 1 + len(line)
+
+    def delete_first_line(self):
+        chunks = self.chunks
+        if chunks is None:
+            text = self.text
+            if text.__class__ is not Rope:
+                return Context.delete_first_line(self)
+            chunks = self.chunks = collections.deque(text.pieces())
+            self.chunks_length = len(text)
+        # there is a newline between two chunks, and chunks may contain some
+        first = chunks[0]
+        index = first.find('\n')
+        if index < 0:
+            if len(chunks) == 1:
+                # a single line is left
+                return False
+            chunks.popleft()
+            self.chunks_length -= len(first) + 1
+            if len(chunks) == 1:
+                self.text = chunks[0]
+                self.chunks = None
+        else:
+            chunks[0] = first[index + 1:]
+            self.chunks_length -= index + 1
+        return True
+
+    def first_line(self):
+        if self.chunks is not None:
+            first = self.chunks[0]
+        else:
+            first = self.text
+            while first.__class__ is Rope:
+                first = first.left if first.flat is None else first.flat
+        index = first.find('\n')
+        return first if index < 0 else first[:index]
+
+    def space_size(self):
+        # ropes and chunks are not joined
+        if self.chunks is not None:
+            size = self.chunks_length
+        else:
+            size = 0 if self.text is None else len(self.text)
+        return size + len(self.HS)
+
+    def append_hold(self):
+        self.text = join_text(self.raw_PS(), self.HS)
+
+    def append_to_hold(self):
+        self.HS = join_text(self.HS, self.raw_PS())
+
+    def copy_to_hold(self):
+        self.HS = self.raw_PS()
+
+    def exchange(self):
+        PS = self.raw_PS()
+        self.text = self.HS
+        self.HS = PS
+
+
+class Rope:
+    """Immutable text made of two pieces separated by a newline, the pieces
+    being strings or ropes. Ropes are joined into a string once, iteratively
+    as they may be deep, and the string then replaces the pieces.
+    """
+
+    __slots__ = ('left', 'right', 'length', 'flat')
+
+    def __init__(self, left, right, length):
+        self.left = left
+        self.right = right
+        self.length = length
+        self.flat = None
+
+    def __len__(self):
+        return self.length
+
+    def __str__(self):
+        if self.flat is None:
+            self.flat = ''.join(self.pieces(True))
+            self.left = self.right = None
+        return self.flat
+
+    def pieces(self, newlines=False):
+        # strings of the rope in order, with the newlines between them if
+        # newlines is true
+        pieces = []
+        stack = [self]
+        while stack:
+            piece = stack.pop()
+            if piece.__class__ is not Rope:
+                pieces.append(piece)
+            elif piece.flat is not None:
+                pieces.append(piece.flat)
+            else:
+                stack.append(piece.right)
+                if newlines:
+                    stack.append('\n')
+                stack.append(piece.left)
+        return pieces
+
+
+def join_text(left, right):
+    # left and right separated by a newline, short texts are joined at once
+    length = ((left.length if left.__class__ is Rope else len(left)) + 1 +
+              (right.length if right.__class__ is Rope else len(right)))
+    if length <= SEGMENT_SIZE:
+        return '%s\n%s' % (left, right)
+    return Rope(left, right, length)
+
+
 class SedException(Exception):
     def __init__(self, message):
         self.message = 'sed.py error: %s' % message
 
 
+class TimeBudgetExceeded(Exception):
+    # raised when a cycle runs longer than the time budget, reported as a
+    # SedException
+    pass
+
+
+class InputNeeded(Exception):
+    # raised when a line is read before it is pushed, the cycle waits for the
+    # next feed
+    pass
+
+
 class Reader:
     def __init__(self):
         self.input_file = None
@@ -251,6 +1032,18 @@ class Reader:
         self.line_number = 0
         self.line_reader = LineReader.factory(self.input_file, need_last_line)
 
+    def open_feed(self, need_last_line=False):
+        self.input_file = None
+        self.line = ''
+        self.line_number = 0
+        self.line_reader = LineReaderPushed(need_last_line)
+
+    def feed(self, text):
+        self.line_reader.push(text)
+
+    def close_feed(self):
+        self.line_reader.close()
+
     def getline(self):
         self.line = self.line_reader.readline()
 
@@ -305,28 +1098,79 @@ class LineReaderBuffered:
     def islastline(self):
         return self.nextline == ''
 
+class LineReaderPushed:
+    # lines pushed by chunks of text, with one line ahead if last line
+    # address ($) required. InputNeeded is raised when the line to read is
+    # not there yet.
+
+    def __init__(self, need_last_line):
+        self.lines = collections.deque()
+        self.partial = []
+        self.lookahead = 1 if need_last_line else 0
+        self.closed = False
+
+    def push(self, text):
+        if self.closed:
+            raise SedException('input is closed')
+        index = text.rfind('\n')
+        if index < 0:
+            self.partial.append(text)
+            return
+        self.partial.append(text[:index])
+        self.lines.extend(line + '\n' for line in ''.join(self.partial).split('\n'))
+        self.partial = [text[index + 1:]]
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            last = ''.join(self.partial)
+            if last:
+                self.lines.append(last)
+
+    def readline(self):
+        lines = self.lines
+        if len(lines) > self.lookahead or self.closed and lines:
+            return lines.popleft()
+        if self.closed:
+            return ''
+        raise InputNeeded()
+
+    def islastline(self):
+        return self.closed and not self.lines
+
 
 class AddressNumber:
+    __slots__ = ('number',)
+
     def __init__(self, number):
         self.number = number
     def __str__(self):
         return str(self.number)
-    def match(self, sed):
-        return self.number == sed.reader.line_number
-    def convert(self, extended):
+    def convert(self, extended, regexps, engine='re'):
         pass
+    def test(self):
+        number = self.number
+        def test(ctx):
+            return ctx.reader.line_number == number
+        return test
 
 class AddressDollar:
+    __slots__ = ()
+
     def __init__(self):
         pass
     def __str__(self):
         return '$'
-    def match(self, sed):
-        return sed.islastline()
-    def convert(self, extended):
+    def convert(self, extended, regexps, engine='re'):
         pass
+    def test(self):
+        def test(ctx):
+            return ctx.reader.islastline()
+        return test
 
 class AddressRegexp:
+    __slots__ = ('pattern', 'ignore_case', 'regexp')
+
     def __init__(self, pattern, ignore_case):
         self.pattern = pattern
         self.ignore_case = ignore_case
@@ -338,22 +1182,28 @@ class AddressRegexp:
         else:
             return self.pattern
 
-    def convert(self, extended):
-        self.regexp = Regexp.factory(self.pattern, extended, self.ignore_case)
-
-    def match(self, sed):
-        try:
-            regexp = sed.cache_regexp(self.regexp)
-            return regexp.search(sed.PS)
-
-        except re.error as e:
-            raise SedException('regexp: %s' % e.message)
-        except:
-            raise
+    def convert(self, extended, regexps, engine='re'):
+        self.regexp = Regexp.factory(self.pattern, extended, self.ignore_case,
+                                     regexps, engine)
+
+    def test(self):
+        regexp = self.regexp
+        if regexp is None:
+            # empty regexp, use the last one at execution time
+            def test(ctx):
+                ctx.last_match = ctx.cache_regexp(None).search(ctx.PS)
+                return ctx.last_match is not None
+        else:
+            def test(ctx):
+                ctx.last_regexp = regexp
+                ctx.last_match = regexp.search(ctx.PS)
+                return ctx.last_match is not None
+        return test
 
 
 class Command:
-    num = 1
+    __slots__ = ('num', 'address1', 'address2', 'negate', 'function', 'args',
+                 'next', 'branch', 'range_index')
 
     def __init__(self, address1, address2, negate, function):
 
@@ -364,9 +1214,7 @@ class Command:
         if function == 'q' and address2:
             raise SedException('wrong number of addresses')
 
-        self.num = Command.num
-        Command.num += 1
-
+        self.num = 0
         self.address1 = address1
         self.address2 = address2
         self.negate = negate
@@ -374,39 +1222,16 @@ class Command:
         self.args = None
         self.next = None
         self.branch = None
-        self.address_range_started = False
+        self.range_index = None
 
     @staticmethod
-    def factory(address1, address2, negate, function):
-        classes = { '{': Command_block,
-                    '}': Command_block_end,
-                    ':': Command_label,
-                    'a': Command_a,
-                    'b': Command_b,
-                    'c': Command_c,
-                    'd': Command_d,
-                    'D': Command_D,
-                    '=': Command_equal,
-                    'g': Command_g,
-                    'G': Command_G,
-                    'h': Command_h,
-                    'H': Command_H,
-                    'i': Command_i,
-                    'l': Command_l,
-                    'n': Command_n,
-                    'N': Command_N,
-                    'p': Command_p,
-                    'P': Command_P,
-                    'q': Command_q,
-                    'r': Command_r,
-                    's': Command_s,
-                    't': Command_t,
-                    'w': Command_w,
-                    'x': Command_x,
-                    'y': Command_y,
-                }
-        if function in classes:
-            return classes[function](address1, address2, negate, function)
+    def factory(address1, address2, negate, function, natives=None):
+        if natives and function in natives:
+            command = Command_native(address1, address2, negate, function)
+            command.native = natives[function]
+            return command
+        elif function in COMMAND_CLASSES:
+            return COMMAND_CLASSES[function](address1, address2, negate, function)
         else:
             raise SedException('unknown function: %s' % function)
 
@@ -434,237 +1259,497 @@ class Command:
         else:
             return i
 
-    def convert(self, regexp_extended):
+    def convert(self, regexp_extended, regexps, engine='re'):
         if self.address1:
-            self.address1.convert(regexp_extended)
+            self.address1.convert(regexp_extended, regexps, engine)
         if self.address2:
-            self.address2.convert(regexp_extended)
+            self.address2.convert(regexp_extended, regexps, engine)
+
+    def explain(self):
+        # notes about the regexps and the fast paths of the command
+        notes = []
+        for name, address in (('address1', self.address1),
+                              ('address2', self.address2)):
+            if isinstance(address, AddressRegexp):
+                notes.append('%s: %s' % (name, explain_regexp(address.regexp)))
+                notes.extend(explain_matcher(name, address.regexp))
+        if self.inlined_regexp() is not None:
+            notes.append('fast path: address test inlined')
+        return notes
+
+    def regexps(self):
+        # non empty regexps of the command
+        for address in (self.address1, self.address2):
+            if isinstance(address, AddressRegexp) and address.regexp:
+                yield address.regexp
+
+    def inlined_regexp(self):
+        # regexp of the single address whose test is inlined in the guard,
+        # or None
+        if self.address2 is None and isinstance(self.address1, AddressRegexp):
+            return self.address1.regexp
+        return None
 
-    def apply_func(self, sed):
-        if self.address1 is None:
-            matched = True
-        elif self.address2 is None:
-            matched = self.match_1addr(sed)
-        else:
-            matched = self.match_2addr(sed)
+    def can_fuse(self, command):
+        # test if the command and the next one can be replaced by a single
+        # command, see fuse
+        return False
 
-        if self.negate:
-            matched = not matched
+    def action(self, steps, nxt, branch):
+        # return a closure executing the function of the command. The closure
+        # receives the execution context and returns the step to execute next,
+        # read from steps at index nxt or branch (None at end of cycle).
+        raise NotImplementedError
 
-        if matched:
-            return matched, self.apply(sed)
-        else:
-            return matched, self.next
+    def guard(self, action, steps, nxt, scan=None):
+        # return the step of the command: the action guarded by the address
+        # test, with the kind of address and negation resolved once for all.
+        # scan, if given, is the AddressScan of the inlined address tests.
+        negate = self.negate
+
+        if self.address1 is None:
+            if negate:
+                # "!" without address: the command is never executed
+                def step(ctx):
+                    return steps[nxt]
+                return step
+            else:
+                return action
+
+        elif scan is not None and self.inlined_regexp() in scan.regexps:
+            # the regexp is searched only if the scan of the pattern space
+            # by all the address regexps has found a match. The scan is
+            # redone when PS is replaced by another string.
+            regexp = self.address1.regexp
+            def step(ctx):
+                PS = ctx.PS
+                if ctx.scanned_PS is not PS:
+                    ctx.scanned_PS = PS
+                    ctx.scan_matched = scan.search(PS)
+                ctx.last_regexp = regexp
+                ctx.last_match = regexp.search(PS) if ctx.scan_matched else None
+                if (ctx.last_match is not None) != negate:
+                    return action(ctx)
+                else:
+                    return steps[nxt]
+            return step
+
+        elif self.inlined_regexp() is not None:
+            # most frequent case, address test is inlined
+            regexp = self.address1.regexp
+            def step(ctx):
+                ctx.last_regexp = regexp
+                ctx.last_match = regexp.search(ctx.PS)
+                if (ctx.last_match is not None) != negate:
+                    return action(ctx)
+                else:
+                    return steps[nxt]
+            return step
 
-    def match_1addr(self, sed):
-        return sed.match(self.address1)
+        elif self.address2 is None:
+            test = self.address1.test()
+            if negate:
+                def step(ctx):
+                    if test(ctx):
+                        return steps[nxt]
+                    else:
+                        return action(ctx)
+            else:
+                def step(ctx):
+                    if test(ctx):
+                        return action(ctx)
+                    else:
+                        return steps[nxt]
+            return step
 
-    def match_2addr(self, sed):
-        if self.address_range_started:
-            x = sed.match(self.address2)
-            if x:
-                self.address_range_started = False
-            return True
         else:
-            x = sed.match(self.address1)
-            if x:
-                self.address_range_started = True
-            return x
+            index = self.range_index
+            test1 = self.address1.test()
+            test2 = self.address2.test()
+            def step(ctx):
+                if ctx.ranges[index]:
+                    if test2(ctx):
+                        ctx.ranges[index] = False
+                    matched = True
+                else:
+                    matched = test1(ctx)
+                    if matched:
+                        ctx.ranges[index] = True
+
+                if matched != negate:
+                    return action(ctx)
+                else:
+                    return steps[nxt]
+            return step
 
 
 class Command_block(Command):
+    __slots__ = ()
+
     def parse_arguments(self, line, i):
         return i
 
-    def apply(self, sed):
-        # self.next is the first instruction after block
-        # self.branch is the first instruction within block
-        return self.branch
+    def action(self, steps, nxt, branch):
+        # nxt is the first instruction after block
+        # branch is the first instruction within block
+        def block(ctx):
+            return steps[branch]
+        return block
 
 class Command_block_end(Command):
+    __slots__ = ()
+
     def parse_arguments(self, line, i):
         return i
 
-    def apply(self, sed):
-        return self.next
+    def action(self, steps, nxt, branch):
+        def block_end(ctx):
+            return steps[nxt]
+        return block_end
 
 class Command_label(Command):
-    def apply(self, sed):
-        return self.next
+    __slots__ = ()
+
+    def action(self, steps, nxt, branch):
+        def label(ctx):
+            return steps[nxt]
+        return label
 
 class Command_a(Command):
+    __slots__ = ()
+
     def parse_arguments(self, line, i):
         i, self.args = parse_arguments_aic(line, i)
         return i
 
-    def apply(self, sed):
-        sed.append_buffer.append(self.args)
-        return self.next
+    def action(self, steps, nxt, branch):
+        text = self.args
+        def a(ctx):
+            ctx.append_buffer.append(text)
+            return steps[nxt]
+        return a
 
 class Command_b(Command):
-    def apply(self, sed):
-        # if label missing, self.branch is None and will go to end of script
-        return self.branch
+    __slots__ = ()
+
+    def action(self, steps, nxt, branch):
+        # if label missing, branch is the end of script
+        def b(ctx):
+            return steps[branch]
+        return b
 
 class Command_c(Command):
+    __slots__ = ()
+
     def parse_arguments(self, line, i):
         i, self.args = parse_arguments_aic(line, i)
         return i
 
-    def apply(self, sed):
-        if (not self.address2 or
-            self.address2 and self.address_range_started == False):
-            sed.printline(self.args)
-        sed.PS = None
-        return None
+    def action(self, steps, nxt, branch):
+        index = self.range_index
+        text = self.args
+        def c(ctx):
+            if index is None or ctx.ranges[index] == False:
+                ctx.printline(text)
+            ctx.PS = None
+            return None
+        return c
 
 class Command_d(Command):
-    def apply(self, sed):
-        sed.PS = None
-        return None
+    __slots__ = ()
+
+    def action(self, steps, nxt, branch):
+        def d(ctx):
+            ctx.PS = None
+            return None
+        return d
 
 class Command_D(Command):
-    def apply(self, sed):
-        if '\n' in sed.PS:
-            sed.PS = sed.PS[sed.PS.index('\n') + 1:]
-        else:
-            sed.PS = ''
-            sed.PS = sed.readline()
-        return None
+    __slots__ = ()
+
+    def action(self, steps, nxt, branch):
+        def D(ctx):
+            if not ctx.delete_first_line():
+                try:
+                    ctx.PS = ctx.readline()
+                except InputNeeded:
+                    ctx.resume_step = D
+                    raise
+                if ctx.PS is None:
+                    # end of input, the cycle ends as with d
+                    return None
+            # no autoprint and no reading at end of cycle
+            ctx.restart_cycle = True
+            return None
+        return D
 
 class Command_equal(Command):
-    def apply(self, sed):
-        sed.printline('%d' % sed.reader.line_number)
-        return self.next
+    __slots__ = ()
+
+    def action(self, steps, nxt, branch):
+        def equal(ctx):
+            ctx.printline('%d' % ctx.reader.line_number)
+            return steps[nxt]
+        return equal
 
 class Command_g(Command):
-    def apply(self, sed):
-        sed.PS = sed.HS
-        return self.next
+    __slots__ = ()
+
+    def action(self, steps, nxt, branch):
+        def g(ctx):
+            ctx.PS = ctx.HS
+            return steps[nxt]
+        return g
 
 class Command_G(Command):
-    def apply(self, sed):
-        sed.PS += '\n' + sed.HS
-        return self.next
+    __slots__ = ()
+
+    def action(self, steps, nxt, branch):
+        def G(ctx):
+            ctx.append_hold()
+            return steps[nxt]
+        return G
 
 class Command_h(Command):
-    def apply(self, sed):
-        sed.HS = sed.PS
-        return self.next
+    __slots__ = ()
+
+    def action(self, steps, nxt, branch):
+        def h(ctx):
+            ctx.copy_to_hold()
+            return steps[nxt]
+        return h
 
 class Command_H(Command):
-    def apply(self, sed):
-        sed.HS += '\n' + sed.PS
-        return self.next
+    __slots__ = ()
+
+    def action(self, steps, nxt, branch):
+        def H(ctx):
+            ctx.append_to_hold()
+            return steps[nxt]
+        return H
 
 class Command_i(Command):
+    __slots__ = ()
+
     def parse_arguments(self, line, i):
         i, self.args = parse_arguments_aic(line, i)
         return i
 
-    def apply(self, sed):
-        sed.printline(self.args)
-        return self.next
+    def action(self, steps, nxt, branch):
+        text = self.args
+        def i(ctx):
+            ctx.printline(text)
+            return steps[nxt]
+        return i
 
 class Command_l(Command):
-    def apply(self, sed):
-        x = ''
-        for c in sed.PS:
-            if chr(32) <= c < chr(128) or c in '\n\t':
-                x += c
-            else:
-                rep = oct(ord(c))
-                rep = rep.replace('o', '') # remove 'o' from python 3
-                rep = ('00' + rep)[-3:]    # pad on 3 characters
-                x += '\\' + rep
-
-        x += '$'
-        x = x.replace('\n', r'\n')
-        x = x.replace('\t', r'\t')
-        width = 69
-        for i in range(0, len(x), width):
-            if i+width >= len(x):
-                sed.printline(x[i:i+width])
-            elif i+width == len(x) - 1 and x[i+width] == '$':
-                sed.printline(x[i:i+width + 1])
-                break
-            else:
-                sed.printline(x[i:i+width] + '\\')
+    __slots__ = ()
+
+    def action(self, steps, nxt, branch):
+        def l(ctx):
+            x = ''
+            for c in ctx.PS:
+                if chr(32) <= c < chr(128) or c in '\n\t':
+                    x += c
+                else:
+                    rep = oct(ord(c))
+                    rep = rep.replace('o', '') # remove 'o' from python 3
+                    rep = ('00' + rep)[-3:]    # pad on 3 characters
+                    x += '\\' + rep
+
+            x += '$'
+            x = x.replace('\n', r'\n')
+            x = x.replace('\t', r'\t')
+            width = 69
+            for i in range(0, len(x), width):
+                if i+width >= len(x):
+                    ctx.printline(x[i:i+width])
+                elif i+width == len(x) - 1 and x[i+width] == '$':
+                    ctx.printline(x[i:i+width + 1])
+                    break
+                else:
+                    ctx.printline(x[i:i+width] + '\\')
 
-        return self.next
+            return steps[nxt]
+        return l
 
 class Command_n(Command):
-    def apply(self, sed):
-        if not sed.no_autoprint:
-            sed.printline(sed.PS)
-        sed.PS = sed.readline()
-        if sed.PS is None:
-            return None
-        else:
-            return self.next
+    __slots__ = ()
+
+    def action(self, steps, nxt, branch):
+        def n(ctx):
+            # the line is read first, pushed input may be missing
+            try:
+                line = ctx.readline()
+            except InputNeeded:
+                ctx.resume_step = n
+                raise
+            if not ctx.no_autoprint:
+                ctx.printline(ctx.PS)
+            ctx.PS = line
+            if ctx.PS is None:
+                return None
+            else:
+                return steps[nxt]
+        return n
 
 class Command_N(Command):
-    def apply(self, sed):
-        newline = sed.readline()
-        if newline is None:
-            return None
-        else:
-            sed.PS = sed.PS + '\n' + newline
-            return self.next
+    __slots__ = ()
+
+    def action(self, steps, nxt, branch):
+        def N(ctx):
+            try:
+                newline = ctx.readline()
+            except InputNeeded:
+                ctx.resume_step = N
+                raise
+            if newline is None:
+                return None
+            else:
+                ctx.append_line(newline)
+                return steps[nxt]
+        return N
 
 class Command_p(Command):
-    def apply(self, sed):
-        sed.printline(sed.PS)
-        return self.next
+    __slots__ = ()
+
+    def action(self, steps, nxt, branch):
+        def p(ctx):
+            ctx.printline(ctx.PS)
+            return steps[nxt]
+        return p
 
 class Command_P(Command):
-    def apply(self, sed):
-        if '\n' in sed.PS:
-            sed.printline(sed.PS[:sed.PS.index('\n')])
-        else:
-            sed.printline(sed.PS)
-        return self.next
+    __slots__ = ()
+
+    def action(self, steps, nxt, branch):
+        def P(ctx):
+            ctx.printline(ctx.first_line())
+            return steps[nxt]
+        return P
 
 class Command_q(Command):
-    def apply(self, sed):
-        # handled in sed.apply
-        return None
+    __slots__ = ()
+
+    def action(self, steps, nxt, branch):
+        def q(ctx):
+            # end of script handled in Context.apply
+            ctx.quit = True
+            return None
+        return q
 
 class Command_r(Command):
-    def apply(self, sed):
-        # https://groups.yahoo.com/neo/groups/sed-users/conversations/topics/9096
-        try:
-            for line in open(self.args):
-                line = line.replace('\n', '')
-                sed.append_buffer.append(line)
-        except:
-            # "if filename cannot be read, it is treated as if it were an empty
-            # file, without any error indication." (GNU sed manual page)
-            pass
+    __slots__ = ()
+
+    def action(self, steps, nxt, branch):
+        filename = self.args
+        def r(ctx):
+            # https://groups.yahoo.com/neo/groups/sed-users/conversations/topics/9096
+            try:
+                for line in open(filename):
+                    line = line.replace('\n', '')
+                    ctx.append_buffer.append(line)
+            except:
+                # "if filename cannot be read, it is treated as if it were an empty
+                # file, without any error indication." (GNU sed manual page)
+                pass
 
-        return self.next
+            return steps[nxt]
+        return r
 
 class Command_s(Command):
-    def __init__(self, address1, address2, negate, function):
-        Command.__init__(self, address1, address2, negate, function)
-        self.xregexp = None
+    # arguments are stored in slots rather than in args
+    __slots__ = ('pattern', 'repl', 'count', 'printit', 'ignore_case', 'write',
+                 'filename', 'regexp', 'batch', 'hook')
 
     def parse_arguments(self, line, i):
-        i, self.args = parse_arguments_s(line, i)
+        i, args = parse_arguments_s(line, i)
+        (self.pattern, self.repl, self.count, self.printit, self.ignore_case,
+            self.write, self.filename) = args
+        self.regexp = None
+        self.batch = None
+        self.hook = None
         return i
 
-    def convert(self, regexp_extended):
-        Command.convert(self, regexp_extended)
-
-        pattern, repl, _, _, ignore_case, _, _ = self.args
-
-        self.regexp = Regexp.factory(pattern, regexp_extended, ignore_case)
-
-        self.args[0] = '' if self.regexp is None else self.regexp.pattern
-        self.args[1] = convert_replacement(repl)
+    def literal_rules(self):
+        # return the list of (literal, replacement) equivalent to the command
+        # if it is an unaddressed s///g whose regexp matches a small set of
+        # literal strings, None otherwise
+        if self.batch is not None:
+            return self.batch.rules
+        if (self.address1 is not None or self.negate or self.count != 0 or
+                self.printit or self.write or self.ignore_case or
+                self.regexp is None or self.hook is not None):
+            return None
+        if RE_NOT_LITERAL[self.regexp.extended].search(self.regexp.source):
+            return None
+        alternatives = literal_alternatives(self.regexp.pattern)
+        if alternatives is None:
+            return None
+        return [(text, self.repl.expand_groups(text, groups))
+                for text, groups in alternatives]
+
+    def can_fuse(self, command):
+        # sed applies the runs of s commands one after the other. They can be
+        # applied in one pass if no literals overlap (then their occurrences
+        # do not overlap in any string) and if later literals cannot overlap
+        # the replacements of previous commands, or match across a deletion.
+        if not isinstance(command, Command_s):
+            return False
+        rules1 = self.literal_rules()
+        if rules1 is None or any(repl == '' for _, repl in rules1):
+            return False
+        rules2 = command.literal_rules()
+        if rules2 is None:
+            return False
+        for text2, _ in rules2:
+            for text1, repl1 in rules1:
+                if literals_overlap(text1, text2) or literals_overlap(repl1, text2):
+                    return False
+        return True
+
+    def fuse(self, command):
+        if self.batch is None:
+            self.batch = LiteralBatch(self.literal_rules(), self.regexp)
+        self.batch.add(command.literal_rules(), command.regexp)
+
+    def convert(self, regexp_extended, regexps, engine='re'):
+        Command.convert(self, regexp_extended, regexps, engine)
+
+        self.regexp = Regexp.factory(self.pattern, regexp_extended,
+                                     self.ignore_case, regexps, engine)
+
+        self.repl = Replacement(convert_replacement(self.repl))
+
+    def regexps(self):
+        for regexp in Command.regexps(self):
+            yield regexp
+        if self.regexp:
+            yield self.regexp
+
+    def explain(self):
+        notes = Command.explain(self)
+        if self.batch is None:
+            notes.append('pattern: %s' % explain_regexp(self.regexp))
+            notes.extend(explain_matcher('pattern', self.regexp))
+        else:
+            notes.append('fast path: batch of %d literal substitutions in one pass'
+                         % len(self.batch.rules))
+        if self.hook is not None:
+            notes.append('replacement: python function %s' % self.hook.name())
+        return notes
 
     def str_arguments(self):
-        pattern, repl, count, printit, ignore_case, write, filename = self.args
+        if self.batch is None:
+            pattern = '' if self.regexp is None else self.regexp.pattern
+            repl = (self.repl.template if self.hook is None else
+                    '<python %s>' % self.hook.name())
+        else:
+            pattern = self.batch.pattern()
+            repl = '<batch of %d literals>' % len(self.batch.rules)
+        count = self.count
+        printit, ignore_case = self.printit, self.ignore_case
+        write, filename = self.write, self.filename
 
         # try to alight right delimiter by reducing repl width if necessary
         l0 = max(20, len(pattern)) + max(20, len(repl))
@@ -688,46 +1773,144 @@ class Command_s(Command):
 
         return args
 
-    def apply(self, sed):
-        _, repl, count, printit, _, write, filename = self.args
-
-        # managing ampersand is done when converting to python format
+    def action(self, steps, nxt, branch):
+        if self.batch is not None:
+            return self.batch_action(steps, nxt)
+        if self.hook is not None:
+            return self.hook_action(steps, nxt)
 
-        # manage empty regexp
-        regexp = sed.cache_regexp(self.regexp)
+        repl, count, printit = self.repl, self.count, self.printit
+        write, filename = self.write, self.filename
+        regexp = self.regexp
 
-        success, sed.PS = regexp.subn(repl, sed.PS, count=count)
+        # managing ampersand is done when converting to python format
 
-        sed.subst_successful = sed.subst_successful or success
+        def s(ctx):
+            # manage empty regexp. The last match of an address on the
+            # same pattern space is reused (/x/s//y/).
+            if regexp is None:
+                current = ctx.cache_regexp(None)
+                match = ctx.last_match
+                if match is not None and match.string is not ctx.PS:
+                    match = None
+                success, ctx.PS = current.subn(repl, ctx.PS, count, match)
+            else:
+                current = ctx.last_regexp = regexp
+                success, ctx.PS = current.subn(repl, ctx.PS, count)
 
-        if success:
-            if printit:
-                sed.printline(sed.PS)
-            if write:
-                sed.write_subst_file(filename, sed.PS)
+            if success:
+                ctx.subst_successful = True
+                if printit:
+                    ctx.printline(ctx.PS)
+                if write:
+                    ctx.write_subst_file(filename, ctx.PS)
+
+            return steps[nxt]
+        return s
+
+    def hook_action(self, steps, nxt):
+        # the matches are given to the python function, the fast paths of
+        # the regexp do not apply
+        hook, count, printit = self.hook, self.count, self.printit
+        write, filename = self.write, self.filename
+        regexp = self.regexp
+
+        def s(ctx):
+            if regexp is None:
+                current = ctx.cache_regexp(None)
+                match = ctx.last_match
+            else:
+                current = ctx.last_regexp = regexp
+                match = None
+            compiled = current.compiled or current.compile()
+            if match is not None and (match.string is not ctx.PS or
+                                      match.re is not compiled):
+                match = None
+            success, ctx.PS = re_sub_ex(compiled, hook, ctx.PS, count, match)
+
+            if success:
+                ctx.subst_successful = True
+                if printit:
+                    ctx.printline(ctx.PS)
+                if write:
+                    ctx.write_subst_file(filename, ctx.PS)
+
+            return steps[nxt]
+        return s
+
+    def batch_action(self, steps, nxt):
+        batch = self.batch
+        last_regexp = batch.last_regexp
+        def s(ctx):
+            ctx.last_regexp = last_regexp
+            PS, nsubst = batch.subn(ctx.PS)
+            if nsubst:
+                ctx.PS = PS
+                ctx.subst_successful = True
+            return steps[nxt]
+        return s
+
+class Command_native(Command):
+    # command registered with Sed.register_command, running a python function
+    __slots__ = ('native',)
+
+    def explain(self):
+        notes = Command.explain(self)
+        notes.append('native: python function %s' % function_name(self.native))
+        return notes
 
-        return self.next
+    def str_arguments(self):
+        return '<python %s>' % function_name(self.native)
+
+    def action(self, steps, nxt, branch):
+        # a change of the pattern space counts as a substitution for t
+        function = self.native
+        def native(ctx):
+            match = ctx.last_match
+            if match is not None and match.string is not ctx.PS:
+                match = None
+            PS = function(ctx.PS, match)
+            if PS is not None and PS != ctx.PS:
+                ctx.PS = PS
+                ctx.subst_successful = True
+            return steps[nxt]
+        return native
 
 class Command_t(Command):
-    def apply(self, sed):
-        # if label missing, self.branch is None and will go to end of script
-        if sed.subst_successful:
-            sed.subst_successful = False
-            return self.branch
-        else:
-            return self.next
+    __slots__ = ()
+
+    def action(self, steps, nxt, branch):
+        # if label missing, branch is the end of script
+        def t(ctx):
+            if ctx.subst_successful:
+                ctx.subst_successful = False
+                return steps[branch]
+            else:
+                return steps[nxt]
+        return t
 
 class Command_w(Command):
-    def apply(self, sed):
-        sed.write_subst_file(self.args, sed.PS)
-        return self.next
+    __slots__ = ()
+
+    def action(self, steps, nxt, branch):
+        filename = self.args
+        def w(ctx):
+            ctx.write_subst_file(filename, ctx.PS)
+            return steps[nxt]
+        return w
 
 class Command_x(Command):
-    def apply(self, sed):
-        sed.PS, sed.HS = sed.HS, sed.PS
-        return self.next
+    __slots__ = ()
+
+    def action(self, steps, nxt, branch):
+        def x(ctx):
+            ctx.exchange()
+            return steps[nxt]
+        return x
 
 class Command_y(Command):
+    __slots__ = ('translate',)
+
     def __init__(self, address1, address2, negate, function):
         Command.__init__(self, address1, address2, negate, function)
         self.translate = None
@@ -736,102 +1919,698 @@ class Command_y(Command):
         i, self.args = parse_arguments_y(line, i)
         return i
 
-    def convert(self, regexp_extended):
-        Command.convert(self, regexp_extended)
+    def convert(self, regexp_extended, regexps, engine='re'):
+        Command.convert(self, regexp_extended, regexps, engine)
         self.args[0] = convert_argument_y(self.args[0])
         self.args[1] = convert_argument_y(self.args[1])
         try:
-            try:
-                # python2
+            if sys.version_info[0] == 2:
+                import string
                 self.translate = string.maketrans(*self.args)
-            except:
-                # python3
+            else:
                 self.translate = str.maketrans(*self.args)
         except:
             raise SedException('y: incorrect arguments')
 
+    def can_fuse(self, command):
+        return is_plain_y(self) and is_plain_y(command)
+
+    def fuse(self, command):
+        # compose translation with the one of the next y command
+        table = dict((key, command.translate.get(value, value))
+                     for key, value in self.translate.items())
+        for key, value in command.translate.items():
+            table.setdefault(key, value)
+        self.translate = table
+        self.args = [''.join(chr(key) for key in table),
+                     ''.join(chr(value) for value in table.values())]
+
     def str_arguments(self):
         source_chars, dest_chars = self.args
         return '%-20s|%-20s' % (source_chars, dest_chars)
 
-    def apply(self, sed):
-        sed.PS = sed.PS.translate(self.translate)
-        return self.next
+    def action(self, steps, nxt, branch):
+        table = self.translate
+        def y(ctx):
+            ctx.PS = ctx.PS.translate(table)
+            return steps[nxt]
+        return y
+
+
+COMMAND_CLASSES = {
+    '{': Command_block,
+    '}': Command_block_end,
+    ':': Command_label,
+    'a': Command_a,
+    'b': Command_b,
+    'c': Command_c,
+    'd': Command_d,
+    'D': Command_D,
+    '=': Command_equal,
+    'g': Command_g,
+    'G': Command_G,
+    'h': Command_h,
+    'H': Command_H,
+    'i': Command_i,
+    'l': Command_l,
+    'n': Command_n,
+    'N': Command_N,
+    'p': Command_p,
+    'P': Command_P,
+    'q': Command_q,
+    'r': Command_r,
+    's': Command_s,
+    't': Command_t,
+    'w': Command_w,
+    'x': Command_x,
+    'y': Command_y,
+}
+
+
+def compile_commands(commands, first_cmd, address_scan=False, time_budget=None,
+                     memory_budget=None):
+    # turn the linked commands into closures. Each closure receives the
+    # execution context and returns the closure of the command to execute
+    # next, or None at end of cycle. Closures are stored in steps by command
+    # index, the extra last slot standing for the end of the script.
+    # Commands with two addresses have the index of their range state in the
+    # context, numbered when the script is loaded. The commands are not
+    # modified. Return the first step and the number of ranges.
+    # With address_scan, the inlined address tests share an AddressScan.
+    # With a time budget, steps record the command they run and check the
+    # deadline of the cycle. With a memory budget, the steps of commands which
+    # may enlarge the pattern or hold space check their size.
+
+    range_count = sum(1 for command in commands if command.address2)
+
+    scan = AddressScan.factory(commands) if address_scan else None
+
+    steps = [None] * (len(commands) + 1)
+    slot = dict((command, index) for index, command in enumerate(commands))
+    slot[None] = len(commands)
+
+    for index, command in enumerate(commands):
+        nxt = slot[command.next]
+        action = command.action(steps, nxt, slot[command.branch])
+        steps[index] = command.guard(action, steps, nxt, scan)
+
+    if memory_budget is not None:
+        for index, command in enumerate(commands):
+            if (command.function in SPACE_COMMANDS or
+                    isinstance(command, Command_native)):
+                steps[index] = memory_step(command, steps[index], memory_budget)
+
+    if time_budget is not None:
+        for index, command in enumerate(commands):
+            steps[index] = budget_step(command, steps[index])
+
+    return steps[slot[first_cmd]], range_count
+
+
+def number_ranges(commands):
+    # index of the range state of commands with two addresses
+    range_count = 0
+    for command in commands:
+        if command.address2:
+            command.range_index = range_count
+            range_count += 1
+
+
+def accumulations(commands):
+    # return the reasons why the pattern or hold space may grow over many
+    # lines: N in a loop of the script, as in :a;N;$!ba, H and G. Commands
+    # ending the cycle stop the loops: sliding windows like $!N;P;D are not
+    # loops.
+    reasons = sorted(set(command.function for command in commands) & set('GH'))
+    if n_in_loop(commands):
+        reasons.insert(0, 'N in a loop')
+    return reasons
+
+
+def n_in_loop(commands):
+    for command in commands:
+        if command.function != 'N':
+            continue
+        seen = set()
+        todo = [command.next, command.branch]
+        while todo:
+            target = todo.pop()
+            if target is None or target in seen or target.function in 'dDq':
+                continue
+            if target is command:
+                return True
+            seen.add(target)
+            todo.append(target.next)
+            todo.append(target.branch)
+    return False
+
+
+# commands which may enlarge the pattern or hold space
+SPACE_COMMANDS = frozenset('nNDgGhHxs')
+
+
+def memory_step(command, step, budget):
+    def measured_step(ctx):
+        next_step = step(ctx)
+        ctx.check_space_size(budget, command)
+        return next_step
+    return measured_step
+
+
+def budget_step(command, step):
+    import time
+    clock = time.perf_counter
+
+    def timed_step(ctx):
+        ctx.current_command = command
+        next_step = step(ctx)
+        if clock() > ctx.deadline:
+            raise TimeBudgetExceeded()
+        return next_step
+    return timed_step
+
+
+class AddressScan:
+    # single search of the pattern space with the alternation of the regexps
+    # of the inlined address tests. When it fails, none of the regexps can
+    # match and their searches are skipped. Regexps anchored at start are
+    # matched apart: mixed with the other ones, they would prevent the regexp
+    # engine from skipping the positions where no alternative can start.
+    # Regexps with backreferences, whose groups would be renumbered, and
+    # regexps run by the nfa engine are left out.
+
+    __slots__ = ('regexps', 'prefix', 'compiled')
+
+    @staticmethod
+    def factory(commands):
+        regexps = []
+        for command in commands:
+            regexp = command.inlined_regexp()
+            if (regexp is not None and regexp not in regexps and
+                    regexp.engine == 're'):
+                if not has_backreference(regexp.pattern):
+                    regexps.append(regexp)
+        if len(regexps) < 2:
+            return None
+        try:
+            return AddressScan(regexps)
+        except re.error:
+            return None
+
+    def __init__(self, regexps):
+        self.regexps = regexps
+        anchored, other = [], []
+        for regexp in regexps:
+            if regexp.analyze()[0]:
+                anchored.append(scan_alternative(regexp, regexp.pattern[1:]))
+            else:
+                other.append(scan_alternative(regexp, regexp.pattern))
+        self.prefix = re.compile('|'.join(anchored), re.DOTALL) if anchored else None
+        self.compiled = re.compile('|'.join(other), re.DOTALL) if other else None
+
+    def search(self, string):
+        # False if no regexp matches string
+        if self.prefix is not None and self.prefix.match(string) is not None:
+            return True
+        return self.compiled is not None and self.compiled.search(string) is not None
+
+
+def scan_alternative(regexp, pattern):
+    return ('(?i:%s)' if regexp.ignore_case else '(?:%s)') % pattern
+
+
+def has_backreference(pattern):
+    # True if the python regexp contains a reference to one of its groups.
+    # Opcodes are singletons, compared by identity with the parsed items.
+    def walk(value):
+        if isinstance(value, tuple) and value and (
+                value[0] is sre_parse.GROUPREF or
+                value[0] is sre_parse.GROUPREF_EXISTS):
+            return True
+        if isinstance(value, (list, tuple, sre_parse.SubPattern)):
+            return any(walk(item) for item in value)
+        return False
+
+    try:
+        return walk(sre_parse.parse(pattern))
+    except Exception:
+        return True
 
 
 class Regexp:
-    # note that compile = False does not work for python 2.6 and below due to
-    # re.subn lacking the flag parameter
-    compile = True
+    # conversion to python syntax and compilation are done on first use. Only
+    # a cheap syntax check is done when the regexp is created. With the nfa
+    # engine, the regexp is compiled into an NFAPattern, whose searches take a
+    # time linear in the length of the string, unless it is a literal or uses
+    # backreferences.
+
+    __slots__ = ('source', 'extended', 'ignore_case', 'engine', 'flags',
+                 'converted', 'compiled', 'empty', 'required', 'matcher')
 
     @staticmethod
-    def factory(pattern, extended, ignore_case):
+    def factory(pattern, extended, ignore_case, regexps=None, engine='re'):
+        # regexps, if given, collects the regexps of a script. Identical
+        # regexps are shared by all scripts through the regexp cache.
         if pattern == '':
             return None
-        else:
-            return Regexp(pattern, extended, ignore_case)
-
-    def __init__(self, pattern, extended, ignore_case):
-        self.pattern = convert_regexp(pattern, extended)
+        key = (pattern, extended, ignore_case, engine)
+        if regexps is not None and key in regexps:
+            return regexps[key]
+        regexp = REGEXP_CACHE.get(key)
+        if regexp is None:
+            regexp = Regexp(pattern, extended, ignore_case, engine)
+            REGEXP_CACHE.put(key, regexp)
+        if regexps is not None:
+            regexps[key] = regexp
+        return regexp
+
+    def __init__(self, pattern, extended, ignore_case, engine='re'):
+        check_regexp(pattern, extended)
+        self.source = pattern
+        self.extended = extended
         self.ignore_case = ignore_case
+        self.engine = engine
         self.flags = re.DOTALL | (re.IGNORECASE if ignore_case else 0)
-        if Regexp.compile:
+        self.converted = None
+        self.compiled = None
+        self.empty = None
+        self.required = ()
+        self.matcher = None
+
+    @property
+    def pattern(self):
+        # python syntax of the regexp
+        if self.converted is None:
+            self.converted = convert_regexp(self.source, self.extended)
+        return self.converted
+
+    def compile(self):
+        if self.compiled is None:
             try:
-                self.compiled = re.compile(self.pattern, self.flags)
+                compiled = re.compile(self.pattern, self.flags)
             except re.error as e:
-                raise SedException('regexp: %s' % e.message)
-            except:
-                raise
+                raise SedException('regexp: %s' % e)
+            self.required = self.required_literals()
+            self.matcher = LiteralMatcher.factory(self, compiled)
+            if self.engine == 'nfa' and self.matcher is None:
+                try:
+                    compiled = NFAPattern(self.pattern, self.flags)
+                except NFAError:
+                    # backreferences: the re engine is used
+                    pass
+            self.compiled = compiled
+        return self.compiled
+
+    def backtracking_risks(self):
+        # shapes of the regexp which may make re backtrack for an exponential
+        # time
+        source = self.source if self.extended else reverse_slash(self.source)
+        try:
+            return backtracking_risks(source)
+        except Exception:
+            return []
+
+    def required_literals(self):
+        # literals which are part of any match, searched before running the
+        # regexp engine
+        if self.ignore_case or analyze_regexp(self.pattern)[1] is not None:
+            # a literal regexp is searched as fast as its literal
+            return ()
+        source = self.source if self.extended else reverse_slash(self.source)
+        try:
+            return tuple(required_literals(source))
+        except Exception:
+            # regast is less permissive than the conversion to python
+            return ()
+
+    def analyze(self):
+        # return (anchored at start, literal text or None, anchored at end)
+        return analyze_regexp(self.pattern)
+
+    def __reduce__(self):
+        # the converted regexp is saved but not the compiled one
+        return restore_regexp, (self.source, self.extended, self.ignore_case,
+                                int(self.flags), self.pattern, self.engine)
+
+    def search(self, string):
+        # return the first match or None
+        compiled = self.compiled or self.compile()
+        if self.matcher is not None:
+            return self.matcher.search(string)
+        for literal in self.required:
+            if literal not in string:
+                return None
+        return compiled.search(string)
+
+    def matches_empty(self):
+        # True if the regexp may match an empty string somewhere
+        if self.empty is None:
+            compiled = self.compiled or self.compile()
+            self.empty = sre_parse.parse(compiled.pattern, compiled.flags).getwidth()[0] == 0
+        return self.empty
+
+    def subn(self, repl, string, count, first=None):
+        # first is the result of a previous search of the regexp in string,
+        # if known
+        compiled = self.compiled or self.compile()
+        if repl.max_group > compiled.groups:
+            raise SedException("invalid reference \\%d on `s' command's RHS" %
+                               repl.max_group)
+        if self.matcher is not None and count != 1:
+            # re.subn is as fast for the first match only
+            return self.matcher.subn(repl, string, count, first)
+        for literal in self.required:
+            if literal not in string:
+                return False, string
+        if first is not None and first.re is not compiled:
+            first = None
+        if first is not None and count == 1:
+            start, end = first.span()
+            return True, string[:start] + repl.expand(first) + string[end:]
+        elif (compiled.__class__ is not NFAPattern and
+              (count == 1 or (count == 0 and not self.matches_empty()))):
+            # re semantics are the same as sed ones
+            string, nsubst = compiled.subn(repl.template, string, count)
+            return nsubst > 0, string
         else:
-            self.compiled = None
+            return re_sub_ex(compiled, repl, string, count, first)
+
+
+class LiteralMatcher:
+    # regexp made of a non empty literal, possibly anchored, searched and
+    # replaced with string methods. The regexp engine is only run at the
+    # position of a match to return a genuine match object. $ is converted
+    # to \Z: a literal anchored at end is a suffix of the string.
+
+    __slots__ = ('compiled', 'literal', 'length')
+
+    method = 'str.find'
+
+    @staticmethod
+    def factory(regexp, compiled):
+        if regexp.ignore_case:
+            return None
+        start, literal, end = regexp.analyze()
+        if not literal:
+            return None
+        if start and end:
+            return WholeMatcher(compiled, literal)
+        elif start:
+            return PrefixMatcher(compiled, literal)
+        elif end:
+            return SuffixMatcher(compiled, literal)
+        else:
+            return LiteralMatcher(compiled, literal)
+
+    def __init__(self, compiled, literal):
+        self.compiled = compiled
+        self.literal = literal
+        self.length = len(literal)
+
+    def find(self, string, pos=0):
+        # return the index of the first match from pos or -1
+        return string.find(self.literal, pos)
+
+    def search(self, string):
+        index = string.find(self.literal)
+        return None if index < 0 else self.compiled.match(string, index)
+
+    def subn(self, repl, string, count, first=None):
+        literal = self.literal
+        if count == 0 and self.__class__ is LiteralMatcher:
+            if literal not in string:
+                return False, string
+            return True, string.replace(literal, repl.expand_groups(literal, {}))
+
+        # an anchored literal matches at most once, otherwise the count-th
+        # occurrence is replaced
+        if first is not None and first.re is self.compiled:
+            index = first.start()
+        else:
+            index = self.find(string)
+        while count > 1 and index >= 0:
+            index = self.find(string, index + self.length)
+            count -= 1
+        if index < 0:
+            return False, string
+        text = repl.literal if repl.literal is not None else repl.expand_groups(literal, {})
+        return True, string[:index] + text + string[index + self.length:]
+
+
+class PrefixMatcher(LiteralMatcher):
+    __slots__ = ()
+
+    method = 'str.startswith'
+
+    def find(self, string, pos=0):
+        return 0 if pos == 0 and string.startswith(self.literal) else -1
+
+    def search(self, string):
+        return self.compiled.match(string) if string.startswith(self.literal) else None
+
+
+class SuffixMatcher(LiteralMatcher):
+    __slots__ = ()
+
+    method = 'str.endswith'
+
+    def find(self, string, pos=0):
+        index = len(string) - self.length
+        return index if index >= pos and string.endswith(self.literal) else -1
+
+    def search(self, string):
+        if string.endswith(self.literal):
+            return self.compiled.match(string, len(string) - self.length)
+        return None
+
+
+class WholeMatcher(LiteralMatcher):
+    __slots__ = ()
+
+    method = 'str.__eq__'
+
+    def find(self, string, pos=0):
+        return 0 if pos == 0 and string == self.literal else -1
 
     def search(self, string):
-        if self.compiled:
-            m = self.compiled.search(string)
+        return self.compiled.match(string) if string == self.literal else None
+
+
+# literal characters of python regexps: characters other than operators and
+# escaped characters other than classes and anchors (\n and \t are literal)
+RE_LITERAL_BODY = re.compile(r'(?:[^\\.^$*+?{}\[\]|()]|\\[^A-Za-z0-9]|\\[nt])*')
+
+def analyze_regexp(pattern):
+    # conservative analysis of a python regexp: return (anchored at start,
+    # literal text or None, anchored at end)
+    start = pattern.startswith('^')
+    body = pattern[1:] if start else pattern
+
+    end = False
+    if body.endswith('\\Z'):
+        stripped = body[:-2]
+        if (len(stripped) - len(stripped.rstrip('\\'))) % 2 == 0:
+            end = True
+            body = stripped
+
+    if RE_LITERAL_BODY.fullmatch(body):
+        literal = re.sub(r'\\(.)', lambda m: {'n': '\n', 't': '\t'}.get(m.group(1), m.group(1)), body)
+    else:
+        literal = None
+        if '|' in body:
+            # anchors may apply to one alternative only
+            start = end = False
+
+    return start, literal, end
+
+def explain_regexp(regexp):
+    if regexp is None:
+        return 'empty regexp, last regexp used at execution time'
+    start, literal, end = regexp.analyze()
+    kinds = []
+    if start or end:
+        kinds.append('anchored at %s' % ' and '.join(
+            ['start'] * start + ['end'] * end))
+    if literal is not None:
+        kinds.append('literal %r' % literal)
+    if regexp.ignore_case:
+        kinds.append('ignore case')
+    if not kinds:
+        kinds.append('regexp')
+    if literal is None and not regexp.ignore_case:
+        required = regexp.required_literals()
+        if required:
+            kinds.append('prefilter %s' % ' '.join(repr(text) for text in required))
+    if regexp.engine == 're':
+        kinds.extend('backtracking risk: %s' % risk
+                     for risk in regexp.backtracking_risks())
+    else:
+        if isinstance(regexp.compile(), NFAPattern):
+            kinds.append('nfa engine')
         else:
-            m = re.search(self.pattern, string, flags=self.flags)
-        return m is not None
+            kinds.append('re engine (literal or backreferences)')
+    return '%r %s' % (regexp.pattern, ', '.join(kinds))
+
+def explain_matcher(name, regexp):
+    # note on the string method replacing the regexp engine, if any
+    matcher = None if regexp is None else LiteralMatcher.factory(regexp, None)
+    if matcher is None:
+        return []
+    return ['fast path: %s searched with %s' % (name, matcher.method)]
+
+
+def restore_regexp(source, extended, ignore_case, flags, converted, engine):
+    # unpickle a regexp, shared with the regexp cache. It has already been
+    # checked and converted when it was pickled.
+    key = (source, extended, ignore_case, engine)
+    regexp = REGEXP_CACHE.get(key)
+    if regexp is None:
+        regexp = Regexp.__new__(Regexp)
+        regexp.source = source
+        regexp.extended = extended
+        regexp.ignore_case = ignore_case
+        regexp.engine = engine
+        regexp.flags = flags
+        regexp.converted = converted
+        regexp.compiled = None
+        regexp.empty = None
+        regexp.required = ()
+        regexp.matcher = None
+        REGEXP_CACHE.put(key, regexp)
+    return regexp
+
+
+REGEXP_ENGINES = ('re', 'nfa')
+
+
+RegexpCacheInfo = collections.namedtuple('RegexpCacheInfo',
+                                         'hits misses maxsize currsize')
+
+
+class RegexpCache:
+    # process-wide LRU cache of regexps, keyed by (pattern, extended,
+    # ignore_case, engine). Regexps are shared by all Sed instances and programs,
+    # their lazy conversion and compilation are done once.
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.regexps = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            regexp = self.regexps.get(key)
+            if regexp is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.regexps.move_to_end(key)
+            return regexp
+
+    def put(self, key, regexp):
+        with self.lock:
+            if self.maxsize <= 0:
+                return
+            self.regexps[key] = regexp
+            while len(self.regexps) > self.maxsize:
+                self.regexps.popitem(last=False)
+
+    def info(self):
+        with self.lock:
+            return RegexpCacheInfo(self.hits, self.misses, self.maxsize,
+                                   len(self.regexps))
+
+    def clear(self):
+        with self.lock:
+            self.regexps.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def resize(self, maxsize):
+        with self.lock:
+            self.maxsize = maxsize
+            while len(self.regexps) > max(maxsize, 0):
+                self.regexps.popitem(last=False)
+
+
+REGEXP_CACHE = RegexpCache(maxsize=1024)
 
-    def subn(self, repl, string, count):
-        return re_sub_ex(self.pattern, self.compiled, repl, string, count, self.flags)
+
+def regexp_cache_info():
+    """Return hits, misses, maxsize and current size of the regexp cache."""
+    return REGEXP_CACHE.info()
+
+
+def regexp_cache_clear():
+    """Empty the regexp cache and reset its counters."""
+    REGEXP_CACHE.clear()
+
+
+def set_regexp_cache_size(maxsize):
+    """Set the maximum number of regexps kept in cache, 0 to disable it."""
+    REGEXP_CACHE.resize(maxsize)
 
 
 # -- Parser ------------------------------------------------------------------
 
 
+# The parser works on indices in the packed lines of the script: the parsing
+# functions receive a line and the index of the first character to parse, and
+# return the index of the first character after what they parsed. Lines are
+# never sliced while parsing, which keeps parsing linear for long lines.
+
+RE_COMMENT_LINE = re.compile('^[ \t]*#.*')
+RE_SPACES = re.compile('[ \t]*')
+RE_NUMBER = re.compile('[0-9]+')
+RE_CHARSET = re.compile('\\[([^^]|\\^.)[^]]*\\]')
+RE_FLAGS_S = re.compile('(([pgiI]|[0-9]+)*)(w (.*))?$')
+
 def pack_script(script):
     # remove comments
     # comments following commands are removed during parsing
-    script = [re.sub('^[ \t]*#.*', '', line) for line in script]
+    script = [RE_COMMENT_LINE.sub('', line) for line in script]
 
     # remove trailing spaces
     script = [line.rstrip() for line in script]
 
-    # join lines ending with '\'
+    # join lines ending with '\'. Pieces of joined lines are collected before
+    # being joined once.
     packed = []
+    pieces = []
     for line in script:
-        if packed and packed[-1].endswith('\\'):
-            packed[-1] = packed[-1][:-1] + '\n' + line
+        if pieces:
+            pieces.append(line)
         else:
-            packed.append(line)
+            pieces = [line]
+        if line.endswith('\\'):
+            pieces[-1] = line[:-1]
+        else:
+            packed.append('\n'.join(pieces))
+            pieces = []
 
     # particular case of last line of script ending with slash
-    if packed and packed[-1].endswith('\\'):
-        packed[-1] = packed[-1][:-1] + '\n'
+    if pieces:
+        packed.append('\n'.join(pieces) + '\n')
 
     return packed
 
-def parse_script(script):
+def parse_script(script, natives=None):
+    # natives maps the names of registered commands to their functions
     try:
         commands = []
         for line in script:
-            while len(line) > 0:
-                i, command = parse_command(line)
+            i = 0
+            while i < len(line):
+                i, command = parse_command(line, i, natives)
                 if command is None:
                     pass
                 else:
                     commands.append(command)
-                line = line[i:]
+
+        for num, command in enumerate(commands, 1):
+            command.num = num
 
         link_commands(commands)
         return commands
@@ -889,9 +2668,90 @@ def link_commands(commands):
             pass
 
 
-def parse_command(line):
+def optimize_commands(commands, first_cmd):
+    # peephole optimization of the linked commands:
+    # - branch chains are threaded through no-op commands (labels, block ends,
+    #   unaddressed blocks and unconditional branches)
+    # - consecutive unaddressed y commands are fused into one table
+    # - runs of unaddressed literal s///g commands are fused into one pass
+    # - commands which cannot be reached any more are removed
+    # return the remaining commands, the first one, and the list of removed
+    # commands with the reason of their removal
+
+    def jump_target(command):
+        # return the command really executed when jumping to command
+        seen = set()
+        while command is not None and is_jump(command):
+            if command in seen:
+                # loop of no-op commands, keep it as it is
+                return command
+            seen.add(command)
+            if command.address1 is None and command.negate:
+                command = command.next
+            elif command.function in ':}':
+                command = command.next
+            else:
+                command = command.branch
+        return command
+
+    for command in commands:
+        command.next = jump_target(command.next)
+        command.branch = jump_target(command.branch)
+    first_cmd = jump_target(first_cmd)
+
+    # count references to find commands which are not branch targets
+    refs = dict((command, 0) for command in commands)
+    refs[first_cmd] = 1
+    for command in commands:
+        for target in (command.next, command.branch):
+            if target is not None:
+                refs[target] += 1
 
-    i, address1, address2, negate = parse_addresses(line, 0)
+    fused = dict()
+    for command in commands:
+        if command in fused:
+            continue
+        while (command.next is not None and refs[command.next] == 1 and
+               command.can_fuse(command.next)):
+            fused[command.next] = command
+            command.fuse(command.next)
+            command.next = command.next.next
+
+    # keep reachable commands in script order
+    reachable = set()
+    todo = [first_cmd]
+    while todo:
+        command = todo.pop()
+        if command is not None and command not in reachable:
+            reachable.add(command)
+            todo.append(command.next)
+            todo.append(command.branch)
+
+    removed = []
+    for command in commands:
+        if command in fused:
+            removed.append((command, 'fused into %03d' % fused[command].num))
+        elif command not in reachable:
+            removed.append((command, 'no-op' if is_jump(command) else 'unreachable'))
+
+    commands = [command for command in commands if command in reachable]
+    return commands, first_cmd, removed
+
+def is_jump(command):
+    # test if command does nothing else than going to another command
+    if command.address1 is None:
+        return command.negate or command.function in ':}{b'
+    else:
+        return command.function in ':}'
+
+def is_plain_y(command):
+    return (command is not None and command.function == 'y' and
+            command.address1 is None and not command.negate)
+
+
+def parse_command(line, i, natives=None):
+
+    i, address1, address2, negate = parse_addresses(line, i)
     i, function = parse_function(line, i)
 
     if function is None or function in '#;':
@@ -901,15 +2761,14 @@ def parse_command(line):
         else:
             return i, None
 
-    command = Command.factory(address1, address2, negate, function)
+    command = Command.factory(address1, address2, negate, function, natives)
 
     i = command.parse_arguments(line, i)
 
     return i, command
 
 def ignore_space(s, i):
-    m = re.match('([ \t]*)', s[i:])
-    j = i + m.end(1)
+    j = RE_SPACES.match(s, i).end()
     if j >= len(s):
         return j, None
     else:
@@ -1005,7 +2864,7 @@ def parse_arguments_s(line, i):
 
     i, tail = parse_tail_of_command(line, i)
 
-    m = re.match('(([pgiI]|[0-9]+)*)(w (.*))?$', tail)
+    m = RE_FLAGS_S.match(tail)
     if m is None:
         raise SedException('regexp: incorrect flags: %s' % tail)
 
@@ -1033,7 +2892,7 @@ def parse_arguments_s(line, i):
     return i, [left, right, count, printit, ignore_case, write, filename]
 
 def parse_arguments_y(line, i):
-    if not line:
+    if i >= len(line):
         raise SedException('y: unterminated command')
 
     sep = line[i]
@@ -1082,9 +2941,9 @@ def parse_tail_of_command(line, i):
         return len(line), tail
 
 def parse_number(line, i):
-    m = re.match('([0-9]+)', line[i:])
+    m = RE_NUMBER.match(line, i)
     if m:
-        return i + m.end(1), int(m.group(1))
+        return m.end(), int(m.group())
     else:
         return i, None
 
@@ -1121,9 +2980,9 @@ def parse_charset(s, i):
     # return position of closing bracket
     # handle []...] and [^]...]
 
-    m = re.match('\[([^^]|\^.)[^]]*\]', s[i:])
+    m = RE_CHARSET.match(s, i)
     if m:
-        return i + len(m.group(0)) - 1
+        return m.end() - 1
     else:
         raise SedException('regexp: charset not closed')
 
@@ -1150,6 +3009,143 @@ def parse_replacement(s, i, delim):
 # -- Conversion from sed syntax to python syntax -----------------------------
 
 
+# Syntax check of regexp
+
+# tokens are escaped characters, charsets, runs of ordinary characters and
+# single special characters
+RE_REGEXP_TOKEN = re.compile(r'\\.?|\[([^^]|\^.)[^]]*\]|[^\\[(){}|*+?^]+|.',
+                             re.DOTALL)
+
+def check_regexp(regexp, extended):
+    # cheap check of the errors which would be raised when converting or
+    # compiling the regexp, done without converting it. Errors missed here
+    # are reported when the regexp is compiled on first use.
+
+    opened = 0          # number of groups opened so far
+    stack = []          # numbers of groups currently open
+    closed = set()      # numbers of closed groups
+    previous = 'start'  # start, open, alt, anchor, atom, quantifier
+    braces = None       # content of braces being parsed
+    repeated = None     # previous before the braces
+
+    for m in RE_REGEXP_TOKEN.finditer(regexp):
+        token = m.group(0)
+
+        # operator or None if token is an atom
+        if token == '\\':
+            raise SedException('regexp: illegal syntax')
+        elif token[0] == '\\' and token[1] in '(){}|+?':
+            operator = token[1] if not extended else None
+        elif token[0] == '\\' and token[1] in '123456789':
+            if int(token[1]) not in closed:
+                raise SedException('regexp: invalid reference %s' % token)
+            operator = None
+        elif len(token) == 1 and token in '(){}|+?':
+            operator = token if extended else None
+        elif token == '*':
+            operator = token
+        elif token == '^' and previous in ('start', 'open', 'alt'):
+            operator = '^'
+        elif token[0] == '[' and len(token) > 1:
+            check_charset(regexp, m.start())
+            operator = None
+        else:
+            operator = None
+
+        if braces is not None:
+            # inside quantifier braces
+            if operator == '}' and braces == '':
+                # python takes empty braces as literal characters
+                braces = None
+                previous = 'atom'
+                continue
+            elif operator == '}':
+                check_braces(regexp, braces, repeated)
+                braces = None
+                previous = 'quantifier'
+                continue
+            elif not token.strip('0123456789,'):
+                braces += token
+                continue
+            else:
+                # python takes invalid braces as literal characters
+                braces = None
+                previous = 'atom'
+
+        if operator == '{':
+            # python takes braces with something else than bounds as
+            # literal characters, they are checked when closed
+            if previous == 'quantifier':
+                raise SedException('regexp: multiple quantifier ' + regexp)
+            braces = ''
+            repeated = previous
+        elif operator in ('*', '+', '?'):
+            if previous == 'quantifier':
+                raise SedException('regexp: multiple quantifier ' + regexp)
+            elif previous in ('start', 'open', 'alt', 'anchor'):
+                raise SedException('regexp: nothing to repeat ' + regexp)
+            else:
+                previous = 'quantifier'
+        elif operator == '(':
+            opened += 1
+            stack.append(opened)
+            previous = 'open'
+        elif operator == ')':
+            if not stack:
+                raise SedException('regexp: unbalanced parenthesis ' + regexp)
+            closed.add(stack.pop())
+            previous = 'atom'
+        elif operator == '|':
+            previous = 'alt'
+        elif operator == '^':
+            previous = 'anchor'
+        else:
+            previous = 'atom'
+
+    if stack:
+        raise SedException('regexp: missing ) ' + regexp)
+
+
+def check_braces(regexp, braces, repeated):
+    # bounds of a quantifier, as checked by re
+    if repeated != 'atom':
+        raise SedException('regexp: nothing to repeat ' + regexp)
+    bounds = braces.split(',')
+    if len(bounds) == 2 and bounds[0] and bounds[1]:
+        if int(bounds[0]) > int(bounds[1]):
+            raise SedException('regexp: min repeat greater than max repeat ' + regexp)
+
+
+def check_charset(regexp, i):
+    # ranges of the charset starting at i, as checked by re once converted:
+    # \n and \t are characters, other backslashes are literal
+    try:
+        end = parse_charset(regexp, i)
+    except SedException:
+        return
+    body = regexp[i + 1:end]
+    if body.startswith('^'):
+        body = body[1:]
+    chars = []          # characters and their source
+    j = 0
+    while j < len(body):
+        if body[j] == '\\' and body[j + 1:j + 2] in ('n', 't'):
+            chars.append(('\n' if body[j + 1] == 'n' else '\t', body[j:j + 2]))
+            j += 2
+        else:
+            chars.append((body[j], body[j]))
+            j += 1
+    k = 0
+    while k < len(chars):
+        if k + 2 < len(chars) and chars[k + 1][0] == '-':
+            if chars[k][0] > chars[k + 2][0]:
+                raise SedException('regexp: bad character range %s-%s %s'
+                                   % (chars[k][1], chars[k + 2][1], regexp))
+            k += 3
+        else:
+            k += 1
+
+
 # Conversion of regexp
 
 def convert_regexp(regexp, extended):
@@ -1345,69 +3341,475 @@ def convert_argument_y(s):
 # -- Extended substitution ---------------------------------------------------
 
 
-def re_sub_ex(pattern, compiled, replacement, string, count, flags):
-    # re.sub() extended:
-    # - an unmatched group returns an empty string rather than None
-    #   (http://gromgull.net/blog/2012/10/python-regex-unicode-and-brokenness/)
-    # - the nth occurrence is replaced rather than the nth first ones
-    #   (https://mail.python.org/pipermail/python-list/2008-December/475132.html)
-    # - since 3.5, first agument of _expand must be a compiled regex
-
-    class Match():
-        def __init__(self, m):
-            self.m = m
-            self.string = m.string
-        def group(self, n):
-            return self.m.group(n) or ''
-        def start(self, i):
-            return self.m.start(i)
-        def end(self, i):
-            return self.m.end(i)
-
-    class Nth(object):
-        def __init__(self):
-            self.calls = 0
-            self.prevmatch = None
-        def __call__(self, matchobj):
-            if count == 0:
-                match = Match(matchobj)
-                try:
-                    if self.prevmatch and match.group(0) == '' and match.start(0) == self.prevmatch.end(0):
-                        return match.group(0)
-                    else:
-                        return re._expand(compiled, match, replacement)
-                finally:
-                    self.prevmatch = match
+class Replacement:
+    # replacement of s command in python syntax, precompiled into a list of
+    # literal strings and group numbers
+
+    __slots__ = ('template', 'parts', 'literal', 'max_group')
+
+    def __init__(self, template):
+        self.template = template
+        self.parts = []
+        for m in RE_TEMPLATE_PART.finditer(template):
+            group, char, text = m.group(1) or m.group(2), m.group(3), m.group(4)
+            if group is not None:
+                self.parts.append(int(group))
+            elif char is not None:
+                self.append_text(TEMPLATE_ESCAPES.get(char, char))
             else:
-                self.calls += 1
-                if self.calls == count:
-                    return re._expand(compiled, Match(matchobj), replacement)
-                else:
-                    return matchobj.group(0)
+                self.append_text(text)
+
+        groups = [part for part in self.parts if isinstance(part, int)]
+        self.max_group = max(groups) if groups else 0
+        self.literal = None if groups else ''.join(self.parts)
+
+    def append_text(self, text):
+        if self.parts and isinstance(self.parts[-1], str):
+            self.parts[-1] += text
+        else:
+            self.parts.append(text)
+
+    def expand_groups(self, text, groups):
+        # expansion for a match of text whose groups are known
+        if self.literal is not None:
+            return self.literal
+        return ''.join([part if part.__class__ is str else
+                        text if part == 0 else groups.get(part, '')
+                        for part in self.parts])
+
+    def expand(self, m):
+        # an unmatched group gives an empty string
+        if self.literal is not None:
+            return self.literal
+        return ''.join([part if part.__class__ is str else (m.group(part) or '')
+                        for part in self.parts])
+
+
+class ReplacementHook:
+    # replacement of s command computed by a python function, registered with
+    # Sed.register_replacement
+
+    __slots__ = ('function',)
+
+    def __init__(self, function):
+        self.function = function
+
+    def name(self):
+        return function_name(self.function)
+
+    def expand(self, m):
+        return self.function(m.string, m)
+
+
+def function_name(function):
+    return getattr(function, '__name__', repr(function))
+
+
+# \g<n>, \n, escaped char, text
+RE_TEMPLATE_PART = re.compile(r'\\(?:g<(\d+)>|(\d)|(.))|([^\\]+)', re.DOTALL)
+TEMPLATE_ESCAPES = {'n': '\n'}
+
 
+# Batches of literal substitutions
+
+# characters making a sed regexp more than literals, groups and alternations
+RE_NOT_LITERAL = {False: re.compile(r'[.[*^$]|\\[^()|]'),
+                  True: re.compile(r'[.[*^$+?{}]|\\')}
+
+MAX_LITERAL_ALTERNATIVES = 64
+
+def literal_alternatives(pattern):
+    # return the list of (text, groups) of the strings matched by a python
+    # regexp made of literals, groups and alternations, or None. groups
+    # gives the text of the groups matched with text.
     try:
-        if compiled is None:
-            string_res, nsubst = re.subn(pattern, Nth(), string, count, flags)
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return None
+    return expand_alternatives(parsed)
+
+def expand_alternatives(subpattern):
+    results = [('', {})]
+    for op, av in subpattern:
+        if op is sre_parse.LITERAL:
+            alternatives = [(chr(av), {})]
+        elif op is sre_parse.IN and all(item_op is sre_parse.LITERAL
+                                        for item_op, _ in av):
+            alternatives = [(chr(char), {}) for _, char in av]
+        elif op is sre_parse.BRANCH:
+            alternatives = []
+            for branch in av[1]:
+                expanded = expand_alternatives(branch)
+                if expanded is None:
+                    return None
+                alternatives.extend(expanded)
+        elif op is sre_parse.SUBPATTERN and not av[1] and not av[2]:
+            group, subpattern = av[0], av[-1]
+            alternatives = expand_alternatives(subpattern)
+            if alternatives is None:
+                return None
+            if group is not None:
+                for text, groups in alternatives:
+                    groups[group] = text
         else:
-            string_res, nsubst = compiled.subn(Nth(), string, count)
+            return None
 
-    except re.error as e:
-        raise SedException('regexp: %s' % e.message)
-    except:
-        raise
+        if len(results) * len(alternatives) > MAX_LITERAL_ALTERNATIVES:
+            return None
+        results = [(text1 + text2, merge_groups(groups1, groups2))
+                   for text1, groups1 in results
+                   for text2, groups2 in alternatives]
+    return results
+
+def merge_groups(groups1, groups2):
+    groups = dict(groups1)
+    groups.update(groups2)
+    return groups
+
+def literals_overlap(text1, text2):
+    # test if occurrences of two literals may overlap in some string
+    if text1 in text2 or text2 in text1:
+        return True
+    for i in range(1, min(len(text1), len(text2))):
+        if text1.endswith(text2[:i]) or text2.endswith(text1[:i]):
+            return True
+    return False
+
+
+class LiteralBatch:
+    # run of literal substitutions applied in one pass with an alternation of
+    # all literals. No literal being a prefix of another one, the order of the
+    # alternation does not matter.
+
+    __slots__ = ('rules', 'table', 'last_regexp', 'compiled')
+
+    def __init__(self, rules, regexp):
+        self.rules = []
+        self.table = dict()
+        self.last_regexp = None
+        self.compiled = None
+        self.add(rules, regexp)
+
+    def add(self, rules, regexp):
+        self.rules.extend(rules)
+        self.table.update(rules)
+        self.last_regexp = regexp
+        self.compiled = None
 
-    # nsubst is the number of subst which would have been made without
-    # the redefinition
-    if count == 0:
-        return (nsubst > 0), string_res
+    def pattern(self):
+        return '|'.join(re.escape(text) for text, _ in self.rules)
+
+    def __getstate__(self):
+        return self.rules, self.table, self.last_regexp
+
+    def __setstate__(self, state):
+        self.rules, self.table, self.last_regexp = state
+        self.compiled = None
+
+    def subn(self, string):
+        if self.compiled is None:
+            self.compiled = re.compile(self.pattern(), re.DOTALL)
+        table = self.table
+        return self.compiled.subn(lambda m: table[m.group()], string)
+
+
+def re_sub_ex(compiled, replacement, string, count, first=None):
+    # re.subn() with sed semantics, used when they differ from python ones:
+    # - an empty match just after the previous match is not a match
+    # - the nth occurrence is replaced rather than the nth first ones
+    # first is the first match if already known.
+    # return True if a substitution has been made and the resulting string
+
+    if first is None or first.start() == first.end():
+        # after an empty match, the next one is searched from the same
+        # position, which finditer does only when scanning from the start
+        matches = compiled.finditer(string)
     else:
-        return (nsubst >= count), string_res
+        matches = itertools.chain([first], compiled.finditer(string, first.end()))
+
+    pieces = []
+    pos = 0
+    previous_end = -1
+    nmatch = 0
+    for m in matches:
+        start, end = m.span()
+        if start == end == previous_end:
+            continue
+        previous_end = end
+        nmatch += 1
+        if count == 0:
+            pieces.append(string[pos:start])
+            pieces.append(replacement.expand(m))
+            pos = end
+        elif nmatch == count:
+            return True, string[:start] + replacement.expand(m) + string[end:]
+
+    if count == 0 and nmatch > 0:
+        pieces.append(string[pos:])
+        return True, ''.join(pieces)
+    else:
+        return False, string
+
+
+# -- Idioms ------------------------------------------------------------------
+
+
+# Well-known one-liners are recognized by the shape of their commands, once
+# parsed, linked and converted, and run by python functions reading and
+# printing lines through the context. Their output is the one of the
+# commands, with or without autoprint.
+
+IDIOM_TEMPLATES = (
+    # name, script, function. The replacement of the s command of join is
+    # any literal text, the separator of the joined lines.
+    ('uniq', r'$!N;/^\(.*\)\n\1$/!P;D', 'run_uniq'),
+    ('tac', '1!G;h;$!d', 'run_tac'),
+    ('join', r':a;N;$!ba;s/\n/ /g', 'run_join'),
+    ('line count', '$=', 'run_line_count'),
+    ('last line', '$!d', 'run_last_line'),
+)
+
+# shapes of the templates, computed on first use
+IDIOM_SHAPES = []
+
+
+class Idiom:
+    # recognized one-liner: python function run with the context and the
+    # argument of the idiom (separator of joined lines, number of lines)
+
+    __slots__ = ('name', 'function', 'argument')
+
+    def __init__(self, name, function, argument=None):
+        self.name = name
+        self.function = function
+        self.argument = argument
+
+    def __str__(self):
+        return self.name
+
+    def run(self, ctx):
+        self.function(ctx, self.argument)
+
+
+def recognize_idiom(commands):
+    # return the Idiom run by the commands, parsed, linked and converted, or
+    # None
+    if not IDIOM_SHAPES:
+        for name, template, function in IDIOM_TEMPLATES:
+            template_commands = parse_script(pack_script(template.split('\n')))
+            for command in template_commands:
+                command.convert(False, UncachedRegexps())
+            IDIOM_SHAPES.append((name, script_shape(template_commands),
+                                 globals()[function]))
+
+    shape = script_shape(commands)
+    for name, idiom_shape, function in IDIOM_SHAPES:
+        if name == 'join':
+            # the replacement is the last item of the shape of s
+            command = commands[-1]
+            if (len(shape) == len(idiom_shape) and
+                    shape[:-1] == idiom_shape[:-1] and
+                    shape[-1][:-1] == idiom_shape[-1][:-1] and
+                    command.repl.literal is not None):
+                return Idiom('join lines with %r' % command.repl.literal,
+                             function, command.repl.literal)
+        elif shape == idiom_shape:
+            return Idiom(name, function)
+
+    # Nq
+    if len(commands) == 1:
+        command = commands[0]
+        if (command.function == 'q' and command.address2 is None and
+                isinstance(command.address1, AddressNumber) and
+                command.address1.number > 0 and not command.negate):
+            return Idiom('head (%d lines)' % command.address1.number, run_head,
+                         command.address1.number)
+    return None
+
+
+class UncachedRegexps(dict):
+    # regexps of a script created apart from the regexp cache, see
+    # Regexp.factory
+
+    def __contains__(self, key):
+        if not dict.__contains__(self, key):
+            self[key] = Regexp(*key)
+        return True
+
+
+def script_shape(commands):
+    # comparable description of the commands: addresses, function and
+    # arguments, with branches given by index
+    index = dict((command, i) for i, command in enumerate(commands))
+    index[None] = -1
+
+    def address_shape(address):
+        if isinstance(address, AddressRegexp):
+            regexp = address.regexp
+            return ('/', None if regexp is None else regexp.pattern,
+                    address.ignore_case)
+        return None if address is None else str(address)
+
+    shape = []
+    for command in commands:
+        item = (command.__class__, address_shape(command.address1),
+                address_shape(command.address2), command.negate)
+        if isinstance(command, Command_s):
+            item += (None if command.regexp is None else command.regexp.pattern,
+                     command.count, command.printit, command.ignore_case,
+                     command.write, command.hook, command.repl.template)
+        elif isinstance(command, Command_native):
+            item += (command.native,)
+        elif command.function in 'bt{':
+            item += (index[command.branch],)
+        elif command.function != ':':
+            item += (command.args,)
+        shape.append(item)
+    return shape
+
+
+def run_uniq(ctx, argument):
+    # consecutive identical lines are printed once, P prints even without
+    # autoprint
+    previous = ctx.readline()
+    if previous is None:
+        return
+    line = ctx.readline()
+    while line is not None:
+        if line != previous:
+            ctx.printline(previous)
+        previous = line
+        line = ctx.readline()
+    ctx.printline(previous)
+
+
+def read_lines(ctx):
+    lines = []
+    line = ctx.readline()
+    while line is not None:
+        lines.append(line)
+        line = ctx.readline()
+    return lines
+
+
+def run_tac(ctx, argument):
+    # the reversed lines are printed at once as the last pattern space
+    lines = read_lines(ctx)
+    if lines and not ctx.no_autoprint:
+        lines.reverse()
+        ctx.printline('\n'.join(lines))
+
+
+def run_join(ctx, separator):
+    # a single line is printed by N at end of input
+    lines = read_lines(ctx)
+    if lines and not ctx.no_autoprint:
+        ctx.printline(separator.join(lines))
+
+
+def run_line_count(ctx, argument):
+    # the count is printed before the last line
+    previous = ctx.readline()
+    count = 0
+    while previous is not None:
+        count += 1
+        line = ctx.readline()
+        if line is None:
+            ctx.printline('%d' % count)
+        if not ctx.no_autoprint:
+            ctx.printline(previous)
+        previous = line
+
+
+def run_last_line(ctx, argument):
+    lines = read_lines(ctx)
+    if lines and not ctx.no_autoprint:
+        ctx.printline(lines[-1])
+
+
+def run_head(ctx, count):
+    # q stops reading the input
+    for _ in range(count):
+        line = ctx.readline()
+        if line is None:
+            break
+        if not ctx.no_autoprint:
+            ctx.printline(line)
+
+
+# -- Cache of parsed scripts -------------------------------------------------
+
+
+# Commands are linked by their next and branch attributes. They are pickled
+# as copies where links are replaced by indexes, to avoid deep recursions when
+# pickling long scripts.
+
+def private_cache_dir(cache_dir):
+    # True if the cache directory does not exist yet or may be written only
+    # by the current user. Unix permissions are not checked on Windows.
+    try:
+        stat = os.stat(cache_dir)
+    except OSError:
+        return True
+    return private_stat(stat)
+
+def private_stat(stat):
+    if not hasattr(os, 'getuid'):
+        return True
+    return stat.st_uid == os.getuid() and not stat.st_mode & 0o022
+
+def dump_commands(commands, first_cmd, removed_commands, idiom=None):
+    import copy
+    import pickle
+
+    table = list(commands) + [command for command, _ in removed_commands]
+    index = dict((id(command), i) for i, command in enumerate(table))
+
+    def link(command):
+        if command is None:
+            return None
+        if id(command) not in index:
+            index[id(command)] = len(table)
+            table.append(command)
+        return index[id(command)]
+
+    copies = []
+    i = 0
+    while i < len(table):
+        command = copy.copy(table[i])
+        command.next = link(command.next)
+        command.branch = link(command.branch)
+        copies.append(command)
+        i += 1
+
+    script = (len(commands), copies, link(first_cmd),
+              [(index[id(command)], reason) for command, reason in removed_commands],
+              idiom)
+    return pickle.dumps(script, pickle.HIGHEST_PROTOCOL)
+
+def load_commands(data):
+    import pickle
+
+    count, table, first_index, removed, idiom = pickle.loads(data)
+
+    for command in table:
+        if command.next is not None:
+            command.next = table[command.next]
+        if command.branch is not None:
+            command.branch = table[command.branch]
+
+    commands = table[:count]
+    first_cmd = None if first_index is None else table[first_index]
+    removed_commands = [(table[i], reason) for i, reason in removed]
+    return commands, first_cmd, removed_commands, idiom
 
 
 # -- Main --------------------------------------------------------------------
 
 
 def do_helphtml():
+    import webbrowser
+
     if os.path.isfile('sed.html'):
         helpfile = 'sed.html'
     else:
@@ -1417,11 +3819,14 @@ def do_helphtml():
 
 USAGE = """
 sed.py -h | -H | -v
-       [-n][-r] -f <file> <text file>
-       [-n][-r] -e <string> <text file>
+       [-n][-r][--cache-dir <dir>] -f <file> <text file>
+       [-n][-r][--cache-dir <dir>] -e <string> <text file>
+       [-n][-r] --explain -f <file> | -e <string>
 """
 
 def parse_command_line():
+    import argparse
+
     parser = argparse.ArgumentParser(usage=USAGE, add_help=False)
 
     parser.add_argument('-h', help='show this help message', action='store_true', dest='do_help')
@@ -1432,11 +3837,39 @@ def parse_command_line():
     parser.add_argument("-n", help="print only if requested", action="store_true", dest="no_autoprint")
     parser.add_argument("-r", help="regexp extended", action="store_true", dest="regexp_extended")
     parser.add_argument("-d", help=argparse.SUPPRESS, action="store_true", dest="dump_script")
+    parser.add_argument("--explain", help="show execution plan", action="store_true", dest="explain")
+    parser.add_argument("--cache-dir", help="cache of parsed scripts", action="store", dest="cache_dir", metavar='dir',
+                        default=os.environ.get('PYTHONSED_CACHE_DIR'))
+    parser.add_argument("--no-idioms", help="run well-known one-liners as any script", action="store_false",
+                        dest="idioms")
+    parser.add_argument("--address-scan", help="one scan of regexp addresses per line", action="store_true",
+                        dest="address_scan")
+    parser.add_argument("--regexp-engine", help="engine running the regexps", choices=REGEXP_ENGINES,
+                        dest="regexp_engine", default='re')
+    parser.add_argument("--backtracking-risk", help="regexps prone to catastrophic backtracking",
+                        choices=('ignore', 'warn', 'reject'), dest="backtracking_risk", default='ignore')
+    parser.add_argument("--time-budget", help="maximum time of a cycle in milliseconds", type=float,
+                        dest="time_budget", metavar='ms')
+    parser.add_argument("--memory-budget", help="maximum size of pattern and hold spaces in characters, "
+                        "with an optional suffix k, M or G", type=parse_size, dest="memory_budget", metavar='size')
     parser.add_argument("target", nargs='?', help=argparse.SUPPRESS, default=sys.stdin)
 
     args = parser.parse_args()
     return parser, args
 
+def parse_size(text):
+    import argparse
+    multiplier = 1
+    if text[-1:] in SIZE_SUFFIXES:
+        multiplier = SIZE_SUFFIXES[text[-1]]
+        text = text[:-1]
+    try:
+        return int(text) * multiplier
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid size: %s' % text)
+
+SIZE_SUFFIXES = {'k': 1 << 10, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+
 def main():
     parser, args = parse_command_line()
 
@@ -1444,6 +3877,13 @@ def main():
         sed = Sed()
         sed.no_autoprint = args.no_autoprint
         sed.regexp_extended = args.regexp_extended
+        sed.cache_dir = args.cache_dir
+        sed.address_scan = args.address_scan
+        sed.idioms = args.idioms
+        sed.regexp_engine = args.regexp_engine
+        sed.backtracking_risk = args.backtracking_risk
+        sed.time_budget = args.time_budget
+        sed.memory_budget = args.memory_budget
 
         if args.version:
             print(BRIEF)
@@ -1462,6 +3902,10 @@ def main():
         else:
             raise SedException('too few arguments')
 
+        if args.explain:
+            sed.explain_script()
+            sys.exit(0)
+
         if args.dump_script:
             sed.dump_script()
 
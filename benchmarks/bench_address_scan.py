@@ -0,0 +1,61 @@
+"""
+Benchmark of the combined address scan: a script made of many commands
+guarded by regexp addresses, none of which matches most lines, is run with
+one search per line instead of one search per address.
+
+bench_address_scan.py [number of lines] [number of commands]
+"""
+
+import sys
+import io
+import time
+from PythonSed import Sed
+
+
+def make_script(ncommands):
+    lines = []
+    for i in range(ncommands):
+        if i % 2:
+            lines.append('/code=%d[0-9]\\+x/s/code/CODE/' % i)
+        else:
+            lines.append('/^user%d:/p' % i)
+    return '\n'.join(lines)
+
+def make_input(nlines):
+    lines = []
+    for i in range(nlines):
+        if i % 100 == 0:
+            lines.append('user0: code=1%d login' % i)
+        else:
+            lines.append('INFO request %d served in %dms' % (i, i % 50))
+    return '\n'.join(lines) + '\n'
+
+def measure(script, text, address_scan):
+    sed = Sed()
+    sed.address_scan = address_scan
+    sed.load_string(script)
+    program = sed.compile()
+    elapsed = None
+    for _ in range(3):
+        start = time.perf_counter()
+        output = program.apply(io.StringIO(text), None)
+        elapsed = min(elapsed or 1e9, time.perf_counter() - start)
+    return elapsed, output
+
+def main():
+    nlines = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    ncommands = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    text = make_input(nlines)
+
+    print('%-12s %12s %12s' % ('commands', 'separate (s)', 'scan (s)'))
+    for n in (4, 10, ncommands):
+        script = make_script(n)
+        separate, output1 = measure(script, text, False)
+        scan, output2 = measure(script, text, True)
+        if output1 != output2:
+            print('Failed: different outputs for %d commands' % n)
+            sys.exit(1)
+        print('%-12d %12.3f %12.3f' % (n, separate, scan))
+
+
+main()
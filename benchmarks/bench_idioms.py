@@ -0,0 +1,49 @@
+"""
+Benchmark of the native run of well-known one-liners against the run of
+their commands, on large inputs.
+
+bench_idioms.py [number of lines]
+"""
+
+import sys
+import io
+import time
+from PythonSed import Sed
+
+
+SCRIPTS = (
+    r'$!N; /^\(.*\)\n\1$/!P; D',
+    '1!G;h;$!d',
+    r':a;N;$!ba;s/\n/ /g',
+    '$=',
+    '$!d',
+    '1000q',
+)
+
+def make_input(n):
+    return ''.join('line %d of the input\n' % (i // 2) for i in range(n))
+
+def measure(script, text, idioms):
+    sed = Sed()
+    sed.idioms = idioms
+    sed.load_string(script)
+    program = sed.compile()
+    start = time.perf_counter()
+    output = program.apply(io.StringIO(text), None)
+    return time.perf_counter() - start, output
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    text = make_input(n)
+
+    print('%-28s %12s %12s' % ('script', 'commands (s)', 'native (s)'))
+    for script in SCRIPTS:
+        elapsed_generic, output_generic = measure(script, text, False)
+        elapsed_native, output_native = measure(script, text, True)
+        if output_native != output_generic:
+            print('Failed: different outputs for', script)
+            sys.exit(1)
+        print('%-28s %12.3f %12.3f' % (script, elapsed_generic, elapsed_native))
+
+
+main()
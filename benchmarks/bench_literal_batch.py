@@ -0,0 +1,54 @@
+"""
+Benchmark of runs of literal s///g commands, as in entity or translation
+tables. The optimizer applies such a run in one pass: time per line must
+depend on the length of the line, not on the number of rules.
+
+bench_literal_batch.py [number of lines]
+"""
+
+import sys
+import io
+import time
+from PythonSed import Sed
+
+
+def make_script(nrules):
+    return ['s/&ent%d;/<%d>/g' % (i, i) for i in range(nrules)]
+
+def make_input(nlines, length):
+    words = ['word', '&ent1;', 'text', '&ent7;', 'more', '&nope;']
+    line = ' '.join(words[i % len(words)] for i in range(length // 6))
+    return (line + '\n') * nlines
+
+def measure(nrules, text, optimize):
+    sed = Sed()
+    sed.optimize = optimize
+    sed.load_string_list(make_script(nrules))
+    elapsed = None
+    for _ in range(3):
+        start = time.perf_counter()
+        sed.apply(io.StringIO(text), None)
+        elapsed = min(elapsed or 1e9, time.perf_counter() - start)
+    return elapsed
+
+def main():
+    nlines = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    text = make_input(nlines, 200)
+
+    print('%10s %15s %15s' % ('rules', 'sequential (s)', 'batched (s)'))
+    times = []
+    for nrules in (10, 40, 160):
+        sequential = measure(nrules, text, False)
+        batched = measure(nrules, text, True)
+        times.append(batched)
+        print('%10d %15.3f %15.3f' % (nrules, sequential, batched))
+
+    # 16 times more rules must not cost much more
+    growth = times[-1] / times[0]
+    print('growth of batched time from 10 to 160 rules: %.2f' % growth)
+    if growth > 2:
+        print('Failed: time depends on the number of rules')
+        sys.exit(1)
+
+
+main()
@@ -0,0 +1,69 @@
+"""
+Benchmark of literal regexps: addresses and substitutions whose regexp is a
+literal, possibly anchored, are run with string methods instead of the regexp
+engine.
+
+bench_literal_match.py [number of lines]
+"""
+
+import sys
+import io
+import time
+import PythonSed
+from PythonSed import Sed
+
+
+SCRIPTS = (
+    '/^#/d',
+    r'/\.gz$/p',
+    's/foo/bar/g',
+    's/foo/bar/2',
+    r's/ms$/ milliseconds/',
+)
+
+def make_input(nlines):
+    lines = []
+    for i in range(nlines):
+        if i % 10 == 0:
+            lines.append('# comment %d' % i)
+        else:
+            lines.append('file%d.gz foo food %d foo in %dms' % (i, i, i % 50))
+    return '\n'.join(lines) + '\n'
+
+def measure(script, text, literal):
+    sed = Sed()
+    sed.load_string(script)
+    program = sed.compile()
+    if not literal:
+        for command in program.commands:
+            for regexp in (getattr(command.address1, 'regexp', None),
+                           getattr(command, 'regexp', None)):
+                if regexp is not None:
+                    regexp.compile()
+                    regexp.matcher = None
+    elapsed = None
+    for _ in range(3):
+        start = time.perf_counter()
+        output = program.apply(io.StringIO(text), None)
+        elapsed = min(elapsed or 1e9, time.perf_counter() - start)
+    return elapsed, output
+
+def main():
+    nlines = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    text = make_input(nlines)
+
+    print('%-45s %12s %12s' % ('script', 'regexp (s)', 'string (s)'))
+    for script in SCRIPTS:
+        # regexps are shared through the regexp cache, measure without
+        # string methods first
+        PythonSed.regexp_cache_clear()
+        without, output1 = measure(script, text, False)
+        PythonSed.regexp_cache_clear()
+        with_literal, output2 = measure(script, text, True)
+        if output1 != output2:
+            print('Failed: different outputs for', script)
+            sys.exit(1)
+        print('%-45s %12.3f %12.3f' % (script, without, with_literal))
+
+
+main()
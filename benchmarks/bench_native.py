@@ -0,0 +1,52 @@
+"""
+Benchmark of python functions registered as sed commands: incrementing
+numbers with the s/t loop of incr_num.sed and with a native command. The loop
+runs once per trailing 9, the native command once per line.
+
+bench_native.py [number of lines]
+"""
+
+import sys
+import os
+import io
+import time
+from PythonSed import Sed
+
+
+INCR_NUM = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '..', 'tests', 'testsuite4', 'incr_num.sed')
+
+def increment(PS, match):
+    return str(int(PS) + 1)
+
+def make_input(n):
+    # numbers with up to 30 trailing 9s
+    return ''.join('%d%s\n' % (i, '9' * (i % 31)) for i in range(n))
+
+def measure(sed, text):
+    program = sed.compile()
+    start = time.perf_counter()
+    output = program.apply(io.StringIO(text), None)
+    return time.perf_counter() - start, output
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    text = make_input(n)
+
+    sed = Sed()
+    sed.load_script(INCR_NUM)
+    elapsed_sed, output_sed = measure(sed, text)
+
+    sed = Sed()
+    sed.register_command('U', increment)
+    sed.load_string('U')
+    elapsed_native, output_native = measure(sed, text)
+
+    if output_native != output_sed:
+        print('Failed: different outputs')
+        sys.exit(1)
+    print('%-12s %10s %10s' % ('lines', 'sed (s)', 'native (s)'))
+    print('%-12d %10.3f %10.3f' % (n, elapsed_sed, elapsed_native))
+
+
+main()
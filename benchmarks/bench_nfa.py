@@ -0,0 +1,70 @@
+"""
+Benchmark of the nfa regexp engine: time of a search as a function of the
+length of the line, with re and nfa engines, for a pattern on which re
+backtracks and for an ordinary one. The time of nfa searches must grow
+linearly.
+
+bench_nfa.py [maximum length]
+"""
+
+import sys
+import io
+import time
+from PythonSed import Sed
+
+
+CASES = (
+    # pattern, line of given length, longest line given to re
+    # the literals of the regexp are in the lines, they are not rejected
+    # before running the regexp
+    (r's/\(a*\)*b/X/', lambda n: 'a' * n + 'cb', 22),
+    (r's/.*x.*y.*z/X/', lambda n: 'z' + 'x' * (n // 2) + 'y' * (n // 2), 2000),
+    (r's/[0-9]\+ms/X/', lambda n: 'served in 12ms ' * (n // 15), 100000),
+)
+
+def measure(script, line, engine):
+    sed = Sed()
+    sed.regexp_engine = engine
+    sed.load_string(script)
+    program = sed.compile()
+    start = time.perf_counter()
+    output = program.apply(io.StringIO(line + '\n'), None)
+    return time.perf_counter() - start, output
+
+def main():
+    maximum = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    print('%-20s %8s %12s %12s' % ('script', 'length', 're (s)', 'nfa (s)'))
+    for script, make_line, re_maximum in CASES:
+        times = []
+        for length in (maximum // 4, maximum // 2, maximum):
+            line = make_line(length)
+            elapsed, output = measure(script, line, 'nfa')
+            times.append(elapsed)
+            if length <= re_maximum:
+                elapsed_re, output_re = measure(script, line, 're')
+                if output != output_re:
+                    print('Failed: different outputs for', script)
+                    sys.exit(1)
+                text_re = '%12.3f' % elapsed_re
+            else:
+                text_re = '%12s' % '-'
+            print('%-20s %8d %s %12.3f' % (script, length, text_re, elapsed))
+        for length in (18, 20, 22):
+            # re is exponential, compare on short lines
+            if re_maximum == 22:
+                line = make_line(length)
+                elapsed_re, output_re = measure(script, line, 're')
+                elapsed, output = measure(script, line, 'nfa')
+                if output != output_re:
+                    print('Failed: different outputs for', script)
+                    sys.exit(1)
+                print('%-20s %8d %12.3f %12.3f' % (script, length, elapsed_re, elapsed))
+        # linear time: 4 times the length must not take much more than 4
+        # times longer
+        if times[2] > 12 * max(times[0], 1e-3):
+            print('Failed: nfa time not linear for', script)
+            sys.exit(1)
+
+
+main()
@@ -0,0 +1,72 @@
+"""
+Benchmark of parsing multi-megabyte generated scripts, all commands on one
+line joined with ';'. Parse time must grow linearly with script size.
+
+bench_parse.py [max size in MB]
+"""
+
+import sys
+import time
+from PythonSed.sed import pack_script, parse_script
+
+
+COMMANDS = (
+    's/foo%d/bar&/g',
+    '/^key%d:/,/end/ { p }',
+    'y/abc/xyz/',
+    '$!N',
+    ':label%d',
+    'b label%d',
+    r's/\(x\)\{1,%d\}/\1/2',
+)
+
+def make_script(size):
+    # one line script of about size bytes
+    commands = []
+    length = 0
+    i = 0
+    while length < size:
+        command = COMMANDS[i % len(COMMANDS)]
+        if '%d' in command:
+            command = command % (i // len(COMMANDS) + 1)
+        commands.append(command)
+        length += len(command) + 1
+        i += 1
+    return [';'.join(commands)], len(commands)
+
+def measure(size):
+    script, ncommands = make_script(size)
+    elapsed = None
+    for _ in range(3):
+        start = time.perf_counter()
+        parse_script(pack_script(script))
+        elapsed = min(elapsed or 1e9, time.perf_counter() - start)
+    return elapsed, ncommands
+
+def main():
+    max_size = float(sys.argv[1]) if len(sys.argv) > 1 else 8
+    max_size = int(max_size * 1e6)
+
+    sizes = []
+    size = max_size
+    while size >= 250000:
+        sizes.insert(0, size)
+        size //= 2
+
+    print('%10s %10s %10s %10s' % ('size (MB)', 'commands', 'parse (s)', 's/MB'))
+    ratios = []
+    for size in sizes:
+        elapsed, ncommands = measure(size)
+        ratios.append(elapsed / size)
+        print('%10.2f %10d %10.3f %10.3f' % (size / 1e6, ncommands, elapsed,
+                                             elapsed / size * 1e6))
+
+    # parsing is linear if time per byte does not depend on size
+    growth = ratios[-1] / ratios[0]
+    print('growth of parse time per byte: %.2f' % growth)
+    if growth > 2:
+        print('Failed: not linear')
+        sys.exit(1)
+
+
+main()
@@ -0,0 +1,68 @@
+"""
+Benchmark of the required-literal prefilter: addresses and substitutions
+whose regexp contains literals which are absent from most lines are
+rejected without running the regexp engine.
+
+bench_prefilter.py [number of lines]
+"""
+
+import sys
+import io
+import time
+import PythonSed.sed
+from PythonSed import Sed
+
+
+SCRIPTS = (
+    '/ERROR.*timeout/p',
+    r'/[a-z]* [0-9]\+ms timeout/p',
+    r's/\([a-z]*\)=\([0-9]*\) timeout/\2=\1/g',
+)
+
+def make_input(nlines):
+    lines = []
+    for i in range(nlines):
+        if i % 100 == 0:
+            lines.append('ERROR request %d failed after 30ms timeout' % i)
+        else:
+            lines.append('INFO request %d served key=%d in %dms ' % (i, i, i % 50) * 4)
+    return '\n'.join(lines) + '\n'
+
+def measure(script, text, prefilter):
+    sed = Sed()
+    sed.no_autoprint = True
+    sed.load_string(script)
+    program = sed.compile()
+    if not prefilter:
+        for command in program.commands:
+            for regexp in (getattr(command.address1, 'regexp', None),
+                           getattr(command, 'regexp', None)):
+                if regexp is not None:
+                    regexp.compile()
+                    regexp.required = ()
+    elapsed = None
+    for _ in range(3):
+        start = time.perf_counter()
+        output = program.apply(io.StringIO(text), None)
+        elapsed = min(elapsed or 1e9, time.perf_counter() - start)
+    return elapsed, output
+
+def main():
+    nlines = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    text = make_input(nlines)
+
+    print('%-45s %12s %12s' % ('script', 'regexp (s)', 'filter (s)'))
+    for script in SCRIPTS:
+        # regexps are shared through the regexp cache, measure without
+        # prefilter first
+        PythonSed.regexp_cache_clear()
+        without, output1 = measure(script, text, False)
+        PythonSed.regexp_cache_clear()
+        with_filter, output2 = measure(script, text, True)
+        if output1 != output2:
+            print('Failed: different outputs for', script)
+            sys.exit(1)
+        print('%-45s %12.3f %12.3f' % (script, without, with_filter))
+
+
+main()
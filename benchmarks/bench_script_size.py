@@ -0,0 +1,76 @@
+"""
+Benchmark of loading large generated scripts: load time and memory per
+command must not grow with the number of commands.
+
+bench_script_size.py [max number of commands]
+"""
+
+import sys
+import time
+import tracemalloc
+from PythonSed import Sed
+
+
+def make_script(size):
+    # translation table like scripts: substitutions and addresses, each
+    # pattern being used several times
+    lines = []
+    for i in range(size // 2):
+        lines.append('s/word%d/other%d/g' % (i % 5000, i))
+        lines.append('/^key%d:/d' % (i % 5000))
+    return lines
+
+def measure(size):
+    script = make_script(size)
+
+    elapsed = None
+    for _ in range(3):
+        sed = Sed()
+        start = time.perf_counter()
+        sed.load_string_list(script)
+        sed.compile()
+        elapsed = min(elapsed or 1e9, time.perf_counter() - start)
+        del sed
+
+    tracemalloc.start()
+    sed = Sed()
+    sed.load_string_list(script)
+    sed.compile()
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed, memory
+
+def main():
+    max_size = int(sys.argv[1]) if len(sys.argv) > 1 else 160000
+
+    sizes = []
+    size = max_size
+    while size >= 10000:
+        sizes.insert(0, size)
+        size //= 2
+
+    print('%10s %10s %12s %12s %12s' % ('commands', 'load (s)', 'us/command',
+                                         'memory (MB)', 'bytes/command'))
+    ratios = []
+    for size in sizes:
+        elapsed, memory = measure(size)
+        ratios.append((elapsed / size, memory / size))
+        print('%10d %10.3f %12.2f %12.1f %12.0f' % (size, elapsed,
+                                                     1e6 * elapsed / size,
+                                                     memory / 1e6,
+                                                     memory / size))
+
+    # growth is linear if cost per command does not grow with size: the
+    # cost per command of the largest script must not exceed the one of the
+    # smallest, with a margin for timing noise
+    time_growth = ratios[-1][0] / ratios[0][0]
+    memory_growth = ratios[-1][1] / ratios[0][1]
+    print('growth of cost per command: time %.2f, memory %.2f' % (time_growth,
+                                                                  memory_growth))
+    if time_growth > 1.1 or memory_growth > 1.0:
+        print('Failed: cost per command grows with script size')
+        sys.exit(1)
+
+
+main()
@@ -0,0 +1,123 @@
+"""
+Benchmark of sed one-liners accumulating lines on large inputs: slurping the
+whole file and joining its lines with N or H, reversing it with G, printing
+a slurped file line by line with P and D, and uniq with a sliding window for
+reference. Accumulating scripts keep the pattern and hold spaces in pieces
+and must run in linear time.
+
+The scripts of tests/testsuite4 using these commands, revlines.sed
+(1!G;h;$p), undblspc.sed (N), indexer.sed ($!N in a loop with P;D) and
+head.sed, are also checked against their expected output and run on inputs
+of the same shape.
+
+bench_segmented.py [number of lines]
+"""
+
+import sys
+import os
+import io
+import time
+from PythonSed import Sed
+
+
+TESTSUITE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         '..', 'tests', 'testsuite4')
+
+
+def make_input(n):
+    return ''.join('line %d of the input\n' % (i // 2) for i in range(n))
+
+def expected_output(name, lines):
+    if name == 'join':
+        return [' '.join(lines)]
+    elif name == 'slurp':
+        return ['+'.join(lines)]
+    elif name == 'collect':
+        return [','.join([''] + lines)]
+    elif name == 'tac':
+        return ['\n'.join(lines[::-1])]
+    elif name == 'window':
+        return lines
+    else:
+        return lines[::2]
+
+SCRIPTS = (
+    ('join', r':a;N;$!ba;s/\n/ /g'),
+    ('slurp', r':a;$!{N;ba};s/\n/+/g'),
+    ('collect', r'H;$!d;x;s/\n/,/g'),
+    ('tac', '1!G;h;$!d'),
+    ('window', r':a;$!{N;ba};P;D'),
+    ('uniq', r'$!N; /^\(.*\)\n\1$/!P; D'),
+)
+
+# inputs of the test suite scripts, scaled to n lines
+SUITE_INPUTS = (
+    ('revlines', lambda i: 'line %d' % i),
+    ('undblspc', lambda i: '' if i % 2 else 'line %d' % i),
+    ('indexer', lambda i: 'Topic %d, as "firstborn"; %d' % (i // 3, i)),
+    ('head', lambda i: 'line %d' % i),
+)
+
+def load_suite_script(name):
+    sed = Sed()
+    flags = os.path.join(TESTSUITE, name + '.flags')
+    if os.path.exists(flags):
+        with open(flags) as f:
+            sed.no_autoprint = '-n' in f.read().split()
+    sed.load_script(os.path.join(TESTSUITE, name + '.sed'))
+    return sed
+
+def measure(script, text):
+    if isinstance(script, Sed):
+        sed = script
+    else:
+        sed = Sed()
+        sed.load_string(script)
+    program = sed.compile()
+    start = time.perf_counter()
+    output = program.apply(io.StringIO(text), None)
+    return time.perf_counter() - start, output
+
+def main():
+    maximum = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+    print('%-8s %10s %10s' % ('script', 'lines', 'time (s)'))
+    for name, script in SCRIPTS:
+        times = []
+        for n in (maximum // 4, maximum):
+            text = make_input(n)
+            elapsed, output = measure(script, text)
+            if output != expected_output(name, text.splitlines()):
+                print('Failed: wrong output for', name)
+                sys.exit(1)
+            times.append(elapsed)
+            print('%-8s %10d %10.3f' % (name, n, elapsed))
+        check_linear(name, times)
+
+    for name, line in SUITE_INPUTS:
+        sed = load_suite_script(name)
+        with open(os.path.join(TESTSUITE, name + '.inp')) as f:
+            text = f.read()
+        with open(os.path.join(TESTSUITE, name + '.good')) as f:
+            good = f.read().splitlines()
+        # output lines are pattern spaces which may contain newlines
+        if '\n'.join(measure(sed, text)[1]).splitlines() != good:
+            print('Failed: wrong output for', name)
+            sys.exit(1)
+        times = []
+        for n in (maximum // 4, maximum):
+            text = ''.join(line(i) + '\n' for i in range(n))
+            elapsed, output = measure(sed, text)
+            times.append(elapsed)
+            print('%-8s %10d %10.3f' % (name, n, elapsed))
+        check_linear(name, times)
+
+def check_linear(name, times):
+    # linear time: 4 times the lines must not take much more than 4 times
+    # longer
+    if times[1] > 12 * max(times[0], 1e-3):
+        print('Failed: time not linear for', name)
+        sys.exit(1)
+
+
+main()
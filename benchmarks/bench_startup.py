@@ -0,0 +1,83 @@
+"""
+Benchmark of startup time: import time of PythonSed measured with python -X
+importtime, and end to end time of `pythonsed -e p` on an empty input, less
+the time of starting python. Fails if a budget is exceeded or if a module
+needed only by the command line or the script cache is imported with
+PythonSed.
+
+bench_startup.py [import budget in ms] [end to end budget in ms]
+"""
+
+import sys
+import subprocess
+import time
+
+
+LAZY_MODULES = ('argparse', 'webbrowser', 'string', 'pickle', 'hashlib', 'copy')
+RUNS = 20
+
+def import_time():
+    # cumulative import time of PythonSed in ms, best of several runs
+    best = None
+    for _ in range(RUNS):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                                 'import PythonSed'],
+                                stderr=subprocess.PIPE, universal_newlines=True)
+        for line in result.stderr.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == 'PythonSed':
+                elapsed = int(fields[1]) / 1000
+                best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def imported_modules():
+    code = 'import sys, PythonSed; print(" ".join(sys.modules))'
+    output = subprocess.check_output([sys.executable, '-c', code],
+                                     universal_newlines=True)
+    return output.split()
+
+def run_time(args):
+    # time in ms of running python with args on an empty input, best of
+    # several runs
+    best = None
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, stdin=subprocess.DEVNULL,
+                       stdout=subprocess.DEVNULL, check=True)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    import_budget = float(sys.argv[1]) if len(sys.argv) > 1 else 8
+    run_budget = float(sys.argv[2]) if len(sys.argv) > 2 else 25
+
+    failed = False
+
+    elapsed = import_time()
+    print('import PythonSed: %.1f ms (budget %.1f ms)' % (elapsed, import_budget))
+    if elapsed > import_budget:
+        print('Failed: import time exceeds budget')
+        failed = True
+
+    modules = imported_modules()
+    eager = [name for name in LAZY_MODULES if name in modules]
+    if eager:
+        print('Failed: modules imported with PythonSed: %s' % ' '.join(eager))
+        failed = True
+
+    python = run_time(['-c', 'pass'])
+    pythonsed = run_time(['-c', 'from PythonSed.sed import main; main()',
+                          '-e', 'p'])
+    print('python: %.1f ms, pythonsed -e p: %.1f ms' % (python, pythonsed))
+    print('startup overhead: %.1f ms (budget %.1f ms)' % (pythonsed - python,
+                                                           run_budget))
+    if pythonsed - python > run_budget:
+        print('Failed: startup time exceeds budget')
+        failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+main()
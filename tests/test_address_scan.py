@@ -0,0 +1,78 @@
+"""
+Test the combined scan of regexp addresses: a script gives the same output
+with and without the scan, including when commands change the pattern space
+between two address tests.
+"""
+
+import sys
+import io
+from PythonSed import Sed
+
+
+SCRIPT = r'''
+/^#/d
+/foo/s/foo/bar/
+/bar/s/$/ (bar)/
+/ERR/Iy/abc/ABC/
+/\(x\)\1/s//<&>/
+/baz/!s/^/- /
+/qux$/{
+s/qux/quux/
+/quux/p
+}
+'''
+INPUT = '''\
+# comment
+foo
+plain
+Err abc
+xx and yy
+baz
+a qux
+'''
+OUTPUT = [
+    '- bar (bar)',
+    '- plain',
+    '- Err ABC',
+    '- <xx> and yy',
+    'baz',
+    '- a quux',
+    '- a quux',
+]
+
+
+def check(condition, code):
+    if not condition:
+        print('Failed. Error code:', code)
+        sys.exit(code)
+
+
+def run(address_scan):
+    sed = Sed()
+    sed.address_scan = address_scan
+    sed.load_string(SCRIPT)
+    with io.StringIO(INPUT) as stream_in:
+        return sed.apply(stream_in, None)
+
+
+def main():
+    check(run(False) == OUTPUT, 1)
+    check(run(True) == OUTPUT, 2)
+
+    # the regexp with a backreference is left out of the scan
+    sed = Sed()
+    sed.address_scan = True
+    sed.load_string(SCRIPT)
+    check('address scan: 7 regexps' in sed.explain(), 3)
+
+    # the program is rebuilt when the flag changes
+    program = sed.compile()
+    sed.address_scan = False
+    check(sed.compile() is not program, 4)
+
+    # ok
+    print('OK')
+    sys.exit(0)
+
+
+main()
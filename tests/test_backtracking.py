@@ -0,0 +1,140 @@
+"""
+Test the analysis of backtracking risks of regexps, the policies applied when
+loading a script, and the time budget of cycles.
+"""
+
+import sys
+import io
+import signal
+import threading
+import warnings
+from PythonSed import Sed, SedException
+from PythonSed.regast import backtracking_risks
+
+
+RISKS = (
+    ('(a+)+', ['nested quantifiers a+ in (a+)+']),
+    ('(a*)*b', ['nested quantifiers a* in (a*)*']),
+    ('(x+x+)+y', ['nested quantifiers x+ in (x+x+)+']),
+    ('(.*,)*', ['nested quantifiers .* in (.*,)*']),
+    ('(a{1,3})*', ['nested quantifiers a{1,3} in (a{1,3})*']),
+    ('(a|ab)*', ['overlapping alternatives in (a|ab)*']),
+    ('([^,]*,)*', []),
+    ('(a*b)*', []),
+    ('(ab|cd)*', []),
+    ('(a{2})*', []),
+    ('[0-9]+(\\.[0-9]+)*', []),
+)
+
+RISKY = 's/\\(a*\\)*b/X/'
+PATHOLOGICAL = 'a' * 26 + 'cb\n'
+
+
+def check(condition, code):
+    if not condition:
+        print('Failed. Error code:', code)
+        sys.exit(code)
+
+
+def load(script, policy, engine='re'):
+    sed = Sed()
+    sed.backtracking_risk = policy
+    sed.regexp_engine = engine
+    sed.load_string(script)
+    return sed
+
+
+def run(script, text, budget):
+    sed = Sed()
+    sed.time_budget = budget
+    sed.load_string(script)
+    with io.StringIO(text) as stream_in:
+        return sed.apply(stream_in, None)
+
+
+def check_host_timer():
+    # the timer and the handler of the host program are kept
+    fired = []
+    def handler(signum, frame):
+        fired.append(signum)
+    previous_handler = signal.signal(signal.SIGALRM, handler)
+    try:
+        signal.setitimer(signal.ITIMER_REAL, 5.0)
+        check(run('s/a/b/', 'a\n' * 1000, 1000) == ['b'] * 1000, 40)
+        delay, _ = signal.getitimer(signal.ITIMER_REAL)
+        check(4.0 < delay <= 5.0, 41)
+        check(signal.getsignal(signal.SIGALRM) is handler and not fired, 42)
+
+        # the handler is not installed while a generator is paused
+        sed = Sed()
+        sed.time_budget = 1000
+        sed.load_string('p')
+        lines = sed.iter_apply(io.StringIO('a\nb\n'))
+        check(next(lines) == 'a', 43)
+        check(signal.getsignal(signal.SIGALRM) is handler, 44)
+        check(list(lines) == ['a', 'b', 'b'], 45)
+
+        # a host timer expiring before the budget is not delayed
+        signal.setitimer(signal.ITIMER_REAL, 0.01)
+        try:
+            run(RISKY, 'a' * 20 + 'cb\n', 1000)
+        except SedException:
+            pass
+        check(fired == [signal.SIGALRM], 46)
+        check(signal.getsignal(signal.SIGALRM) is handler, 47)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+
+def main():
+    for index, (regexp, risks) in enumerate(RISKS):
+        if backtracking_risks(regexp) != risks:
+            print(regexp, backtracking_risks(regexp))
+            check(False, index + 1)
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        load(RISKY, 'ignore')
+        check(not caught, 20)
+        load(RISKY, 'warn')
+        check(len(caught) == 1 and 'nested quantifiers' in str(caught[0].message), 21)
+        # no risk with the nfa engine
+        load(RISKY, 'reject', 'nfa')
+        check(len(caught) == 1, 22)
+
+    try:
+        load(RISKY, 'reject')
+        check(False, 23)
+    except SedException as e:
+        check('command 1' in e.message, 24)
+
+    # a cycle is interrupted during the regexp search
+    check(run('s/a/b/', 'a\n', 1000) == ['b'], 30)
+    try:
+        run('p\n' + RISKY, 'ok\n' + PATHOLOGICAL, 50)
+        check(False, 31)
+    except SedException as e:
+        check('command 2 (s) on line 2' in e.message, 32)
+
+    # outside of the main thread, the budget is checked after each command
+    errors = []
+    def worker():
+        try:
+            run(RISKY, 'a' * 22 + 'cb\n', 1)
+        except SedException as e:
+            errors.append(e.message)
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    check(len(errors) == 1 and 'command 1 (s) on line 1' in errors[0], 33)
+
+    if hasattr(signal, 'setitimer'):
+        check_host_timer()
+
+    # ok
+    print('OK')
+    sys.exit(0)
+
+
+main()
@@ -0,0 +1,86 @@
+"""
+Test sed.compile: a compiled program is applied several times and from several
+threads, each run starting from a fresh state.
+"""
+
+import sys
+import io
+import threading
+from PythonSed import Sed, SedException
+
+
+# range, hold space and empty regexp: all of them keep some state during a run
+SCRIPT = r'''
+/BEGIN/,/END/H
+${
+x
+s/\n/ /g
+s//x/
+p
+}
+d
+'''
+
+def make_input(n):
+    lines = ['line %d' % i for i in range(n)]
+    lines.extend(['BEGIN %d' % n, 'inside %d' % n])
+    return '\n'.join(lines) + '\n'
+
+def expected_output(n):
+    return [' BEGIN %d inside %d' % (n, n)]
+
+
+def run(program, n):
+    with io.StringIO(make_input(n)) as stream_in:
+        return program.apply(stream_in, None)
+
+
+def main():
+    sed = Sed()
+    sed.load_string(SCRIPT)
+    program = sed.compile()
+
+    # range not terminated at end of first run must not leak into second one
+    for n in (3, 4):
+        if run(program, n) != expected_output(n):
+            print('Failed. Error code:', 1)
+            sys.exit(1)
+
+    # program is read-only, and compiling does not modify the commands
+    try:
+        program.first_step = None
+        print('Failed. Error code:', 2)
+        sys.exit(2)
+    except AttributeError:
+        pass
+    sed = Sed()
+    sed.load_string(SCRIPT)
+    indexes = [command.range_index for command in sed.commands]
+    sed.compile()
+    if indexes != [command.range_index for command in sed.commands] or indexes[0] != 0:
+        print('Failed. Error code:', 4)
+        sys.exit(4)
+
+    # concurrent runs of the same program
+    results = dict()
+    def worker(n):
+        results[n] = run(program, n)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(50)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for n in range(50):
+        if results[n] != expected_output(n):
+            print(n, results[n])
+            print('Failed. Error code:', 3)
+            sys.exit(3)
+
+    # ok
+    print('OK')
+    sys.exit(0)
+
+
+main()
@@ -0,0 +1,54 @@
+"""
+Test sed.explain: properties of the script and analysis of regexps.
+"""
+
+import sys
+from PythonSed import Sed
+
+
+def explain(script, extended=False):
+    sed = Sed()
+    sed.regexp_extended = extended
+    sed.load_string(script)
+    return sed.explain()
+
+
+def check(condition, code):
+    if not condition:
+        print('Failed. Error code:', code)
+        sys.exit(code)
+
+
+def main():
+    lines = explain('s/a/b/;/^x/p')
+    check('line independent: yes' in lines, 1)
+    check('streaming: yes' in lines, 2)
+    check("    pattern: 'a' literal 'a'" in lines, 3)
+    check("    address1: '^x' anchored at start, literal 'x'" in lines, 4)
+    check('    fast path: address test inlined' in lines, 5)
+    check('    fast path: pattern searched with str.find' in lines, 13)
+    check('    fast path: address1 searched with str.startswith' in lines, 14)
+
+    lines = explain('$!N;/a\\|b$/h;x')
+    check('$ lookahead (need_last_line): yes' in lines, 6)
+    check('hold space: yes (h, x)' in lines, 7)
+    check('multi-line pattern space: yes (N)' in lines, 8)
+    check('line independent: no (hold space, several lines per cycle, $ address)' in lines, 9)
+    check('streaming: one line lookahead' in lines, 10)
+    check('segmented spaces: no' in lines, 15)
+    check('idiom: no' in lines, 17)
+    check("    address1: 'a|b\\\\Z' regexp" in lines, 11)
+
+    lines = explain(':a;N;$!ba;s/\\n/ /g')
+    check('segmented spaces: yes (N in a loop)' in lines, 16)
+    check("idiom: join lines with ' ', run natively" in lines, 18)
+
+    lines = explain('s/a.b$//', extended=True)
+    check("    pattern: 'a.b\\\\Z' anchored at end, prefilter 'a' 'b'" in lines, 12)
+
+    # ok
+    print('OK')
+    sys.exit(0)
+
+
+main()
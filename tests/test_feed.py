@@ -0,0 +1,163 @@
+"""
+Test sed.feeder: input pushed by chunks of any size gives the output of
+sed.apply, lines are printed as soon as the cycle reading them ends, and one
+line of lookahead is kept when the script tests the last line.
+"""
+
+import sys
+import io
+import os
+import glob
+import random
+from PythonSed import Sed, SedException
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TESTSUITE = os.path.join(HERE, 'testsuite4')
+
+SCRIPTS = (
+    'p',
+    '$!N;P;D',
+    ':a;N;$!ba;s/\\n/,/g',
+    '$!N;/^\\(.*\\)\\n\\1$/!P;D',
+    'n;d',
+    '$p',
+    '/2/,/4/{N;N;s/\\n/+/g}',
+    '3q',
+    '/1/a\\\nappended',
+    '1!G;h;$!d',
+)
+
+TEXT = ''.join('line %d\n' % (i // 3) for i in range(40)) + '\nlast without newline'
+
+
+def check(cond, code):
+    if not cond:
+        print('Failed. Error code:', code)
+        sys.exit(code)
+
+
+def chunks(text, rand, maxsize):
+    index = 0
+    while index < len(text):
+        size = rand.randint(1, maxsize)
+        yield text[index:index + size]
+        index += size
+
+
+def feed(sed, text, rand, maxsize):
+    lines = []
+    feeder = sed.feeder(lines.append)
+    for chunk in chunks(text, rand, maxsize):
+        feeder.feed(chunk)
+    feeder.close()
+    return lines
+
+
+def load(filename):
+    # flags of the test suite: -n and -r
+    sed = Sed()
+    flags = os.path.splitext(filename)[0] + '.flags'
+    if os.path.exists(flags):
+        with open(flags) as f:
+            words = f.read().split()
+        sed.no_autoprint = '-n' in words
+        sed.regexp_extended = '-r' in words
+    sed.load_script(filename)
+    return sed
+
+
+def main():
+    rand = random.Random(0)
+
+    for index, script in enumerate(SCRIPTS):
+        sed = Sed()
+        sed.load_string(script)
+        expected = sed.apply(io.StringIO(TEXT), None)
+        for maxsize in (1, 3, 20, 1000):
+            check(feed(sed, TEXT, rand, maxsize) == expected, 1 + index)
+
+    # scripts of the test suite
+    for filename in sorted(glob.glob(os.path.join(TESTSUITE, '*.sed'))):
+        try:
+            sed = load(filename)
+        except SedException:
+            continue
+        with open(os.path.splitext(filename)[0] + '.inp', encoding='latin-1') as f:
+            text = f.read()
+        expected = sed.apply(io.StringIO(text), None)
+        if feed(sed, text, rand, 30) != expected:
+            print(filename)
+            check(False, 20)
+
+    # output as soon as possible, one line ahead with $
+    for script, ahead in (('s/^/>/', 0), ('$s/^/>/', 1)):
+        sed = Sed()
+        sed.load_string(script)
+        lines = []
+        feeder = sed.feeder(lines.append)
+        feeder.feed('a\nb')
+        check(len(lines) == 1 - ahead, 30 + ahead)
+        feeder.feed('\nc\n')
+        check(len(lines) == 3 - ahead, 32 + ahead)
+        feeder.close()
+        check(len(lines) == 3, 34 + ahead)
+
+    # N waits in the middle of a cycle, its address is not tested again
+    sed = Sed()
+    sed.load_string('/a/,/b/N;s/\\n/-/')
+    lines = []
+    feeder = sed.feeder(lines.append)
+    feeder.feed('a\n')
+    check(lines == [], 40)
+    feeder.feed('b\nx\nb\n')
+    feeder.close()
+    check(lines == ['a-b', 'x-b'], 41)
+
+    # budgets apply to pushed input, the memory is checked after a cycle
+    # waiting for input resumes
+    sed = Sed()
+    sed.time_budget = 1000
+    sed.memory_budget = 100
+    sed.load_string(':a;N;$!ba;s/\\n/,/g')
+    lines = []
+    feeder = sed.feeder(lines.append)
+    for index in range(5):
+        feeder.feed('x%d\n' % index)
+    feeder.close()
+    check(lines == ['x0,x1,x2,x3,x4'] and feeder.peak_space_size == 14, 45)
+    feeder = sed.feeder(lines.append)
+    try:
+        for index in range(100):
+            feeder.feed('line %d\n' % index)
+        check(False, 46)
+    except SedException as e:
+        check('line 14' in e.message, 47)
+
+    # empty input, input after close, q stops the run
+    sed = Sed()
+    sed.load_string('p')
+    lines = []
+    feeder = sed.feeder(lines.append)
+    feeder.close()
+    check(lines == [], 50)
+    try:
+        feeder.feed('a\n')
+        check(False, 51)
+    except SedException:
+        pass
+    sed = Sed()
+    sed.load_string('2q')
+    lines = []
+    feeder = sed.feeder(lines.append)
+    feeder.feed('a\nb\nc\n')
+    feeder.feed('d\n')
+    feeder.close()
+    check(lines == ['a', 'b'], 52)
+
+    # ok
+    print('OK')
+    sys.exit(0)
+
+
+main()
@@ -0,0 +1,128 @@
+"""
+Test the recognition of well-known one-liners and their native run: the
+output is the one of the generic run over the inputs of testsuite4, with and
+without autoprint, and scripts of testsuite4 are not taken for idioms.
+"""
+
+import sys
+import io
+import os
+import glob
+import tempfile
+import contextlib
+from PythonSed import Sed, SedException
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TESTSUITE = os.path.join(HERE, 'testsuite4')
+
+IDIOMS = (
+    # script, extended, idiom
+    (r'$!N; /^\(.*\)\n\1$/!P; D', False, 'uniq'),
+    (r'$!N;/^(.*)\n\1$/!P;D', True, 'uniq'),
+    ('1!G;h;$!d', False, 'tac'),
+    (r':a;N;$!ba;s/\n/ /g', False, "join lines with ' '"),
+    (':loop\nN\n$!b loop\ns/\\n/\\n--\\n/g', False, "join lines with '\\n--\\n'"),
+    ('$=', False, 'line count'),
+    ('$!d', False, 'last line'),
+    ('10q', False, 'head (10 lines)'),
+    ('1q', False, 'head (1 lines)'),
+)
+
+NOT_IDIOMS = (
+    r'$!N;P;D',
+    r'$!N; /^\(.*\)\n\1$/P; D',
+    r':a;N;$!ba;s/\n/&/g',
+    r':a;N;$!ba;s/\n/ /',
+    r':a;N;$!ba;s/\n/ /g;p',
+    '1!G;h;$d',
+    '$p',
+    '$q',
+    '/x/q',
+)
+
+SUITE_IDIOMS = {'head.sed': 'head (10 lines)'}
+
+
+def check(condition, code):
+    if not condition:
+        print('Failed. Error code:', code)
+        sys.exit(code)
+
+
+def load(script, extended=False, no_autoprint=False, idioms=True):
+    sed = Sed()
+    sed.regexp_extended = extended
+    sed.no_autoprint = no_autoprint
+    sed.idioms = idioms
+    sed.load_string(script)
+    return sed
+
+
+def main():
+    inputs = sorted(glob.glob(os.path.join(TESTSUITE, '*.inp')))
+    check(inputs, 1)
+
+    for index, (script, extended, name) in enumerate(IDIOMS):
+        sed = load(script, extended)
+        check(str(sed.idiom) == name, 10 + index)
+        for no_autoprint in (False, True):
+            native = load(script, extended, no_autoprint)
+            generic = load(script, extended, no_autoprint, idioms=False)
+            check(native.compile().idiom is not None, 30 + index)
+            check(generic.compile().idiom is None, 30 + index)
+            for filename in inputs:
+                if native.apply(filename, None) != generic.apply(filename, None):
+                    print(script, no_autoprint, filename)
+                    check(False, 50 + index)
+
+    for index, script in enumerate(NOT_IDIOMS):
+        check(load(script).idiom is None, 70 + index)
+
+    # head.sed is the only idiom of the test suite, some scripts are for
+    # extended regexps
+    for filename in glob.glob(os.path.join(TESTSUITE, '*.sed')):
+        sed = Sed()
+        try:
+            sed.load_script(filename)
+        except SedException:
+            continue
+        expected = SUITE_IDIOMS.get(os.path.basename(filename))
+        if str(sed.idiom) != str(expected):
+            print(filename, sed.idiom)
+            check(False, 80)
+
+    # the idiom is listed by dump_script, the time budget runs the commands
+    sed = load('1!G;h;$!d')
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        sed.dump_script()
+    check(output.getvalue().endswith('idiom: tac\n'), 90)
+    sed.time_budget = 1000
+    check(sed.compile().idiom is None, 91)
+    with io.StringIO('a\nb\n') as stream_in:
+        check(sed.apply(stream_in, None) == ['b\na'], 92)
+    # the program without idiom is kept while the budget is set
+    check(sed.compile() is sed.compile(), 93)
+    sed.time_budget = None
+    sed.memory_budget = 1000
+    program = sed.compile()
+    check(program.idiom is None and sed.compile() is program, 94)
+    sed.memory_budget = None
+    check(sed.compile().idiom is not None, 95)
+
+    # the idiom is saved in the script cache
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for _ in range(2):
+            sed = Sed()
+            sed.cache_dir = cache_dir
+            sed.load_string('$=')
+            check(str(sed.idiom) == 'line count', 96)
+        check(len(os.listdir(cache_dir)) == 1, 97)
+
+    # ok
+    print('OK')
+    sys.exit(0)
+
+
+main()
@@ -0,0 +1,104 @@
+"""
+Test sed.iter_apply and the collect parameter of sed.apply: output lines are
+yielded after each cycle, or printed without being kept.
+"""
+
+import sys
+import io
+import tracemalloc
+from PythonSed import Sed
+
+
+LINES = ['line %d' % (i // 2) for i in range(200)]
+TEXT = '\n'.join(LINES) + '\n'
+
+SCRIPTS = (
+    'p',
+    '$!N;P;D',
+    '1!G;h;$!d',
+    '$!N;/^\\(.*\\)\\n\\1$/!P;D',
+    '/5/a\\\nafter\n/7/i\\\nbefore',
+    '$=',
+    '5q',
+    'n;d',
+    ':a;N;$!ba;s/\\n/,/g',
+)
+
+
+def check(cond, code):
+    if not cond:
+        print('Failed. Error code:', code)
+        sys.exit(code)
+
+
+class CountingInput:
+    # file-like object counting the lines read
+    def __init__(self):
+        self.count = 0
+
+    def readline(self):
+        self.count += 1
+        return 'line %d\n' % self.count
+
+
+class NullOutput:
+    def write(self, text):
+        pass
+
+
+def main():
+    # same lines as apply, with or without idioms
+    for index, script in enumerate(SCRIPTS):
+        for idioms in (True, False):
+            sed = Sed()
+            sed.idioms = idioms
+            sed.load_string(script)
+            expected = sed.apply(io.StringIO(TEXT), None)
+            check(list(sed.iter_apply(io.StringIO(TEXT))) == expected, 1 + index)
+            check(list(sed.compile().iter_apply(io.StringIO(TEXT))) == expected, 1 + index)
+
+    # lines are yielded as soon as their cycle ends: the input may be endless
+    sed = Sed()
+    sed.load_string('s/line/LINE/')
+    source = CountingInput()
+    lines = sed.iter_apply(source)
+    check([next(lines) for _ in range(3)] == ['LINE 1', 'LINE 2', 'LINE 3'], 20)
+    check(source.count == 3, 21)
+    lines.close()
+
+    # lines are returned when they are not printed or when asked for
+    sed = Sed()
+    sed.load_string('p')
+    check(sed.apply(io.StringIO('a\n'), None) == ['a', 'a'], 30)
+    check(sed.apply(io.StringIO('a\n'), None, collect=False) is None, 31)
+    output = io.StringIO()
+    check(sed.apply(io.StringIO('a\n'), output) is None, 32)
+    check(output.getvalue() == 'a\na\n', 33)
+    output = io.StringIO()
+    check(sed.apply(io.StringIO('a\n'), output, collect=True) == ['a', 'a'], 34)
+    check(output.getvalue() == 'a\na\n', 35)
+
+    # memory does not grow with the output when lines are not kept
+    text = 'some line of text\n' * 100000
+    for run, code in ((lambda source: sed.apply(source, NullOutput()), 40),
+                      (lambda source: sum(1 for _ in sed.iter_apply(source)), 41)):
+        source = io.StringIO(text)
+        tracemalloc.start()
+        run(source)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        check(peak < 100000, code)
+
+    # peak size of the spaces after iteration
+    sed = Sed()
+    sed.memory_budget = 10000
+    sed.load_string('H;$!d;x')
+    check(len(list(sed.iter_apply(io.StringIO(TEXT)))) == 1, 50)
+    check(sed.peak_space_size == len(TEXT) + len(LINES[-1]), 51)
+
+    # ok
+    print('OK')
+    sys.exit(0)
+
+
+main()
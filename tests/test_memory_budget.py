@@ -0,0 +1,109 @@
+"""
+Test sed.memory_budget: the size of the pattern and hold spaces is bounded,
+the command exceeding the budget is named and the peak size is available
+after the run.
+"""
+
+import sys
+import io
+from PythonSed import Sed, SedException
+from PythonSed.sed import parse_size
+
+
+LINES = ['line %d of the input' % i for i in range(2000)]
+TEXT = '\n'.join(LINES) + '\n'
+
+
+def check(cond, code):
+    if not cond:
+        print('Failed. Error code:', code)
+        sys.exit(code)
+
+
+def run(script, budget, text=TEXT, sed=None):
+    if sed is None:
+        sed = Sed()
+    sed.memory_budget = budget
+    sed.load_string(script)
+    with io.StringIO(text) as stream_in:
+        try:
+            return sed, sed.apply(stream_in, None), None
+        except SedException as e:
+            return sed, None, e.message
+
+
+def main():
+    joined = len(TEXT) - 1
+
+    # no budget: no peak
+    sed, output, error = run(':a;N;$!ba;s/\\n/ /g', None)
+    check(error is None and sed.peak_space_size is None, 1)
+
+    # large enough budget: same output, peak is the size of the joined lines,
+    # the idiom is not run natively
+    sed, output, error = run(':a;N;$!ba;s/\\n/ /g', joined)
+    check(error is None and output == [' '.join(LINES)], 2)
+    check(sed.peak_space_size == joined, 3)
+    check(sed.compile().idiom is None, 4)
+
+    # budget exceeded by N, the command and the line are named
+    sed, output, error = run(':a;N;$!ba;s/\\n/ /g', joined - 1)
+    check(output is None and 'command 2 (N)' in error and 'line 2000' in error, 5)
+    check(sed.peak_space_size == joined, 6)
+
+    # hold space: H then x, and G then h
+    sed, output, error = run('H;$!d;x', 10000)
+    check(output is None and '(H)' in error, 7)
+    check(sed.peak_space_size > 10000, 8)
+    sed, output, error = run('1!G;h;$!d', 10 ** 6)
+    check(error is None and output == ['\n'.join(reversed(LINES))], 9)
+    check(sed.peak_space_size == 2 * joined, 10)
+    sed, output, error = run('1!G;h;$!d', 2 * joined - 1)
+    check(output is None and '(h)' in error, 11)
+
+    # s enlarging the pattern space in a loop
+    sed, output, error = run(':a;s/x*/&&x/;ta', 1000, 'line\n')
+    check(output is None and '(s)' in error and 'line 1' in error, 12)
+    check(sed.peak_space_size in range(1001, 2003), 13)
+
+    # line read at the start of a cycle
+    sed, output, error = run('p', 10, 'short\nmuch longer line\n')
+    check(output is None and 'reading on line 2' in error, 14)
+    check(sed.peak_space_size == 16, 15)
+
+    # command registered as python function
+    sed = Sed()
+    sed.register_command('U', lambda PS, match: PS * 1000)
+    sed, output, error = run('U', 1000, 'line\n', sed)
+    check(output is None and 'command 1 (U)' in error, 16)
+
+    # same peak for a script keeping the pattern space in chunks and the
+    # plain one
+    sed, output, error = run(':a;$!{N;ba};s/\\n/ /g', joined)
+    check(error is None and sed.peak_space_size == joined, 17)
+    sed, output, error = run('$!N;P;D', 100)
+    check(error is None and sed.peak_space_size == 2 * len(LINES[-1]) + 1, 18)
+
+    # a program is rebuilt when the budget changes
+    sed = Sed()
+    sed.load_string(':a;N;$!ba')
+    program = sed.compile()
+    sed.memory_budget = 100
+    check(sed.compile() is not program and sed.compile().memory_budget == 100, 19)
+
+    # sizes on the command line
+    check(parse_size('100') == 100, 20)
+    check(parse_size('2k') == 2048 and parse_size('3M') == 3 << 20, 21)
+    check(parse_size('1G') == 1 << 30, 22)
+    try:
+        parse_size('1T')
+        check(False, 23)
+    except Exception as e:
+        check('invalid size' in str(e), 23)
+
+    # ok
+    print('OK')
+    sys.exit(0)
+
+
+main()
@@ -0,0 +1,156 @@
+"""
+Test the python functions registered as commands or as replacements of s
+commands: same output as the sed idioms they replace, integration with t and
+with empty regexps, and listing by dump_script.
+"""
+
+import sys
+import io
+import os
+import tempfile
+import contextlib
+from PythonSed import Sed, SedException
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+INCR_NUM = os.path.join(HERE, 'testsuite4', 'incr_num.sed')
+
+# U increments the number in the pattern space, then a line with 10 as last
+# digits is marked
+SCRIPT_NATIVE = r'''
+/^[0-9]\+$/!b
+U
+t carry
+b
+:carry
+/0$/s/$/ (10)/
+'''
+
+# numbers doubled by a python function, t branches if one has been replaced
+SCRIPT_HOOK = r'''
+s/[0-9]\+/x/g
+tdone
+s/^/no number: /
+b
+:done
+s/$/ (doubled)/
+'''
+
+
+def check(condition, code):
+    if not condition:
+        print('Failed. Error code:', code)
+        sys.exit(code)
+
+
+def increment(PS, match):
+    return str(int(PS) + 1)
+
+
+def double(PS, match):
+    return str(2 * int(match.group()))
+
+
+def run(sed, text):
+    with io.StringIO(text) as stream_in:
+        return sed.apply(stream_in, None)
+
+
+def main():
+    numbers = '0\n9\n199\n41\n999999\n'
+
+    # native command replacing the whole incr_num.sed idiom
+    sed = Sed()
+    sed.load_script(INCR_NUM)
+    expected = run(sed, numbers)
+    sed = Sed()
+    sed.register_command('U', increment)
+    sed.load_string('U')
+    check(run(sed, numbers) == expected, 1)
+
+    # a change of the pattern space is seen by t, the address match is given
+    sed = Sed()
+    sed.register_command('U', increment)
+    sed.load_string(SCRIPT_NATIVE)
+    check(run(sed, '9\nabc\n41\n') == ['10 (10)', 'abc', '42'], 2)
+
+    matches = []
+    def record(PS, match):
+        matches.append(match.group(1) if match else None)
+    sed = Sed()
+    sed.register_command('R', record)
+    sed.load_string('/\\(b\\)/R\nR\ns/b/c/\nR\n/c/{\nx\nR\nx\n}')
+    check(run(sed, 'abc\n') == ['acc'], 3)
+    # the last match is given while the pattern space is unchanged
+    check(matches == ['b', 'b', None, None], 4)
+
+    # replacement hook
+    sed = Sed()
+    sed.register_replacement(1, double)
+    sed.load_string(SCRIPT_HOOK)
+    check(run(sed, '1 and 21\nnone\n') ==
+          ['2 and 42 (doubled)', 'no number: none'], 5)
+
+    # count and empty regexp reusing the match of the address
+    sed = Sed()
+    sed.register_replacement(1, lambda PS, match: match.group().upper())
+    sed.load_string('/o/s//0/2')
+    check(run(sed, 'foo boo\nbar\n') == ['foO boo', 'bar'], 6)
+
+    # the hooked command is not fused with the literal ones around it
+    sed = Sed()
+    sed.register_replacement(2, lambda PS, match: '<%s>' % match.group())
+    sed.load_string('s/a/b/g\ns/c/d/g\ns/e/f/g')
+    check(run(sed, 'ace\n') == ['b<c>f'], 7)
+
+    # dump_script lists the functions
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        sed.dump_script()
+    check('<python <lambda>>' in output.getvalue(), 8)
+    sed = Sed()
+    sed.register_command('U', increment)
+    sed.load_string('U')
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        sed.dump_script()
+    check('|U|<python increment>' in output.getvalue(), 9)
+
+    # errors
+    # s is a sed command, I is the flag of regexp addresses
+    for name, function in (('s', increment), ('I', increment),
+                           ('UP', increment), ('1', increment), ('U', None)):
+        try:
+            Sed().register_command(name, function)
+            check(False, 10)
+        except SedException:
+            pass
+    try:
+        sed = Sed()
+        sed.register_replacement(2, double)
+        sed.load_string('s/a/b/\np')
+        check(False, 11)
+    except SedException:
+        pass
+    try:
+        sed = Sed()
+        sed.load_string('U')
+        check(False, 12)
+    except SedException:
+        pass
+
+    # scripts with python functions are not saved in the script cache
+    with tempfile.TemporaryDirectory() as cache_dir:
+        sed = Sed()
+        sed.cache_dir = cache_dir
+        sed.register_command('U', increment)
+        sed.load_string('U')
+        check(run(sed, '1\n') == ['2'], 13)
+        check(os.listdir(cache_dir) == [], 14)
+
+    # ok
+    print('OK')
+    sys.exit(0)
+
+
+main()
@@ -0,0 +1,98 @@
+"""
+Test the nfa regexp engine: same matches and groups as re, time linear in
+the length of the string, selection by script and by command, and fallback
+to re for backreferences.
+"""
+
+import sys
+import io
+import re
+import time
+from PythonSed import Sed
+from PythonSed.nfa import NFAPattern, NFAError
+
+
+PATTERNS = (
+    ('a(b|c)*d', 'xxabcbdyy'),
+    ('(a|ab)(c|bcd)(d*)', 'abcd'),
+    ('(a*)*b', 'aaab'),
+    ('(?:(\\s|))+', ' \nB'),
+    ('(a|b|)*', 'abab'),
+    ('x{2,3}?y', 'xxxxy'),
+    ('\\bfoo\\b', 'a foobar foo'),
+    ('^a|b\\Z', 'cab'),
+    ('[^a-c]+', 'abcdefabc'),
+    ('(?i:AB)c', 'xabc'),
+)
+
+
+def check(condition, code):
+    if not condition:
+        print('Failed. Error code:', code)
+        sys.exit(code)
+
+
+def spans(m, groups):
+    if m is None:
+        return None
+    return [m.span(group) for group in range(groups + 1)]
+
+
+def run(script, text, engine, by_command=None):
+    sed = Sed()
+    sed.regexp_engine = engine
+    if by_command:
+        sed.regexp_engine_by_command = by_command
+    sed.load_string(script)
+    with io.StringIO(text) as stream_in:
+        return sed.apply(stream_in, None), sed
+
+
+def main():
+    for index, (pattern, string) in enumerate(PATTERNS):
+        compiled = re.compile(pattern, re.DOTALL)
+        nfa = NFAPattern(pattern, re.DOTALL)
+        check(spans(nfa.search(string), compiled.groups) ==
+              spans(compiled.search(string), compiled.groups), index + 1)
+        check([m.span() for m in nfa.finditer(string)] ==
+              [m.span() for m in compiled.finditer(string)], index + 21)
+
+    try:
+        NFAPattern('(a)\\1')
+        check(False, 41)
+    except NFAError:
+        pass
+
+    # exponential with re
+    start = time.perf_counter()
+    check(NFAPattern('(a*)*b').search('a' * 5000 + 'c') is None, 42)
+    check(time.perf_counter() - start < 5, 43)
+
+    script = 's/\\(x\\+\\)*y/[\\1]/g\n/\\(a\\)\\1/s//<&>/'
+    text = 'xxy xy\naa\n'
+    expected = ['[xx] [x]', '<aa>']
+    output, sed = run(script, text, 're')
+    check(output == expected, 44)
+    output, sed = run(script, text, 'nfa')
+    check(output == expected, 45)
+    lines = sed.explain()
+    check(any(line.endswith('nfa engine') for line in lines), 46)
+    check(any('re engine (literal or backreferences)' in line for line in lines), 47)
+
+    # one command only
+    output, sed = run(script, text, 're', {1: 'nfa'})
+    check(output == expected, 48)
+    check(sum(line.endswith('nfa engine') for line in sed.explain()) == 1, 49)
+
+    try:
+        run(script, text, 'dfa')
+        check(False, 50)
+    except Exception:
+        pass
+
+    # ok
+    print('OK')
+    sys.exit(0)
+
+
+main()
@@ -0,0 +1,75 @@
+"""
+Test the required literals of regexps, computed with regast, and the results
+of sed when regexps are prefiltered with them.
+"""
+
+import sys
+import io
+from PythonSed import Sed
+from PythonSed.regast import required_literals
+
+
+LITERALS = (
+    ('ERROR.*timeout', ['timeout', 'ERROR']),
+    ('a(bc)d', ['abcd']),
+    ('a(b|c)d', ['a', 'd']),
+    ('(abc)+x', ['abc', 'x']),
+    ('x{2}yz', ['yz', 'x']),
+    ('x{0,2}yz', ['yz']),
+    ('^foo$', ['foo']),
+    ('[]a]bc', ['bc']),
+    ('[^]a]bc', ['bc']),
+    ('a\\.b\\nc', ['a.b\nc']),
+    ('ab|cd', []),
+    ('(ab|cd)e', ['e']),
+    ('a(b|c)?d', ['a', 'd']),
+    ('ab\\1c', ['ab', 'c']),
+)
+
+SCRIPT = r'''
+/ERROR.*timeout/s/\([0-9]\+\)ms/<\1>/
+/x\(y\|z\)*w/d
+s/k\(ey\)\{1,\}=/K=/g
+'''
+INPUT = '''\
+ERROR after 30ms timeout
+ERROR after 30ms
+timeout 30ms
+xyzw
+xw
+xyw extra
+xaw
+key=1 keyey=2 k=3
+'''
+OUTPUT = [
+    'ERROR after <30> timeout',
+    'ERROR after 30ms',
+    'timeout 30ms',
+    'xaw',
+    'K=1 K=2 k=3',
+]
+
+
+def check(condition, code):
+    if not condition:
+        print('Failed. Error code:', code)
+        sys.exit(code)
+
+
+def main():
+    for index, (regexp, literals) in enumerate(LITERALS):
+        if required_literals(regexp) != literals:
+            print(regexp, required_literals(regexp))
+            check(False, index + 1)
+
+    sed = Sed()
+    sed.load_string(SCRIPT)
+    with io.StringIO(INPUT) as stream_in:
+        check(sed.apply(stream_in, None) == OUTPUT, 100)
+
+    # ok
+    print('OK')
+    sys.exit(0)
+
+
+main()
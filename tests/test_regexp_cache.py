@@ -0,0 +1,73 @@
+"""
+Test the regexp cache: identical regexps are shared by Sed instances and the
+cache is bounded.
+"""
+
+import sys
+import io
+import PythonSed
+from PythonSed import Sed
+
+
+def run(script, text, extended=False):
+    sed = Sed()
+    sed.regexp_extended = extended
+    sed.load_string(script)
+    with io.StringIO(text) as stream_in:
+        return sed.apply(stream_in, None)
+
+
+def check(condition, code):
+    if not condition:
+        print('Failed. Error code:', code)
+        sys.exit(code)
+
+
+def main():
+    PythonSed.regexp_cache_clear()
+    info = PythonSed.regexp_cache_info()
+    check(info.hits == 0 and info.misses == 0 and info.currsize == 0, 1)
+
+    # first script: one miss per distinct regexp, identical ones inside a
+    # script are shared
+    check(run('/a+b/s/a+b/x/;s/c/y/I', 'aab c\n') == ['aab y'], 2)
+    info = PythonSed.regexp_cache_info()
+    check(info.misses == 2 and info.currsize == 2, 3)
+
+    # second instance reuses the regexps of the first one
+    check(run('s/a+b/z/', 'a+b\n') == ['z'], 4)
+    check(PythonSed.regexp_cache_info().hits == 1, 5)
+
+    # keys include extended and ignore_case
+    check(run('s/a+b/z/', 'aab\n', extended=True) == ['z'], 6)
+    check(run('s/C/y/', 'c\n') == ['c'], 7)
+    info = PythonSed.regexp_cache_info()
+    check(info.hits == 1 and info.misses == 4, 8)
+
+    # bounded size, least recently used regexps are dropped first
+    PythonSed.set_regexp_cache_size(2)
+    check(PythonSed.regexp_cache_info().currsize == 2, 9)
+    run('s/1/x/;s/2/x/;s/3/x/', '123\n')
+    check(PythonSed.regexp_cache_info().currsize == 2, 10)
+    PythonSed.regexp_cache_clear()
+    run('s/1/x/', '1\n')
+    run('s/2/x/', '2\n')
+    run('s/1/x/', '1\n')
+    run('s/3/x/', '3\n')
+    run('s/1/x/', '1\n')
+    info = PythonSed.regexp_cache_info()
+    check(info.hits == 2 and info.misses == 3, 11)
+
+    # disabled cache
+    PythonSed.set_regexp_cache_size(0)
+    run('s/1/x/', '1\n')
+    check(PythonSed.regexp_cache_info().currsize == 0, 12)
+    check(run('s/1/x/', '1\n') == ['x'], 13)
+    PythonSed.set_regexp_cache_size(1024)
+
+    # ok
+    print('OK')
+    sys.exit(0)
+
+
+main()
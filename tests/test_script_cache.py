@@ -0,0 +1,124 @@
+"""
+Test the cache of parsed scripts: a script found in cache is not parsed again
+and gives the same result.
+"""
+
+import sys
+import os
+import io
+import shutil
+import tempfile
+import PythonSed.sed
+import PythonSed.regast
+import PythonSed.nfa
+from PythonSed import Sed
+
+
+# labels, branches, ranges, blocks, empty regexp and write file
+SCRIPT = r'''
+:a
+/BEGIN/,/END/{
+    s/x\(y*\)/<\1>/g
+    s//[&]/
+    w %s
+}
+$!{N;b a}
+y/abc/ABC/
+'''
+INPUT_STRING = 'abc\nBEGIN xyy xy\nEND\nc\n'
+
+
+def run(cache_dir, script, no_autoprint=False):
+    sed = Sed()
+    sed.cache_dir = cache_dir
+    sed.no_autoprint = no_autoprint
+    sed.load_string(script)
+    with io.StringIO(INPUT_STRING) as stream_in:
+        return sed.apply(stream_in, None)
+
+
+def check(condition, code):
+    if not condition:
+        print('Failed. Error code:', code)
+        sys.exit(code)
+
+
+def main():
+    cache_dir = tempfile.mkdtemp()
+    write_filename = os.path.join(cache_dir, 'written.txt')
+    script = SCRIPT % write_filename
+    try:
+        expected = run(None, script)
+
+        # cold start: the script is parsed and saved in cache
+        check(run(cache_dir, script) == expected, 1)
+        check(len(os.listdir(cache_dir)) == 2, 2)
+
+        # warm start: the script is not parsed again, write files are
+        # created again
+        os.remove(write_filename)
+        parse_script = PythonSed.sed.parse_script
+        def no_parse(script):
+            raise Exception('script parsed')
+        PythonSed.sed.parse_script = no_parse
+        try:
+            check(run(cache_dir, script) == expected, 3)
+        finally:
+            PythonSed.sed.parse_script = parse_script
+        check(os.path.isfile(write_filename), 4)
+
+        # flags are part of the key
+        run(cache_dir, script, no_autoprint=True)
+        check(len(os.listdir(cache_dir)) == 3, 5)
+
+        # a corrupted cache file is ignored and replaced
+        for filename in os.listdir(cache_dir):
+            if filename.endswith('.pickle'):
+                with open(os.path.join(cache_dir, filename), 'wb') as f:
+                    f.write(b'garbage')
+        check(run(cache_dir, script) == expected, 6)
+
+        # the key depends on the modules used by the parsed commands
+        sed = Sed()
+        sed.cache_dir = cache_dir
+        lines = script.splitlines()
+        filename = sed.script_cache_file(lines)
+        for module in (PythonSed.regast, PythonSed.nfa):
+            stat = os.stat(module.__file__)
+            os.utime(module.__file__, (stat.st_atime, stat.st_mtime + 1))
+            try:
+                check(sed.script_cache_file(lines) != filename, 7)
+            finally:
+                os.utime(module.__file__, (stat.st_atime, stat.st_mtime))
+        check(sed.script_cache_file(lines) == filename, 8)
+
+        # cache files and directories writable by others are not used
+        parsed = []
+        def counting_parse(script, natives=None):
+            parsed.append(script)
+            return parse_script(script, natives)
+        PythonSed.sed.parse_script = counting_parse
+        try:
+            check(run(cache_dir, script) == expected and not parsed, 9)
+            for filename in os.listdir(cache_dir):
+                if filename.endswith('.pickle'):
+                    os.chmod(os.path.join(cache_dir, filename), 0o666)
+            check(run(cache_dir, script) == expected and len(parsed) == 1, 10)
+            os.chmod(cache_dir, 0o777)
+            count = len(os.listdir(cache_dir))
+            check(run(cache_dir, script) == expected and len(parsed) == 2, 11)
+            check(run(cache_dir, script, no_autoprint=True) == [] and
+                  len(os.listdir(cache_dir)) == count, 12)
+        finally:
+            PythonSed.sed.parse_script = parse_script
+            os.chmod(cache_dir, 0o700)
+
+    finally:
+        shutil.rmtree(cache_dir)
+
+    # ok
+    print('OK')
+    sys.exit(0)
+
+
+main()
@@ -0,0 +1,134 @@
+"""
+Test the pattern and hold spaces kept in pieces by scripts accumulating lines
+with N, H or G: same output as with plain strings for accumulating, sliding
+window and line deleting scripts, including when PS is in pieces for P and D,
+and sharing of pieces by h, g and x.
+"""
+
+import sys
+import io
+from PythonSed import Sed
+from PythonSed.sed import Context, SegmentedContext
+import PythonSed.sed as sed_module
+
+
+CASES = (
+    # script, segmented context expected
+    (r':a;N;$!ba;s/\n/ /g', True),
+    (r':a;$!{N;ba};s/\n/+/g', True),
+    (':a\n$!N\ns/\\n/ /\nta', True),
+    # whole file in PS, then printed line by line by P and D, one line out
+    # of two for the second one
+    (r':a;$!{N;ba};P;D', True),
+    (r':a;$!{N;ba};s/^[^\n]*\n//;P;D', True),
+    # tac, whole file and paragraphs collected in hold space
+    ('1!G;h;$!d', True),
+    (r'H;$!d;x;s/\n/,/g', True),
+    (r'1h;1!H;$!d;g;s/\n/|/g', True),
+    (r'/./{H;$!d};x;s/\n/ /g', True),
+    (r'$!{h;d};x;G', True),
+    # uniq and sliding windows are not loops
+    (r'$!N; /^\(.*\)\n\1$/!P; D', False),
+    (r'$!N;P;D', False),
+    (r'1{N;N};$!{N;D}', False),
+)
+
+INPUT = ''.join('line %d\n' % (i // 2) for i in range(200)) + '\nlast\n'
+
+
+class JoinCountingContext(SegmentedContext):
+    # counts the joins of chunks into a string
+    joins = 0
+
+    @property
+    def PS(self):
+        if self.chunks is not None:
+            self.joins += 1
+        return SegmentedContext.PS.fget(self)
+
+    @PS.setter
+    def PS(self, value):
+        SegmentedContext.PS.fset(self, value)
+
+
+def check(condition, code):
+    if not condition:
+        print('Failed. Error code:', code)
+        sys.exit(code)
+
+
+def compile_script(script):
+    sed = Sed()
+    sed.load_string(script)
+    return sed.compile()
+
+
+def run(program, context_class):
+    with io.StringIO(INPUT) as stream_in:
+        return context_class(program).apply(stream_in, None)
+
+
+def main():
+    lines = INPUT.splitlines()
+    segment_size = sed_module.SEGMENT_SIZE
+    for index, (script, segmented) in enumerate(CASES):
+        program = compile_script(script)
+        check((program.context_class is SegmentedContext) == segmented, 1 + index)
+        expected = run(program, Context)
+        check(run(program, SegmentedContext) == expected, 20 + index)
+        # chunks from the first N
+        sed_module.SEGMENT_SIZE = 0
+        try:
+            check(run(program, SegmentedContext) == expected, 40 + index)
+        finally:
+            sed_module.SEGMENT_SIZE = segment_size
+
+    check(run(compile_script(CASES[0][0]), SegmentedContext) == [' '.join(lines)], 60)
+    check(run(compile_script(CASES[3][0]), SegmentedContext) == lines, 61)
+    check(run(compile_script(CASES[4][0]), SegmentedContext) == lines[1::2], 62)
+    check(run(compile_script(CASES[5][0]), SegmentedContext) ==
+          ['\n'.join(lines[::-1])], 63)
+
+    # D and P on ropes made by G and H, pieces shared by h, g and x
+    sed_module.SEGMENT_SIZE = 0
+    try:
+        ctx = SegmentedContext(compile_script('p'))
+        ctx.PS = 'a'
+        ctx.copy_to_hold()
+        ctx.PS = 'b\nc'
+        ctx.append_to_hold()
+        ctx.append_hold()
+        check(ctx.first_line() == 'b', 70)
+        ctx.exchange()
+        check(ctx.first_line() == 'a', 71)
+        check(ctx.delete_first_line(), 72)
+        check(ctx.first_line() == 'b', 73)
+        ctx.append_line('d')
+        check(ctx.PS == 'b\nc\nd', 74)
+        ctx.exchange()
+        check(ctx.PS == 'b\nc\na\nb\nc', 75)
+        check(str(ctx.HS) == 'b\nc\nd', 76)
+        ctx.PS = ctx.HS
+        check(ctx.delete_first_line() and ctx.delete_first_line(), 77)
+        check(not ctx.delete_first_line() and ctx.PS == 'd', 78)
+
+        # cycles restarted by D do not join the chunks, a single line left
+        # has no newline to delete
+        ctx = JoinCountingContext(compile_script(CASES[3][0]))
+        with io.StringIO(INPUT) as stream_in:
+            check(ctx.apply(stream_in, None) == lines, 80)
+        check(ctx.joins == 0, 81)
+        ctx = SegmentedContext(compile_script('p'))
+        ctx.PS = 'a'
+        ctx.append_line('b')
+        check(ctx.chunks is not None and ctx.delete_first_line(), 82)
+        check(not ctx.delete_first_line() and ctx.first_line() == 'b', 83)
+    finally:
+        sed_module.SEGMENT_SIZE = segment_size
+
+    # ok
+    print('OK')
+    sys.exit(0)
+
+
+main()